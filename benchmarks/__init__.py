@@ -0,0 +1,7 @@
+"""
+Benchmarks for momi, using airspeed velocity (asv).
+
+See asv.conf.json in the top level directory for how to run them.
+All data are simulated with msprime when the benchmarks are set up,
+so no network access or external datasets are needed.
+"""
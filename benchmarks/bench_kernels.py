@@ -0,0 +1,83 @@
+"""
+Benchmarks for the low level numerical kernels.
+"""
+import numpy as np
+import autograd
+
+from momi.einsum2 import batched_dot, set_batched_dot_backend
+from momi.einsum2.parallel_matmul import _par_matmul
+from momi.math_functions import convolve_sum_axes, set_convolution_method
+from momi.moran_model import moran_action, set_action_method
+from momi import w_matrix
+
+
+class ConvolveSumAxes(object):
+    params = (["direct", "blas", "fft"], [10, 100, 500], [1, 20])
+    param_names = ["method", "n", "n_reduce"]
+
+    def setup(self, method, n, n_reduce):
+        rgen = np.random.RandomState(1)
+        n_configs = 100 if n_reduce == 1 else 1
+        self.A = rgen.uniform(size=(n_configs, 1, n + 1, n_reduce))
+        self.B = rgen.uniform(size=(n_configs, 1, n + 1, n_reduce))
+        self.G = rgen.normal(size=(n_configs, 1, 1, 2 * n + 1))
+        set_convolution_method(method)
+
+    def teardown(self, method, n, n_reduce):
+        set_convolution_method("auto")
+
+    def time_convolve_sum_axes(self, method, n, n_reduce):
+        convolve_sum_axes(self.A, self.B)
+
+    def time_convolve_sum_axes_grad(self, method, n, n_reduce):
+        autograd.grad(lambda A: autograd.numpy.sum(
+            self.G * convolve_sum_axes(A, self.B)))(self.A)
+
+
+class BatchedDot(object):
+    params = (["parallel", "matmul"], [(1000, 3, 3, 3), (100, 20, 20, 20),
+                                       (10, 200, 200, 200)])
+    param_names = ["backend", "shape"]
+
+    def setup(self, backend, shape):
+        I, J, K, L = shape
+        rgen = np.random.RandomState(1)
+        self.A = rgen.normal(size=(I, J, K))
+        self.B = rgen.normal(size=(I, K, L))
+        set_batched_dot_backend(backend)
+
+    def teardown(self, backend, shape):
+        set_batched_dot_backend("auto")
+
+    def time_batched_dot(self, backend, shape):
+        batched_dot(self.A, self.B)
+
+    def time_par_matmul(self, backend, shape):
+        _par_matmul(self.A, self.B)
+
+
+class Wmatrix(object):
+    params = [10, 100, 1000]
+    param_names = ["n"]
+
+    def time_wmatrix(self, n):
+        # bypass the lru_cache
+        w_matrix.Wmatrix.__wrapped__(n)
+
+    def peakmem_wmatrix(self, n):
+        w_matrix.Wmatrix.__wrapped__(n)
+
+
+class MoranAction(object):
+    params = (["eigen", "expm_multiply"], [10, 100, 500], [.001, .1])
+    param_names = ["method", "n", "t"]
+
+    def setup(self, method, n, t):
+        self.v = np.random.RandomState(1).uniform(size=(1000, n + 1))
+        set_action_method(method)
+
+    def teardown(self, method, n, t):
+        set_action_method("auto")
+
+    def time_moran_action(self, method, n, t):
+        moran_action(t, self.v, axis=-1)
@@ -0,0 +1,69 @@
+"""
+End to end benchmarks of the expected SFS and the likelihood,
+on data simulated with Demography.simulate_data.
+"""
+import autograd
+import autograd.numpy as np
+
+import momi
+from momi import SfsLikelihoodSurface
+
+from .common import EVENT_TYPES, n_params, build_model, simulate_sfs
+
+
+class ExpectedSfs(object):
+    params = ([1, 2, 4], [5, 20, 50], list(EVENT_TYPES))
+    param_names = ["n_demes", "n_per_deme", "event"]
+    timeout = 300
+
+    def setup(self, n_demes, n_per_deme, event):
+        self.x = .1 * np.random.RandomState(1).normal(
+            size=n_params(n_demes, event))
+        model = build_model(self.x, n_demes, event)
+        self.configs = simulate_sfs(model, n_per_deme, 100).configs
+        self.sampled_n_dict = dict(zip(self.configs.sampled_pops,
+                                       self.configs.sampled_n))
+
+    def _log_sfs(self, x, n_demes, event):
+        demo = build_model(x, n_demes, event)._get_demo(self.sampled_n_dict)
+        return np.sum(np.log(momi.expected_sfs(demo, self.configs)))
+
+    def time_expected_sfs(self, n_demes, n_per_deme, event):
+        self._log_sfs(self.x, n_demes, event)
+
+    def time_expected_sfs_grad(self, n_demes, n_per_deme, event):
+        autograd.grad(self._log_sfs)(self.x, n_demes, event)
+
+    def peakmem_expected_sfs_grad(self, n_demes, n_per_deme, event):
+        autograd.grad(self._log_sfs)(self.x, n_demes, event)
+
+
+class LogLikelihood(object):
+    params = ([2, 4], [10, 50], [100, 1000])
+    param_names = ["n_demes", "n_per_deme", "n_loci"]
+    timeout = 300
+    event = "pulse"
+
+    def setup(self, n_demes, n_per_deme, n_loci):
+        self.x = .1 * np.random.RandomState(1).normal(
+            size=n_params(n_demes, self.event))
+        model = build_model(self.x, n_demes, self.event)
+        sfs = simulate_sfs(model, n_per_deme, n_loci)
+        sampled_n_dict = dict(zip(sfs.sampled_pops, sfs.sampled_n))
+
+        def demo_func(*x):
+            return build_model(np.array(x), n_demes, self.event)._get_demo(
+                sampled_n_dict)
+        self.surface = SfsLikelihoodSurface(sfs, demo_func=demo_func)
+
+    def track_n_configs(self, n_demes, n_per_deme, n_loci):
+        return len(self.surface.data.configs)
+
+    def time_log_lik(self, n_demes, n_per_deme, n_loci):
+        self.surface.log_lik(self.x)
+
+    def time_log_lik_grad(self, n_demes, n_per_deme, n_loci):
+        autograd.grad(self.surface.log_lik)(self.x)
+
+    def peakmem_log_lik_grad(self, n_demes, n_per_deme, n_loci):
+        autograd.grad(self.surface.log_lik)(self.x)
@@ -0,0 +1,66 @@
+import autograd.numpy as np
+import momi
+
+EVENT_TYPES = ("join", "pulse", "growth")
+
+
+def n_params(n_demes, event):
+    # split times, ancestral size, and event specific params
+    ret = n_demes
+    if event == "pulse":
+        ret += n_demes - 1
+    elif event == "growth":
+        ret += n_demes
+    return ret
+
+
+def build_model(x, n_demes, event):
+    """
+    Returns a DemographicModel with n_demes leaf populations
+    "pop0",...,"pop{n_demes-1}" that successively join into pop0,
+    parametrized by the unconstrained vector x (of length n_params())
+    so it can be differentiated with autograd.
+
+    If event == "pulse", each population also receives a pulse from pop0
+    before joining it. If event == "growth", each leaf has exponential
+    growth that stops when it joins pop0.
+    """
+    pops = ["pop{}".format(i) for i in range(n_demes)]
+    join_t = np.cumsum(np.exp(x[:(n_demes-1)]))
+    x = x[(n_demes-1):]
+
+    model = momi.DemographicModel(1., .25)
+    if event == "growth":
+        growth_rates, x = x[:n_demes], x[n_demes:]
+        for pop, g in zip(pops, growth_rates):
+            model.add_leaf(pop, g=g)
+    else:
+        for pop in pops:
+            model.add_leaf(pop)
+
+    if event == "pulse":
+        pulse_p, x = 1. / (1. + np.exp(-x[:(n_demes-1)])), x[(n_demes-1):]
+        for pop, t, p in zip(pops[1:], join_t, pulse_p):
+            model.move_lineages(pop, "pop0", t / 2., p=p)
+
+    for pop, t in zip(pops[1:], join_t):
+        model.move_lineages(pop, "pop0", t)
+
+    root_t = join_t[-1] if n_demes > 1 else 1.
+    model.set_size("pop0", root_t, N=np.exp(x[0]))
+    return model
+
+
+def simulate_sfs(model, n_per_deme, n_loci, seed=1):
+    """
+    Simulates n_loci unlinked loci from model with msprime, and returns
+    the resulting Sfs. The number of configs grows with n_loci.
+    """
+    n_bases = 1000
+    sampled_n_dict = {pop: n_per_deme for pop in model.leafs}
+    data = model.simulate_data(length=n_bases, recoms_per_gen=0,
+                               num_replicates=n_loci,
+                               muts_per_gen=1. / n_bases,
+                               sampled_n_dict=sampled_n_dict,
+                               random_seed=seed)
+    return data.extract_sfs(None)
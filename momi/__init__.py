@@ -5,12 +5,12 @@ a summary statistic commonly used in population genetics, and using it to infer
 Please refer to examples/tutorial.ipynb for usage & introduction.
 """
 from .compute_sfs import expected_sfs, expected_total_branch_len, expected_sfs_tensor_prod, expected_tmrca, expected_deme_tmrca
-from .likelihood import SfsLikelihoodSurface
+from .likelihood import SfsLikelihoodSurface, DistributedSfsLikelihoodSurface, JackknifeSfsLikelihoodSurface
 from .confidence_region import ConfidenceRegion
 from .data.configurations import build_config_list
 from .data.sfs import site_freq_spectrum, Sfs
 from .data.tensor import sfs_tensor_prod
-from .data.snps import SnpAlleleCounts, snp_allele_counts
+from .data.snps import SnpAlleleCounts, snp_allele_counts, SfsAccumulator
 from .demo_model import DemographicModel
 from .demo_plotter import DemographyPlot
 from .sfs_stats import SfsModelFitStats, JackknifeGoodnessFitStat
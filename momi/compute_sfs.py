@@ -1,12 +1,19 @@
+import collections as co
+import contextlib
+import functools
+import threading
+import time
 import networkx as nx
+import pandas as pd
 import autograd.numpy as np
+from autograd.tracer import getval
 from .data.configurations import ConfigList
 from .math_functions import (hypergeom_quasi_inverse,
                              binom_coeffs,
                              _apply_error_matrices,
                              convolve_trailing_axes,
                              sum_trailing_antidiagonals)
-from .moran_model import moran_transition
+from .moran_model import moran_action
 
 
 def expected_sfs(
@@ -64,28 +71,107 @@ def expected_sfs(
 
 
 def _expected_sfs(demography, configs, folded, error_matrices):
-    if np.any(configs.sampled_n != demography.sampled_n) or np.any(configs.sampled_pops != demography.sampled_pops):
-        raise ValueError(
-            "configs and demography must have same sampled_n, sampled_pops. Use Demography.copy() or ConfigList.copy() to make a copy with different sampled_n.")
+    # the plan is only used once, so don't plan the axes
+    plan = SfsPlan(demography, configs, folded=folded,
+                   error_matrices=error_matrices, axis_plan=False)
+    return plan._expected_sfs(demography)
 
-    vecs, idxs = configs._vecs_and_idxs(folded)
 
-    if error_matrices is not None:
-        vecs = _apply_error_matrices(vecs, error_matrices)
+class SfsPlan(object):
+    """
+    The parts of expected_sfs() that only depend on the configs and
+    the structure of the demography, but not on its parameters.
 
-    vals = expected_sfs_tensor_prod(vecs, demography)
+    Building a plan computes the likelihood vectors of the configs
+    and the order of the events in the junction tree. The plan can
+    then be reused to compute expected_sfs() for any Demography with
+    the same events and samples (e.g. at different parameter values
+    during optimization).
 
-    sfs = vals[idxs['idx_2_row']]
-    if folded:
-        sfs = sfs + vals[idxs['folded_2_row']]
+    Parameters
+    ----------
+    demography : Demography
+    configs : ConfigList
+    folded, error_matrices :
+         see help(expected_sfs)
+    axis_plan : the axis_plan of another SfsPlan for the same demography,
+         or False to keep the default order of the axes. If None, the
+         order of the axes is planned from demography, which costs about
+         as much as computing the SFS of a single config.
+    """
+    def __init__(self, demography, configs, folded=False,
+                 error_matrices=None, axis_plan=None):
+        if np.any(configs.sampled_n != demography.sampled_n) or np.any(configs.sampled_pops != demography.sampled_pops):
+            raise ValueError(
+                "configs and demography must have same sampled_n, sampled_pops. Use Demography.copy() or ConfigList.copy() to make a copy with different sampled_n.")
+
+        self.sampled_pops = tuple(demography.sampled_pops)
+        self.sampled_n = np.array(demography.sampled_n)
+        self.folded = folded
+        self._events_as_edges = tuple(
+            demography._G.graph['events_as_edges'])
+
+        vecs, self.idxs = configs._vecs_and_idxs(folded)
+        if error_matrices is not None:
+            vecs = _apply_error_matrices(vecs, error_matrices)
+        self.vecs = _add_monomorphic_rows(vecs, self.sampled_n)
+        self.event_ops = _event_ops(demography)
+
+        if axis_plan is None:
+            axis_plan = _AxisPlan.record(demography, self.event_ops)
+        elif axis_plan is False:
+            axis_plan = None
+        self.axis_plan = axis_plan
+
+    def is_compatible(self, demography):
+        """
+        Whether the plan can be used with demography, i.e. if it has
+        the same events and samples as the Demography used to build it.
+        """
+        return (tuple(demography.sampled_pops) == self.sampled_pops and
+                np.all(demography.sampled_n == self.sampled_n) and
+                tuple(demography._G.graph['events_as_edges']) ==
+                self._events_as_edges)
 
-    denom = vals[idxs['denom_idx']]
-    for i in (0, 1):
-        denom = denom - vals[idxs[("corrections_2_denom", i)]]
+    def expected_sfs(self, demography, mut_rate=1.0, normalized=False):
+        """
+        Same as expected_sfs(demography, configs, mut_rate, normalized,
+        folded, error_matrices), with the configs, folded, error_matrices
+        used to build the plan.
+        """
+        sfs, denom = self._expected_sfs(demography)
+        if normalized:
+            sfs = sfs / denom
+        else:
+            sfs = sfs * mut_rate
+        return sfs
+
+    def _expected_sfs(self, demography):
+        if not self.is_compatible(demography):
+            raise ValueError(
+                "SfsPlan was built for a Demography with different events or samples")
+
+        leaf_states = dict(zip(self.sampled_pops, self.vecs))
+        axis_plan = self.axis_plan
+        if axis_plan is not None:
+            axis_plan = axis_plan.replay()
+        vals = LikelihoodTensorList.compute_sfs(
+            leaf_states, demography, event_ops=self.event_ops,
+            axis_plan=axis_plan)
+        vals = _remove_monomorphic_rows(vals, self.vecs)
 
-    #assert np.all(np.logical_or(vals >= 0.0, np.isclose(vals, 0.0)))
+        idxs = self.idxs
+        sfs = vals[idxs['idx_2_row']]
+        if self.folded:
+            sfs = sfs + vals[idxs['folded_2_row']]
 
-    return sfs, denom
+        denom = vals[idxs['denom_idx']]
+        for i in (0, 1):
+            denom = denom - vals[idxs[("corrections_2_denom", i)]]
+
+        #assert np.all(np.logical_or(vals >= 0.0, np.isclose(vals, 0.0)))
+
+        return sfs, denom
 
 
 def expected_total_branch_len(demography, error_matrices=None, ascertainment_pop=None,
@@ -238,23 +324,26 @@ def expected_sfs_tensor_prod(vecs, demography, mut_rate=1.0, sampled_pops=None):
     expected_total_branch_len, expected_tmrca, expected_deme_tmrca :
          examples of coalescent statistics that use this function
     """
+    vecs = _add_monomorphic_rows(vecs, demography.sampled_n)
+    res = _expected_sfs_tensor_prod(vecs, demography, mut_rate=mut_rate)
+    return _remove_monomorphic_rows(res, vecs)
+
+
+def _add_monomorphic_rows(vecs, sampled_n):
     # NOTE cannot use vecs[i] = ... due to autograd issues
-    sampled_n = [np.array(v).shape[-1] - 1 for v in vecs]
-    vecs = [np.vstack([np.array([1.0] + [0.0] * n),  # all ancestral state
+    return [np.vstack([np.array([1.0] + [0.0] * n),  # all ancestral state
                        np.array([0.0] * n + [1.0]),  # all derived state
                        v])
-            for v, n in zip(vecs, demography.sampled_n)]
+            for v, n in zip(vecs, sampled_n)]
 
-    res = _expected_sfs_tensor_prod(vecs, demography, mut_rate=mut_rate)
 
+def _remove_monomorphic_rows(res, vecs):
     # subtract out mass for all ancestral/derived state
     for k in (0, 1):
         res = res - res[k] * np.prod([l[:, -k] for l in vecs], axis=0)
         assert np.isclose(res[k], 0.0)
     # remove monomorphic states
-    res = res[2:]
-
-    return res
+    return res[2:]
 
 
 def _expected_sfs_tensor_prod(vecs, demography, mut_rate=1.0):
@@ -266,31 +355,266 @@ def _expected_sfs_tensor_prod(vecs, demography, mut_rate=1.0):
     return res * mut_rate
 
 
+def _event_ops(demo):
+    # the events of the junction tree in postorder, with their types
+    return tuple((event, demo._event_type(event))
+                 for event in nx.dfs_postorder_nodes(demo._event_tree))
+
+
+class _EventProfiler(object):
+    """
+    Records the wall time, estimated floating point operations, and largest
+    output tensor of each LikelihoodTensor operation at each event,
+    summed over all calls (e.g. over the SFS batches).
+    """
+    def __init__(self):
+        self.records = co.OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, event, e_type, op, seconds, flops=0, liks=None):
+        if liks is None:
+            shape, nbytes = None, 0
+        else:
+            liks = getval(liks)
+            shape, nbytes = liks.shape, liks.nbytes
+        with self.lock:
+            key = (event, op)
+            if key not in self.records:
+                self.records[key] = [e_type, 0, 0.0, 0, None, 0]
+            rec = self.records[key]
+            rec[1] += 1
+            rec[2] += seconds
+            rec[3] += flops
+            if nbytes >= rec[5]:
+                rec[4], rec[5] = shape, nbytes
+
+    def total_bytes(self):
+        """
+        Sum over the operations of their largest output tensor.
+        """
+        return sum(nbytes for (_, _, _, _, _, nbytes)
+                   in self.records.values())
+
+    def dataframe(self):
+        return pd.DataFrame(
+            [[str(event), e_type, op, calls, seconds, flops, shape, nbytes]
+             for (event, op), (e_type, calls, seconds, flops, shape, nbytes)
+             in self.records.items()],
+            columns=["Event", "EventType", "Op", "Calls", "Seconds",
+                     "Flops", "Shape", "Bytes"])
+
+
+# the active _EventProfiler, if any; see _profile_events()
+_profiler = None
+# the event being processed by the current thread, for _profiled methods
+_profiled_event = threading.local()
+
+
+@contextlib.contextmanager
+def _profile_events():
+    """
+    Within this context, record the LikelihoodTensor operations
+    of each event in an _EventProfiler.
+    """
+    global _profiler
+    prev_profiler = _profiler
+    _profiler = _EventProfiler()
+    try:
+        yield _profiler
+    finally:
+        _profiler = prev_profiler
+
+
+def _profiled(flops):
+    """
+    Decorator for LikelihoodTensor methods, that records the method in
+    the active _EventProfiler (if any). flops is a function with the
+    same signature as the method, returning an estimate of the floating
+    point operations used.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapped(self, *args, **kwargs):
+            curr = getattr(_profiled_event, "curr", None)
+            if curr is None:
+                return method(self, *args, **kwargs)
+
+            n_flops = int(flops(self, *args, **kwargs))
+            start = time.perf_counter()
+            ret = method(self, *args, **kwargs)
+            seconds = time.perf_counter() - start
+
+            profiler, event, e_type = curr
+            profiler.record(event, e_type, method.__name__,
+                            seconds, n_flops, self.liks)
+            _profiled_event.op_seconds += seconds
+            return ret
+        return wrapped
+    return decorator
+
+
+def _liks_bytes_per_row(demo):
+    """
+    Estimates the memory (in bytes) used by LikelihoodTensor.liks for each
+    row of the leaf likelihoods (i.e. for each config), when computing the
+    SFS of demo. This only depends on the structure of demo, so it is
+    computed from a single row.
+
+    Returns the total over all the operations of the event tree, rather
+    than the peak, because autograd keeps all of them in memory to compute
+    the gradient.
+    """
+    profiler = _EventProfiler()
+    _compute_single_row_sfs(demo, profiler=profiler)
+    return profiler.total_bytes()
+
+
+def _compute_single_row_sfs(demo, **kwargs):
+    leaf_states = {pop: np.ones((1, n + 1)) for pop, n in zip(
+        demo.sampled_pops, demo.sampled_n)}
+    return LikelihoodTensorList.compute_sfs(leaf_states, demo, **kwargs)
+
+
+def _axes_order(pop_labels, last_pops, any_order=False, key=None):
+    n_last = len(pop_labels) - len(last_pops)
+    trailing = pop_labels[n_last:]
+    if list(trailing) == list(last_pops) or (
+            any_order and set(trailing) == set(last_pops)):
+        return pop_labels
+
+    others = [p for p in pop_labels if p not in last_pops]
+    if key is not None:
+        others = sorted(others, key=key)
+    return others + list(last_pops)
+
+
+class _AxisPlan(object):
+    """
+    Chooses the order of the population axes of the LikelihoodTensors,
+    to avoid transposing (and so copying) them more than needed.
+
+    The plan is recorded by _AxisPlan.record(), which logs the calls to
+    LikelihoodTensor.make_last_axes() and LikelihoodTensor.rename_pop()
+    while computing the SFS for a single row. These calls only depend on
+    the events of the demography, so replay() can then be used for every
+    batch of data. When replaying, if a tensor must be transposed to move
+    some axes to the end, its other axes are sorted by when they are next
+    needed, so that later calls to make_last_axes() find them in place.
+    """
+    @classmethod
+    def record(cls, demo, event_ops=None):
+        axis_plan = cls()
+        _compute_single_row_sfs(demo, event_ops=event_ops,
+                                axis_plan=axis_plan)
+        axis_plan.trace = tuple(axis_plan.trace)
+        axis_plan.recording = False
+        return axis_plan
+
+    def __init__(self, trace=None):
+        self.recording = trace is None
+        if self.recording:
+            trace = []
+        self.trace = trace
+        self.position = 0
+
+    def replay(self):
+        assert not self.recording
+        return _AxisPlan(self.trace)
+
+    def rename_pop(self, oldpop, newpop):
+        self._step(("rename", oldpop, newpop))
+
+    def axes_order(self, pop_labels, last_pops, any_order=False):
+        """
+        Returns the new order of pop_labels, ending with last_pops.
+        """
+        last_pops = tuple(last_pops)
+        self._step(("last", last_pops))
+        if self.recording:
+            return _axes_order(pop_labels, last_pops, any_order)
+        return _axes_order(pop_labels, last_pops, any_order,
+                           key=self._next_use)
+
+    def _step(self, entry):
+        if self.recording:
+            self.trace.append(entry)
+        else:
+            if self.trace[self.position] != entry:
+                raise ValueError(
+                    "Events do not match the demography used to plan"
+                    " the axes")
+            self.position += 1
+
+    def _next_use(self, pop):
+        # the axes needed sooner go further right;
+        # axes that are never moved again go leftmost
+        for i in range(self.position, len(self.trace)):
+            entry = self.trace[i]
+            if entry[0] == "rename":
+                if entry[1] == pop:
+                    pop = entry[2]
+            elif pop in entry[1]:
+                return (-i, entry[1].index(pop))
+        return (-len(self.trace), 0)
+
+
+def _liks_size(lik):
+    return np.prod(lik.liks.shape, dtype=float)
+
+
 class LikelihoodTensorList(object):
     @classmethod
-    def compute_sfs(cls, leaf_states, demo):
-        liklist = cls(leaf_states, demo)
-        for event in nx.dfs_postorder_nodes(
-                demo._event_tree):
-            liklist._process_event(event)
+    def compute_sfs(cls, leaf_states, demo, event_ops=None, profiler=None,
+                    axis_plan=None):
+        if event_ops is None:
+            event_ops = _event_ops(demo)
+        liklist = cls(leaf_states, demo, profiler=profiler,
+                      axis_plan=axis_plan)
+        for event, e_type in event_ops:
+            liklist._process_event(event, e_type)
         assert len(liklist.likelihood_list) == 1
         lik, = liklist.likelihood_list
         return lik.sfs
 
-    def __init__(self, leaf_liks_dict, demo):
+    def __init__(self, leaf_liks_dict, demo, profiler=None, axis_plan=None):
         self.likelihood_list = [
-            LikelihoodTensor(l, 0, [p])
+            LikelihoodTensor(l, 0, [p], axis_plan=axis_plan)
             for p, l in leaf_liks_dict.items()
         ]
         self.demo = demo
+        self.axis_plan = axis_plan
+        # use the active profiler (if any) by default
+        if profiler is None:
+            profiler = _profiler
+        self.profiler = profiler
 
     def _get_likelihoods(self, pop):
         for lik in self.likelihood_list:
             if pop in lik.pop_labels:
                 return lik
 
-    def _process_event(self, event):
-        e_type = self.demo._event_type(event)
+    def _process_event(self, event, e_type=None):
+        if e_type is None:
+            e_type = self.demo._event_type(event)
+
+        profiler = self.profiler
+        if profiler is None:
+            self._process_event_helper(event, e_type)
+        else:
+            _profiled_event.curr = (profiler, event, e_type)
+            _profiled_event.op_seconds = 0.0
+            start = time.perf_counter()
+            try:
+                self._process_event_helper(event, e_type)
+            finally:
+                # time spent outside the LikelihoodTensor methods,
+                # e.g. computing the transition matrices
+                other_seconds = (time.perf_counter() - start -
+                                 _profiled_event.op_seconds)
+                _profiled_event.curr = None
+            profiler.record(event, e_type, "other", other_seconds)
+
+    def _process_event_helper(self, event, e_type):
         if e_type == 'leaf':
             self._process_leaf_likelihood(event)
         elif e_type == 'merge_subpops':
@@ -309,9 +633,7 @@ class LikelihoodTensorList(object):
             if n > 0:
                 lik.add_last_axis_sfs(self.demo._truncated_sfs(newpop))
                 if event != self.demo._event_root:
-                    lik.matmul_last_axis(
-                        np.transpose(moran_transition(
-                            self.demo._scaled_time(newpop), n)))
+                    lik.moran_last_axis(self.demo._scaled_time(newpop))
 
     def _rename_pop(self, oldpop, newpop):
         self._get_likelihoods(oldpop).rename_pop(
@@ -326,7 +648,7 @@ class LikelihoodTensorList(object):
             batch_size = self.likelihood_list[0].liks.shape[0]
             self.likelihood_list.append(LikelihoodTensor(
                 np.ones((batch_size, 1)), 0,
-                [(pop, idx)]
+                [(pop, idx)], axis_plan=self.axis_plan
             ))
 
     def _in_same_lik(self, pop1, pop2):
@@ -336,15 +658,18 @@ class LikelihoodTensorList(object):
        child_liks = [self._get_likelihoods(p)
                      for p in child_pops]
 
-       for lik, pop in zip(child_liks, child_pops):
-           lik.make_last_axis(pop)
-           lik.mul_trailing_binoms()
-
        pop1, pop2 = child_pops
        lik1, lik2 = child_liks
        if lik1 is lik2:
-           lik1.sum_trailing_antidiagonals()
+           # sum_trailing_antidiagonals() is symmetric in the 2 axes
+           lik1.make_last_axes([pop1, pop2], any_order=True)
+           n1, n2 = [n - 1 for n in lik1.liks.shape[-2:]]
+           lik1.mul_trailing(np.outer(binom_coeffs(n1), binom_coeffs(n2)))
+           lik1.sum_trailing_antidiagonals(pop1)
        else:
+           for lik, pop in zip(child_liks, child_pops):
+               lik.make_last_axis(pop)
+               lik.mul_trailing_binoms()
            self.likelihood_list.remove(lik2)
            lik1.convolve_trailing_axes(lik2)
 
@@ -409,16 +734,20 @@ class LikelihoodTensorList(object):
             child_event, = set(child_events)
             lik = self._get_likelihoods(recipient)
             assert lik is self._get_likelihoods(non_recipient)
+            # transpose the (small) pulse_probs rather than lik when
+            # recipient, non_recipient are already the trailing axes
+            lik.make_last_axes([recipient, non_recipient], any_order=True)
+            if lik.pop_labels[-1] == recipient:
+                pulse_probs_dims = [non_recipient, recipient, donor, non_donor]
+            else:
+                pulse_probs_dims = [recipient, non_recipient, non_donor, donor]
+
             pulse_probs, pulse_idxs = self.demo._pulse_prob(event)
-            pulse_probs_dims = [recipient, non_recipient, non_donor, donor]
             assert set(pulse_probs_dims) == set(pulse_idxs)
             pulse_probs = np.transpose(pulse_probs, [
                 pulse_idxs.index(i)
                 for i in pulse_probs_dims])
 
-            lik.make_last_axis(recipient)
-            lik.make_last_axis(non_recipient)
-
             lik.matmul_last_axis(pulse_probs, axes=2)
 
             lik.rename_pop(recipient, non_donor)
@@ -426,16 +755,18 @@ class LikelihoodTensorList(object):
 
 
 class LikelihoodTensor(object):
-    def __init__(self, liks, sfs, pop_labels):
+    def __init__(self, liks, sfs, pop_labels, axis_plan=None):
         self.liks = liks
         self.sfs = sfs
         self.pop_labels = pop_labels
+        self.axis_plan = axis_plan
         # extra leading dimension for batch
         assert len(self.pop_labels) + 1 == len(
             self.liks.shape)
 
     def copy(self):
-        return LikelihoodTensor(self.liks, self.sfs, list(self.pop_labels))
+        return LikelihoodTensor(self.liks, self.sfs, list(self.pop_labels),
+                                axis_plan=self.axis_plan)
 
     def admix_trailing_pop(self, admix_probs_3tensor,
                            newpop_name):
@@ -445,13 +776,16 @@ class LikelihoodTensor(object):
         self.matmul_last_axis(admix_probs_3tensor)
         self.pop_labels.append(newpop_name)
 
-    def sum_trailing_antidiagonals(self):
+    @_profiled(lambda self, merged_pop: _liks_size(self))
+    def sum_trailing_antidiagonals(self, merged_pop):
         trailing_shape = list(self.liks.shape[-2:])
         lik = np.reshape(self.liks, [-1] + trailing_shape)
         lik = sum_trailing_antidiagonals(lik)
         self.liks = np.reshape(lik, [-1] + list(self.liks.shape[1:-2]) + [sum(trailing_shape) - 1])
-        self.pop_labels.pop()
+        self.pop_labels[-2:] = [merged_pop]
 
+    @_profiled(lambda self, other: 2 * _liks_size(self) * _liks_size(other)
+               / self.liks.shape[0])
     def convolve_trailing_axes(self, other):
         def within_pop_sfs(a, b):
             return a.sfs * b.liks[
@@ -493,17 +827,35 @@ class LikelihoodTensor(object):
         return self.pop_labels.index(pop) + 1
 
     def rename_pop(self, oldpop, newpop):
+        if self.axis_plan is not None:
+            self.axis_plan.rename_pop(oldpop, newpop)
         self.pop_labels[
             self.pop_labels.index(oldpop)] = newpop
 
     def make_last_axis(self, pop):
-        axis = self.pop_axis(pop)
-        perm = [i for i in range(self.n_axes)
-                if i != axis] + [axis]
-        self.liks = np.transpose(self.liks, perm)
-        self.pop_labels = [p for p in self.pop_labels if p != pop] + [pop]
+        self.make_last_axes([pop])
+
+    def make_last_axes(self, pops, any_order=False):
+        """
+        Transpose liks so that the axes of pops are the trailing axes,
+        in the order given (or in any order if any_order=True).
+        The order of the other axes is chosen by self.axis_plan,
+        or kept as is if there is no plan.
+        """
+        if self.axis_plan is None:
+            new_labels = _axes_order(self.pop_labels, pops, any_order)
+        else:
+            new_labels = self.axis_plan.axes_order(
+                self.pop_labels, pops, any_order)
+
+        if new_labels != self.pop_labels:
+            perm = [0] + [self.pop_axis(p) for p in new_labels]
+            self.liks = np.transpose(self.liks, perm)
+            self.pop_labels = new_labels
         assert len(self.pop_labels) + 1 == len(self.liks.shape)
 
+    @_profiled(lambda self, truncated_sfs:
+               2 * self.liks.shape[0] * self.liks.shape[-1])
     def add_last_axis_sfs(self, truncated_sfs):
         self.sfs = self.sfs + np.dot(
             self.liks[tuple(
@@ -524,6 +876,8 @@ class LikelihoodTensor(object):
             coeffs = 1.0 / coeffs
         self.mul_trailing(coeffs)
 
+    @_profiled(lambda self, mat, axes=1:
+               2 * _liks_size(self) * np.prod(mat.shape[axes:], dtype=float))
     def matmul_last_axis(self, mat, axes=1):
         reshaped_liks = np.reshape(self.liks, [-1] + [np.prod(
             self.liks.shape[-axes:])])
@@ -532,5 +886,10 @@ class LikelihoodTensor(object):
         reshaped_liks = np.dot(reshaped_liks, reshaped_mat)
         self.liks = np.reshape(reshaped_liks, list(self.liks.shape[:-axes]) + list(mat.shape[axes:]))
 
+    @_profiled(lambda self, t: 2 * _liks_size(self) * self.liks.shape[-1])
+    def moran_last_axis(self, t):
+        self.liks = moran_action(t, self.liks, axis=-1)
+
+    @_profiled(lambda self, to_mult: _liks_size(self))
     def mul_trailing(self, to_mult):
         self.liks = self.liks * to_mult
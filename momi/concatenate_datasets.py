@@ -9,13 +9,20 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--verbose", action="store_true")
     parser.add_argument("files", nargs="+",
-                        help="Files containing momi json data to concatenate")
+                        help="Files containing momi data to concatenate")
+    parser.add_argument("--out", default=None,
+                        help="Output file. If not provided, write JSON to stdout. If ends with .momi, write a directory in the (faster) binary format.")
 
     args = parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
 
+    if args.out is None:
+        out = sys.stdout
+    else:
+        out = args.out
+
     SnpAlleleCounts.concatenate(
         SnpAlleleCounts.load(fname)
-        for fname in args.files).dump(sys.stdout)
+        for fname in args.files).dump(out)
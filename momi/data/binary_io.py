@@ -0,0 +1,70 @@
+"""Binary columnar on-disk format for momi data objects.
+
+A binary file is a directory (by convention ending in ``.momi``) holding
+a small ``header.json`` with the scalar metadata, and one ``.npy`` file
+per array. The arrays are memory-mapped when loaded, so no text is parsed,
+and only the pages that are actually accessed are read into memory.
+"""
+
+import os
+import json
+import numpy as np
+
+BINARY_SUFFIX = ".momi"
+_HEADER_FNAME = "header.json"
+_FORMAT_VERSION = 1
+
+
+def _is_binary_path(f):
+    """Whether ``f`` names a file in the binary format,
+    i.e. it is an existing directory or ends with ``.momi``."""
+    if not isinstance(f, str):
+        return False
+    return (os.path.isdir(f) or
+            f.rstrip("/" + os.sep).endswith(BINARY_SUFFIX))
+
+
+def _dump_arrays(dirname, obj_type, header, arrays):
+    """Write ``header`` (a JSON-serializable dict) and the
+    dict of ``arrays`` into the directory ``dirname``."""
+    os.makedirs(dirname, exist_ok=True)
+    for key, arr in arrays.items():
+        np.save(os.path.join(dirname, key + ".npy"),
+                np.ascontiguousarray(arr))
+
+    header = dict(header)
+    header["type"] = obj_type
+    header["format_version"] = _FORMAT_VERSION
+    header["arrays"] = sorted(arrays.keys())
+    # write the header last, so it is only present
+    # once all the arrays have been written
+    with open(os.path.join(dirname, _HEADER_FNAME), "w") as f:
+        json.dump(header, f, indent=1)
+
+
+def _load_arrays(dirname, obj_type, mmap_mode="r"):
+    """Read a directory written by :func:`_dump_arrays`.
+
+    Returns the header dict and a dict of (memory-mapped) arrays.
+    """
+    header_fname = os.path.join(dirname, _HEADER_FNAME)
+    try:
+        with open(header_fname) as f:
+            header = json.load(f)
+    except FileNotFoundError:
+        raise IOError("{} is not a momi binary file (missing {})".format(
+            dirname, _HEADER_FNAME))
+
+    if header.pop("type", None) != obj_type:
+        raise IOError("{} does not contain a {} object".format(
+            dirname, obj_type))
+    version = header.pop("format_version")
+    if version > _FORMAT_VERSION:
+        raise IOError("{} has binary format version {}, but this version"
+                      " of momi can only read up to version {}".format(
+                          dirname, version, _FORMAT_VERSION))
+
+    arrays = {key: np.load(os.path.join(dirname, key + ".npy"),
+                           mmap_mode=mmap_mode)
+              for key in header.pop("arrays")}
+    return header, arrays
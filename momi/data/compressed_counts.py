@@ -1,3 +1,4 @@
+import itertools as it
 from cached_property import cached_property
 # autograd.numpy.array() inefficient, so use vanilla numpy here
 import numpy as np
@@ -17,6 +18,19 @@ def _hashed2config(config_str):
                               for x in config_str.strip().split()))
 
 
+def _unique_rows(arr):
+    """
+    Like np.unique(arr, axis=0, return_inverse=True), but the
+    unique rows are returned in order of first appearance.
+    """
+    uniq, first_idxs, inverse = np.unique(
+        arr, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first_idxs)
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    return uniq[order], rank[inverse]
+
+
 class _CompressedList(object):
     def __init__(self, items=None):
         self.uniq_values = []
@@ -28,6 +42,16 @@ class _CompressedList(object):
             for i in items:
                 self.append(i)
 
+    @classmethod
+    def _from_arrays(cls, uniq_values, index2uniq):
+        # index2uniq may be a (memory-mapped) array,
+        # in which case the returned list cannot be appended to
+        ret = cls()
+        ret.uniq_values = list(uniq_values)
+        ret.value2uniq = {v: i for i, v in enumerate(ret.uniq_values)}
+        ret.index2uniq = index2uniq
+        return ret
+
     def __eq__(self, other):
         return list(self) == list(other)
 
@@ -64,29 +88,77 @@ class _CompressedList(object):
             self.append(i)
 
 
+# _CompressedHashedCounts hashes a config by the raw bytes of its
+# fixed-width integer array, which is compact and fast to decode
+_HASH_DTYPE = np.int32
+
+
 class _CompressedHashedCounts(object):
     def __init__(self, npops):
-        self.compressed_list = _CompressedList()
         self.npops = npops
+        self.value2uniq = {}
+        self.uniq_values = []
+        # index2uniq is stored as a list of arrays, plus a buffer
+        # of ints for configs added one at a time by append()
+        self._index_chunks = []
+        self._index_buffer = []
 
     def __len__(self):
-        return len(self.compressed_list)
+        return (sum(len(c) for c in self._index_chunks) +
+                len(self._index_buffer))
+
+    def _get_uniq_idx(self, value):
+        try:
+            return self.value2uniq[value]
+        except KeyError:
+            uniq_idx = len(self.uniq_values)
+            self.value2uniq[value] = uniq_idx
+            self.uniq_values.append(value)
+            return uniq_idx
 
     def append(self, config):
-        self.compressed_list.append(_config2hashable(config))
+        self._index_buffer.append(self._get_uniq_idx(
+            np.asarray(config, dtype=_HASH_DTYPE).tobytes()))
+
+    def uniq_idxs(self, configs):
+        """Returns the unique index of each config in an array with
+        shape (n_configs, npops, 2), adding new configs to the
+        unique configs, but without recording them in index2uniq.
+        Only the unique configs within the array are hashed."""
+        configs = np.asarray(configs, dtype=_HASH_DTYPE)
+        if len(configs) == 0:
+            return np.zeros(0, dtype=int)
+        uniq, inverse = _unique_rows(configs.reshape(len(configs), -1))
+        uniq_idxs = np.array([self._get_uniq_idx(config.tobytes())
+                              for config in uniq], dtype=int)
+        return uniq_idxs[inverse]
+
+    def extend(self, configs):
+        """Append an array of configs with shape (n_configs, npops, 2)."""
+        self._flush_buffer()
+        self._index_chunks.append(self.uniq_idxs(configs))
+
+    def _flush_buffer(self):
+        if self._index_buffer:
+            self._index_chunks.append(
+                np.array(self._index_buffer, dtype=int))
+            self._index_buffer = []
 
     def index2uniq(self, i=None):
+        self._flush_buffer()
+        if len(self._index_chunks) != 1:
+            self._index_chunks = [np.concatenate(
+                [np.zeros(0, dtype=int)] + self._index_chunks)]
+        ret, = self._index_chunks
         if i is None:
-            return self.compressed_list.index2uniq
+            return ret
         else:
-            return self.compressed_list.index2uniq[i]
+            return ret[i]
 
     def config_array(self):
-        ret = np.zeros((len(self.compressed_list.uniq_values), self.npops, 2),
-                       dtype=int)
-        for i, config_str in enumerate(self.compressed_list.uniq_values):
-            ret[i, :, :] = _hashed2config(config_str)
-        return ret
+        return np.frombuffer(
+            b"".join(self.uniq_values), dtype=_HASH_DTYPE
+        ).reshape((len(self.uniq_values), self.npops, 2)).astype(int)
 
     def compressed_allele_counts(self):
         return CompressedAlleleCounts(self.config_array(),
@@ -95,18 +167,36 @@ class _CompressedHashedCounts(object):
 
 class CompressedAlleleCounts(object):
     @classmethod
-    def from_iter(cls, config_iter, npops, sort=True):
+    def from_iter(cls, config_iter, npops, sort=True, chunk_size=100000):
+        if isinstance(config_iter, np.ndarray):
+            return cls.from_array(config_iter, sort=sort)
+        # hash the configs in chunks of arrays
         compressed_hashes = _CompressedHashedCounts(npops)
-        for config in config_iter:
-            compressed_hashes.append(config)
+        config_iter = iter(config_iter)
+        while True:
+            chunk = list(it.islice(config_iter, chunk_size))
+            if not chunk:
+                break
+            compressed_hashes.extend(np.reshape(
+                np.array(chunk, dtype=int), (len(chunk), npops, 2)))
         return cls(compressed_hashes.config_array(),
                    compressed_hashes.index2uniq(),
                    sort=sort)
 
+    @classmethod
+    def from_array(cls, config_array, sort=True):
+        """Create from an array with shape (n_snps, npops, 2)."""
+        config_array = np.asarray(config_array, dtype=int)
+        n_snps, npops, _ = config_array.shape
+        uniq, index2uniq = _unique_rows(config_array.reshape(n_snps, -1))
+        return cls(uniq.reshape((len(uniq), npops, 2)), index2uniq,
+                   sort=sort)
+
     def __init__(self, config_array, index2uniq,
                  sort=True):
         self.config_array = config_array
-        self.index2uniq = np.array(index2uniq, dtype=int)
+        # asarray() avoids copying memory-mapped arrays
+        self.index2uniq = np.asarray(index2uniq, dtype=int)
         if sort:
             self.sort_configs()
 
@@ -140,20 +230,18 @@ class CompressedAlleleCounts(object):
         d = self.config_array[:, :, 1]  # derived counts
         n = a + d  # totals
 
-        n = list(map(tuple, n))
-        a = list(map(tuple, a))
-        d = list(map(tuple, d))
-
-        folded = list(map(min, list(zip(a, d))))
+        # folded is the lexicographic min of a, d
+        first_diff = np.argmax(a != d, axis=1)
+        rows = np.arange(len(a))
+        a_is_min = a[rows, first_diff] <= d[rows, first_diff]
+        folded = np.where(a_is_min[:, np.newaxis], a, d)
 
-        keys = list(zip(n, folded))
-        sorted_idxs = sorted(range(len(n)), key=lambda i: keys[i])
-        sorted_idxs = np.array(sorted_idxs, dtype=int)
+        # sort by (n, folded); np.lexsort uses the last key as primary
+        keys = np.concatenate([n, folded], axis=1)
+        sorted_idxs = np.lexsort(keys.T[::-1])
 
-        unsorted_idxs = [None] * len(sorted_idxs)
-        for i, j in enumerate(sorted_idxs):
-            unsorted_idxs[j] = i
-        unsorted_idxs = np.array(unsorted_idxs, dtype=int)
+        unsorted_idxs = np.empty(len(sorted_idxs), dtype=int)
+        unsorted_idxs[sorted_idxs] = np.arange(len(sorted_idxs))
 
         self.config_array = self.config_array[sorted_idxs, :, :]
         self.index2uniq = unsorted_idxs[self.index2uniq]
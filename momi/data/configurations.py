@@ -130,48 +130,91 @@ class ConfigList(object):
         Returns
         numpy.ndarray of weighted counts for each config
         """
-        assert (set(derived_weights_dict.keys())
-                <= set(total_counts_dict.keys()))
+        return self.batch_count_subsets([derived_weights_dict],
+                                        total_counts_dict)[:, 0]
 
-        ret = np.ones(len(self))
+    def batch_count_subsets(self, derived_weights_dicts, total_counts_dict):
+        """
+        Same as count_subsets(), for a list of derived_weights_dict.
+
+        Returns
+        numpy.ndarray with shape (len(self), len(derived_weights_dicts)),
+        whose j-th column is
+        count_subsets(derived_weights_dicts[j], total_counts_dict)
+        """
+        for derived_weights_dict in derived_weights_dicts:
+            assert (set(derived_weights_dict.keys())
+                    <= set(total_counts_dict.keys()))
+
+        ret = np.ones((len(self), len(derived_weights_dicts)))
         for p, n in total_counts_dict.items():
-            i = self.sampled_pops.index(p)
-            if p in derived_weights_dict:
-                curr = np.zeros(len(self))
-                assert len(derived_weights_dict[p]) == n+1
-                for d, w in enumerate(derived_weights_dict[p]):
-                    if w == 0:
-                        continue
-                    a = n - d
-                    curr += w * (comb(self.value[:, i, 0], a)
-                                 * comb(self.value[:, i, 1], d))
-                ret *= curr
-            else:
-                ret *= comb(self.value[:, i, :].sum(axis=1), n)
+            weights = []
+            for derived_weights_dict in derived_weights_dicts:
+                try:
+                    w = derived_weights_dict[p]
+                except KeyError:
+                    # sum over derived counts gives all subsets of size n
+                    w = np.ones(n+1)
+                assert len(w) == n+1
+                weights.append(w)
+            ret *= np.dot(self._subset_counts(p, n), np.transpose(weights))
         return ret
 
+    @memoize_instance
+    def _subset_counts(self, pop, n):
+        """
+        Returns a matrix whose [i, d] entry is the number of subsets of
+        size n of the i-th config in pop, with d derived alleles.
+        """
+        i = self.sampled_pops.index(pop)
+        anc, der = self.value[:, i, 0], self.value[:, i, 1]
+        # binoms[k, j] = comb(k, j)
+        binoms = comb(np.arange(max(np.max(anc), np.max(der)) + 1)[:, None],
+                      np.arange(n+1)[None, :])
+        return binoms[anc, ::-1] * binoms[der, :]
+
     def subsample_probs(self, subconfig):
         """
         Returns the probability of subsampling subconfig
         from each config.
         """
-        subconfig = np.array(subconfig)
+        return self.batch_subsample_probs([subconfig])[:, 0]
+
+    def batch_subsample_probs(self, subconfigs):
+        """
+        Same as subsample_probs(), for a list of subconfigs with
+        the same sample size in each population.
+
+        Returns
+        numpy.ndarray with shape (len(self), len(subconfigs)),
+        whose j-th column is subsample_probs(subconfigs[j])
+        """
+        subconfigs = np.array(subconfigs, ndmin=3)
+        subsample_n = subconfigs.sum(axis=2)
+        if np.any(subsample_n != subsample_n[0]):
+            raise ValueError("subconfigs must have the same sample size"
+                             " in each population")
         total_counts_dict = {p: n for p, n in zip(self.sampled_pops,
-                                                  subconfig.sum(axis=1))
+                                                  subsample_n[0])
                              if n > 0}
-        derived_counts_dict = {p: [0]*(n+1)
-                               for p, n in total_counts_dict.items()}
-        for p, d in zip(self.sampled_pops, subconfig[:, 1]):
-            if p in derived_counts_dict:
-                derived_counts_dict[p][d] = 1
 
-        num = self.count_subsets(derived_counts_dict, total_counts_dict)
-        denom = self.count_subsets({}, total_counts_dict)
+        derived_counts_dicts = []
+        for subconfig in subconfigs:
+            derived_counts_dict = {p: [0]*(n+1)
+                                   for p, n in total_counts_dict.items()}
+            for p, d in zip(self.sampled_pops, subconfig[:, 1]):
+                if p in derived_counts_dict:
+                    derived_counts_dict[p][d] = 1
+            derived_counts_dicts.append(derived_counts_dict)
+
+        counts = self.batch_count_subsets(derived_counts_dicts + [{}],
+                                          total_counts_dict)
+        num, denom = counts[:, :-1], counts[:, -1]
 
         # avoid 0/0
         assert np.all(num[denom == 0] == 0)
         denom[denom == 0] = 1
-        return num / denom
+        return num / denom[:, None]
 
     # TODO: remove this method (and self.sampled_n attribute)
     def _copy(self, sampled_n=None):
@@ -200,17 +243,8 @@ class ConfigList(object):
                 for n in self.sampled_n]
 
         for i in range(len(vecs)):
-            n = self.sampled_n[i]
-            derived = np.einsum(
-                "i,j->ji", np.ones(len(augmented_configs)), np.arange(n + 1))
-            curr = scipy.stats.hypergeom.pmf(
-                    k=augmented_configs[:, i, 1],
-                    M=n,
-                    n=derived,
-                    N=augmented_configs[:, i].sum(1)
-                )
-            assert not np.any(np.isnan(curr))
-            vecs[i] = np.transpose(curr)
+            vecs[i] = _hypergeom_vecs(self.sampled_n[i],
+                                      augmented_configs[:, i, :])
 
         # copy augmented_idxs to make it safe
         return vecs, dict(augmented_idxs)
@@ -373,3 +407,21 @@ class _ConfigList_Subset(ConfigList):
                 for k, v in list(idxs.items())}
         idxs[denom_idx_key] = old_2_new_idxs[denom_idx]
         return old_idxs, idxs
+
+
+def _hypergeom_vecs(n, deme_configs):
+    """
+    Returns the likelihood vectors of the configs of a deme with n samples,
+    i.e. ret[i, j] = probability of observing deme_configs[i] (the
+    ancestral and derived counts) when j of the n samples are derived.
+    """
+    derived = np.einsum(
+        "i,j->ji", np.ones(len(deme_configs)), np.arange(n + 1))
+    curr = scipy.stats.hypergeom.pmf(
+            k=deme_configs[:, 1],
+            M=n,
+            n=derived,
+            N=deme_configs.sum(1)
+        )
+    assert not np.any(np.isnan(curr))
+    return np.transpose(curr)
@@ -2,6 +2,7 @@ import itertools as it
 import collections as co
 import json
 import autograd.numpy as np
+from autograd.extend import primitive, defvjp
 import numpy as raw_np
 from cached_property import cached_property
 import scipy
@@ -13,6 +14,7 @@ from .compressed_counts import _hashed2config, _config2hashable
 from .compressed_counts import CompressedAlleleCounts
 from .configurations import ConfigList
 from .configurations import _ConfigList_Subset
+from .binary_io import _is_binary_path, _dump_arrays, _load_arrays
 from ..util import memoize_instance
 
 
@@ -73,24 +75,23 @@ class Sfs(object):
     """
     @classmethod
     def from_matrix(cls, mat, configs, *args, **kwargs):
-        # convert to csc
-        mat = scipy.sparse.csc_matrix(mat)
-        indptr = mat.indptr
-        loci = []
-        for i in range(mat.shape[1]):
-            loci.append(np.array([
-                mat.indices[indptr[i]:indptr[i+1]],
-                mat.data[indptr[i]:indptr[i+1]]]))
-
-        return cls(loci, configs, *args, **kwargs)
+        # the (configs x loci) matrix is adopted as is,
+        # without splitting it into per-locus arrays
+        return cls(scipy.sparse.csc_matrix(mat), configs, *args, **kwargs)
 
     @classmethod
     def load(cls, f):
         """Load :class:`Sfs` from file created by :meth:`Sfs.dump` or ``python -m momi.extract_sfs``
 
+        If ``f`` is a directory written in the binary format \
+        (see :meth:`Sfs.dump`), its arrays are memory-mapped \
+        instead of being read into memory.
+
         :param str,file f: file object or file name to read in
         :rtype: :class:`Sfs`
         """
+        if _is_binary_path(f):
+            return cls._load_binary(os.path.expanduser(f))
         if isinstance(f, str):
             fname = os.path.expanduser(f)
             if fname.endswith(".gz"):
@@ -125,17 +126,38 @@ class Sfs(object):
 
         return ret
 
+    @classmethod
+    def _load_binary(cls, dirname):
+        header, arrays = _load_arrays(dirname, cls.__name__)
+        configs = ConfigList(header.pop("sampled_pops"), arrays["configs"],
+                             sampled_n=header.pop("sampled_n"),
+                             ascertainment_pop=header.pop("ascertainment_pop"))
+        mat = scipy.sparse.csc_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=(len(configs), header.pop("n_loci")))
+        return cls(mat, configs, **header)
+
     def __init__(self, loci, configs, folded, length):
         self.folded = folded
         self._length = length
 
         self.configs = configs
 
-        self.loc_idxs, self.loc_counts = [], []
+        if scipy.sparse.issparse(loci):
+            # per-locus arrays are only built if needed, see _loc_idxs_counts
+            self._csc_freqs_matrix = scipy.sparse.csc_matrix(loci,
+                                                             dtype=float)
+            self._n_loci = self._csc_freqs_matrix.shape[1]
+            self._total_freqs = raw_np.asarray(
+                self._csc_freqs_matrix.sum(axis=1)).reshape((-1,))
+            assert not np.any(self._total_freqs == 0)
+            return
+
+        loc_idxs, loc_counts = [], []
         for loc in loci:
             if len(loc) == 0:
-                self.loc_idxs.append(np.array([], dtype=int))
-                self.loc_counts.append(np.array([], dtype=float))
+                loc_idxs.append(np.array([], dtype=int))
+                loc_counts.append(np.array([], dtype=float))
             else:
                 try:
                     loc.items()
@@ -148,27 +170,56 @@ class Sfs(object):
                         idxs, cnts = np.unique(loc, return_counts=True)
                 else:
                     idxs, cnts = zip(*loc.items())
-                self.loc_idxs.append(np.array(idxs, dtype=int))
-                self.loc_counts.append(np.array(cnts, dtype=float))
+                loc_idxs.append(np.array(idxs, dtype=int))
+                loc_counts.append(np.array(cnts, dtype=float))
+        self._loc_idxs_counts = (loc_idxs, loc_counts)
+        self._n_loci = len(loc_idxs)
 
-        if len(self.loc_idxs) > 1:
+        if len(loc_idxs) > 1:
             self._total_freqs = self.freqs_matrix.dot(np.ones(self.n_loci))
             assert self._total_freqs.shape == (self.freqs_matrix.shape[0],)
         else:
             # avoid costly building of frequency matrix, when there are many
             # Sfs's of a single locus (e.g. in many stochastic minibatches)
-            idxs, = self.loc_idxs
-            cnts, = self.loc_counts
+            idxs, = loc_idxs
+            cnts, = loc_counts
             self._total_freqs = np.zeros(len(self.configs))
             self._total_freqs[idxs] = cnts
 
         assert not np.any(self._total_freqs == 0)
 
+    @cached_property
+    def _loc_idxs_counts(self):
+        # only called if constructed from a sparse matrix
+        mat = self._csc_freqs_matrix
+        indptr = mat.indptr
+        loc_idxs, loc_counts = [], []
+        for i in range(mat.shape[1]):
+            loc_idxs.append(np.array(
+                mat.indices[indptr[i]:indptr[i+1]], dtype=int))
+            loc_counts.append(np.array(
+                mat.data[indptr[i]:indptr[i+1]], dtype=float))
+        return loc_idxs, loc_counts
+
+    @property
+    def loc_idxs(self):
+        return self._loc_idxs_counts[0]
+
+    @property
+    def loc_counts(self):
+        return self._loc_idxs_counts[1]
+
     def dump(self, f):
         """Write Sfs to file
 
-        :param str,file f: Filename or object. If name ends with ".gz" gzip it.
+        :param str,file f: Filename or object. If name ends with ".gz" gzip it. \
+        If name ends with ".momi", write a directory of binary arrays, \
+        which is much faster to write and read, and is memory-mapped \
+        by :meth:`Sfs.load`.
         """
+        if _is_binary_path(f):
+            self._dump_binary(os.path.expanduser(f))
+            return
         if isinstance(f, str):
             fname = os.path.expanduser(f)
             if fname.endswith(".gz"):
@@ -212,6 +263,24 @@ class Sfs(object):
         print("\t]", file=f)
         print("}", file=f)
 
+    def _dump_binary(self, dirname):
+        try:
+            mat = self._csc_freqs_matrix
+        except AttributeError:
+            mat = self.csr_freqs_matrix.tocsc()
+        header = {
+            "sampled_pops": list(self.sampled_pops),
+            "sampled_n": [int(n) for n in self.sampled_n],
+            "ascertainment_pop": [bool(a) for a in self.ascertainment_pop],
+            "folded": self.folded,
+            "length": self._length,
+            "n_loci": self.n_loci}
+        _dump_arrays(dirname, type(self).__name__, header, {
+            "configs": self.configs.value,
+            "indptr": mat.indptr,
+            "indices": mat.indices,
+            "data": mat.data})
+
     @property
     def populations(self):
         return self.sampled_pops
@@ -235,6 +304,10 @@ class Sfs(object):
 
     @cached_property
     def csr_freqs_matrix(self):
+        try:
+            return self._csc_freqs_matrix.tocsr()
+        except AttributeError:
+            pass
         return _csr_freq_matrix_from_counters(
             self.loc_idxs, self.loc_counts, len(self.configs))
 
@@ -250,17 +323,25 @@ class Sfs(object):
 
         return self.freqs_matrix.T.dot(p_het)
 
-    def resample(self):
+    def resample(self, rgen=None):
         """Create a new SFS by resampling blocks with replacement.
 
         Note the resampled SFS is assumed to have the same length in base pairs \
         as the original SFS, which may be a poor assumption if the blocks are not of equal length.
 
+        :param numpy.random.RandomState rgen: Random generator. \
+        If None, use :mod:`numpy.random`.
         :returns: Resampled SFS
         :rtype: :class:`Sfs`
         """
-        loci = np.random.choice(
+        if rgen is None:
+            rgen = np.random
+        loci = rgen.choice(
             np.arange(self.n_loci), size=self.n_loci, replace=True)
+        return self._subset_loci(loci)
+
+    def _subset_loci(self, loci):
+        # SFS of the given loci (with repeats), keeping the same length
         mat = self.freqs_matrix[:, loci]
         to_keep = np.asarray(mat.sum(axis=1) > 0).squeeze()
         to_keep = np.arange(len(self.configs))[to_keep]
@@ -300,7 +381,7 @@ class Sfs(object):
 
         :rtype: int
         """
-        return len(self.loc_idxs)
+        return self._n_loci
 
     @property
     def n_nonzero_entries(self):
@@ -448,8 +529,7 @@ class Sfs(object):
     def _integrate_sfs(self, weights, vector=False, locus=None):
         if vector:
             assert locus is None
-            return np.array([self._integrate_sfs(weights, locus=loc)
-                             for loc in range(self.n_loci)])
+            return _sparse_dot(weights, self.freqs_matrix, True)
         if locus is None:
             idxs, counts = slice(None), self._total_freqs
         else:
@@ -592,6 +672,7 @@ def _get_subsample_counts(configs, n):
         if np.any(subsample_n > configs.sampled_n):
             continue
 
+        sfs_entries = []
         for sfs_entry in it.product(*(range(sub_n + 1)
                                       for sub_n in subsample_n)):
             sfs_entry = np.array(sfs_entry, dtype=int)
@@ -599,8 +680,13 @@ def _get_subsample_counts(configs, n):
                 # monomorphic
                 continue
 
-            sfs_entry = np.transpose([subsample_n - sfs_entry, sfs_entry])
-            cnt_vec = configs.subsample_probs(sfs_entry)
+            sfs_entries.append(
+                np.transpose([subsample_n - sfs_entry, sfs_entry]))
+        if not sfs_entries:
+            continue
+
+        cnt_vecs = configs.batch_subsample_probs(sfs_entries)
+        for sfs_entry, cnt_vec in zip(sfs_entries, np.transpose(cnt_vecs)):
             if not np.all(cnt_vec == 0):
                 subconfigs.append(sfs_entry)
                 weights.append(cnt_vec)
@@ -610,3 +696,20 @@ def _get_subsample_counts(configs, n):
 
 class SimpleNamespace(object):
     pass
+
+
+@primitive
+def _sparse_dot(v, mat, transpose):
+    """
+    mat.dot(v) for a sparse matrix mat,
+    or mat.T.dot(v) if transpose is True
+    """
+    if transpose:
+        mat = mat.T
+    return mat.dot(v)
+
+
+defvjp(_sparse_dot,
+       lambda ans, v, mat, transpose: lambda g: _sparse_dot(
+           g, mat, not transpose),
+       None, None)
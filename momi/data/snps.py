@@ -1,23 +1,56 @@
 import os
 import itertools as it
-from collections import defaultdict, Counter
 import json
 import re
 import gzip
 import logging
+import multiprocessing
 import numpy as np
 import pysam
+import scipy.sparse
 from cached_property import cached_property
 from .configurations import ConfigList
 from .sfs import Sfs
 from ..util import memoize_instance
 from .compressed_counts import (
-    CompressedAlleleCounts, _CompressedHashedCounts, _CompressedList)
+    CompressedAlleleCounts, _CompressedHashedCounts, _CompressedList,
+    _unique_rows)
+from .binary_io import _is_binary_path, _dump_arrays, _load_arrays
 
 
 logger = logging.getLogger(__name__)
 
 
+def _genotype_array(gt_list):
+    """
+    Convert a list (over SNPs) of lists (over samples) of allele_indices
+    into an array of shape (n_snps, n_samples, ploidy),
+    with missing alleles represented by nan.
+    """
+    try:
+        return np.array(gt_list, dtype=float)
+    except ValueError:
+        # samples have different ploidies, so pad with missing values
+        ploidy = max(len(a) for gts in gt_list for a in gts)
+        return np.array([[tuple(a) + (None,) * (ploidy - len(a))
+                          for a in gts] for gts in gt_list], dtype=float)
+
+
+def _read_bed_regions(bed_file):
+    if bed_file.endswith(".gz"):
+        bed = gzip.open(bed_file, "rt")
+    else:
+        bed = open(bed_file)
+    regions = []
+    with bed:
+        for line in bed:
+            line = line.split()
+            contig = line[0]
+            start, end = map(int, line[1:3])
+            regions.append((contig, start, end))
+    return regions
+
+
 def snp_allele_counts(chrom_ids, positions, populations,
                       ancestral_counts, derived_counts,
                       length=None, use_folded_sfs=False):
@@ -65,7 +98,7 @@ class SnpAlleleCounts(object):
     @classmethod
     def read_vcf(cls, vcf_file, ind2pop,
                  bed_file=None, ancestral_alleles=True,
-                 info_aa_field="AA"):
+                 info_aa_field="AA", processes=1):
         """Read in a VCF file and return the allele counts at biallelic SNPs.
 
         :param str vcf_file: VCF file to read in. "-" reads from stdin.
@@ -87,9 +120,60 @@ class SnpAlleleCounts(object):
         consensus are skipped.
         :param str info_aa_field: The INFO field to read Ancestral Allele from. \
         Default is "AA". Only has effect if ``ancestral_alleles=True``.
+        :param int processes: Number of processes to read the VCF with. \
+        If greater than 1, the regions of the BED file (or the contigs in \
+        the index of the VCF, if no BED is provided) are split into shards \
+        that are read in parallel and then concatenated. This requires \
+        the VCF to be indexed, and the SNPs are returned sorted by \
+        chromosome and position.
 
         :rtype: :class:`SnpAlleleCounts`
         """
+        if bed_file:
+            regions = _read_bed_regions(bed_file)
+        else:
+            regions = None
+            logger.warn("No BED provided, will need to specify length"
+                        " manually with mutation rate")
+
+        if processes > 1:
+            if vcf_file == "-":
+                raise ValueError("Cannot read VCF from stdin with"
+                                 " multiple processes")
+            if regions is None:
+                index = pysam.VariantFile(vcf_file).index
+                if index is None:
+                    raise ValueError("VCF must be indexed to read it with"
+                                     " multiple processes")
+                regions = [(contig, None, None) for contig in index]
+
+            # use more shards than processes, for load balancing
+            n_shards = min(len(regions), 4 * processes)
+            shards = [list(shard) for shard in np.array_split(
+                np.arange(len(regions)), n_shards)]
+            shard_args = [
+                (vcf_file, ind2pop, [regions[i] for i in shard],
+                 bed_file is not None, ancestral_alleles, info_aa_field)
+                for shard in shards]
+            logger.info("Reading VCF in {} shards with {} processes".format(
+                len(shards), processes))
+            with multiprocessing.Pool(processes) as pool:
+                ret = cls.concatenate(
+                    pool.starmap(cls._read_vcf_regions, shard_args))
+        else:
+            ret = cls._read_vcf_regions(
+                vcf_file, ind2pop, regions, bed_file is not None,
+                ancestral_alleles, info_aa_field)
+
+        if len(ret) == 0:
+            logger.warn("No valid SNPs read! Try setting "
+                        "ancestral_alleles=False.")
+        return ret
+
+    @classmethod
+    def _read_vcf_regions(cls, vcf_file, ind2pop, regions, count_length,
+                          ancestral_alleles, info_aa_field):
+        # if regions is None, read the whole VCF
         bcf_in = pysam.VariantFile(vcf_file)
 
         # subset samples for faster VCF parsing
@@ -98,11 +182,18 @@ class SnpAlleleCounts(object):
         assert set(samples) == set(ind2pop.keys())
 
         # extract populations, samples
-        pop2idxs = defaultdict(list)
-        for ind, pop in ind2pop.items():
-            pop2idxs[pop].append(samples.index(ind))
         sampled_pops = sorted(
-            p for p in pop2idxs.keys() if p != ancestral_alleles)
+            set(p for p in ind2pop.values() if p != ancestral_alleles))
+        all_pops = list(sampled_pops)
+        if ancestral_alleles not in (True, False):
+            # the outgroup is the last row of pop_mat
+            all_pops.append(ancestral_alleles)
+
+        # pop_mat[i, j] = 1 if sample j is in population i
+        pop_mat = np.zeros((len(all_pops), len(samples)), dtype=int)
+        for j, ind in enumerate(samples):
+            pop_mat[all_pops.index(ind2pop[ind]), j] = 1
+        pop_mat = scipy.sparse.csr_matrix(pop_mat)
 
         # objects to store chrom, pos, configs
         chrom_list = _CompressedList()
@@ -110,44 +201,22 @@ class SnpAlleleCounts(object):
         compressed_hashed = _CompressedHashedCounts(len(sampled_pops))
         excluded = []
 
-        # pre-allocate objects for temporary configs
-        pop_allele_counts = {pop: Counter() for pop in pop2idxs.keys()}
-        config = np.zeros((len(sampled_pops), 2), dtype=int)
-
-        if bed_file:
-            def open_bed():
-                if bed_file.endswith(".gz"):
-                    return gzip.open(bed_file, "rt")
-                else:
-                    return open(bed_file)
-            length = 0
-            with open_bed() as bed:
-                for line in bed:
-                    line = line.split()
-                    contig = line[0]
-                    start, end = map(int, line[1:3])
-                    length += (end - start)
-                    fetcher = bcf_in.fetch(
-                        contig, start, end)
-                    cls._read_vcf_helper(
-                        fetcher, chrom_list, pos_list,
-                        compressed_hashed, excluded,
-                        ancestral_alleles, pop2idxs,
-                        sampled_pops, pop_allele_counts, config,
-                        info_aa_field)
+        if regions is None:
+            fetchers = [bcf_in.fetch()]
         else:
-            length = None
-            logger.warn("No BED provided, will need to specify length"
-                        " manually with mutation rate")
-            fetcher = bcf_in.fetch()
+            fetchers = (bcf_in.fetch(contig, start, end)
+                        for contig, start, end in regions)
+
+        for fetcher in fetchers:
             cls._read_vcf_helper(
-                fetcher, chrom_list, pos_list, compressed_hashed,
-                excluded, ancestral_alleles, pop2idxs, sampled_pops,
-                pop_allele_counts, config, info_aa_field)
+                fetcher, chrom_list, pos_list,
+                compressed_hashed, excluded,
+                ancestral_alleles, pop_mat, info_aa_field)
 
-        if len(compressed_hashed) == 0:
-            logger.warn("No valid SNPs read! Try setting "
-                        "ancestral_alleles=False.")
+        if count_length:
+            length = sum(end - start for _, start, end in regions)
+        else:
+            length = None
 
         return cls(chrom_list, pos_list,
                    compressed_hashed.compressed_allele_counts(),
@@ -157,56 +226,79 @@ class SnpAlleleCounts(object):
     @classmethod
     def _read_vcf_helper(
             cls, bcf_in_fetch, chrom, pos, compressed_hashed, excluded,
-            ancestral_alleles, pop2idxs, sampled_pops,
-            pop_allele_counts, config, info_aa_field):
+            ancestral_alleles, pop_mat, info_aa_field, batch_size=1000):
+        # records are processed in batches, to count the alleles
+        # and hash the configs with vectorized operations
+        batch_chrom, batch_pos, batch_aa, batch_gt = [], [], [], []
         for rec in bcf_in_fetch:
             if len(rec.alleles) != 2:
                 continue
 
-            for pop, inds in pop2idxs.items():
-                pop_allele_counts[pop].clear()
-                for i in inds:
-                    for a in rec.samples[i].allele_indices:
-                        if a is not None:
-                            pop_allele_counts[pop][a] += 1
-
             if ancestral_alleles is True:
                 try:
-                    aa = rec.info[info_aa_field]
-                except KeyError:
+                    aa = rec.alleles.index(rec.info[info_aa_field])
+                except (KeyError, ValueError):
                     excluded.append((rec.chrom, rec.pos))
                     continue
-                else:
-                    try:
-                        aa = rec.alleles.index(aa)
-                    except ValueError:
-                        excluded.append((rec.chrom, rec.pos))
-                        continue
-            elif ancestral_alleles:
-                outgroup_counts = pop_allele_counts[ancestral_alleles]
-                if len(outgroup_counts) != 1:
-                    excluded.append((rec.chrom, rec.pos))
-                    continue
-                aa, = outgroup_counts.keys()
             else:
+                # for outgroup, aa is determined from the batch below
                 aa = 0
 
-            config *= 0
-            for pop_idx, pop in enumerate(sampled_pops):
-                for a, n in pop_allele_counts[pop].items():
-                    config[pop_idx, a] = n
-
-            if aa == 1:
-                config = config[:, ::-1]
+            batch_chrom.append(rec.chrom)
+            batch_pos.append(rec.pos)
+            batch_aa.append(aa)
+            # NOTE pysam only exposes genotypes per sample, so this loop
+            # is still per record and dominates the reading time
+            batch_gt.append([s.allele_indices for s in rec.samples.values()])
+
+            if len(batch_pos) == batch_size:
+                prev_len = len(pos)
+                cls._add_vcf_batch(
+                    batch_chrom, batch_pos, batch_aa, batch_gt,
+                    chrom, pos, compressed_hashed, excluded,
+                    ancestral_alleles, pop_mat)
+                batch_chrom, batch_pos, batch_aa, batch_gt = [], [], [], []
+                if len(pos) // 10000 > prev_len // 10000:
+                    logger.info("Read vcf up to CHR {}, POS {}".format(
+                        chrom[-1], pos[-1]))
+
+        if batch_pos:
+            cls._add_vcf_batch(
+                batch_chrom, batch_pos, batch_aa, batch_gt,
+                chrom, pos, compressed_hashed, excluded,
+                ancestral_alleles, pop_mat)
 
-            compressed_hashed.append(config)
-
-            chrom.append(rec.chrom)
-            pos.append(rec.pos)
-
-            if len(pos) % 10000 == 0:
-                logger.info("Read vcf up to CHR {}, POS {}".format(
-                    chrom[-1], pos[-1]))
+    @classmethod
+    def _add_vcf_batch(cls, batch_chrom, batch_pos, batch_aa, batch_gt,
+                       chrom, pos, compressed_hashed, excluded,
+                       ancestral_alleles, pop_mat):
+        # gt[snp, sample, k] is the k-th allele of the sample (nan if missing)
+        gt = _genotype_array(batch_gt)
+        # configs[snp, pop, a] is the count of allele a in the population
+        configs = np.stack([pop_mat.dot((gt == a).sum(axis=2).T).T
+                            for a in (0, 1)], axis=2)
+        aa = np.array(batch_aa, dtype=int)
+
+        if ancestral_alleles not in (True, False):
+            outgroup = configs[:, -1, :]
+            configs = configs[:, :-1, :]
+            # keep the SNPs where the outgroup has a consensus allele
+            keep = (outgroup > 0).sum(axis=1) == 1
+            aa = (outgroup[:, 1] > 0).astype(int)
+
+            for i in np.arange(len(keep))[~keep]:
+                excluded.append((batch_chrom[i], batch_pos[i]))
+            keep_idxs = np.arange(len(keep))[keep]
+            batch_chrom = [batch_chrom[i] for i in keep_idxs]
+            batch_pos = [batch_pos[i] for i in keep_idxs]
+            configs, aa = configs[keep], aa[keep]
+
+        flip = aa == 1
+        configs[flip] = configs[flip, :, ::-1]
+
+        compressed_hashed.extend(configs)
+        chrom.extend(batch_chrom)
+        pos.extend(batch_pos)
 
     @classmethod
     def concatenate(cls, to_concatenate):
@@ -221,8 +313,8 @@ class SnpAlleleCounts(object):
         nonascertained = list(first.non_ascertained_pops)
         to_concatenate = it.chain([first], to_concatenate)
 
-        #chrom_ids = []
-        chrom_ids = _CompressedList()
+        chrom_values = _CompressedList()
+        chrom_codes = []
         positions = []
         index2uniq = []
 
@@ -241,19 +333,26 @@ class SnpAlleleCounts(object):
                 raise ValueError(
                     "Datasets must have same populations with same"
                     " ascertainment to concatenate")
-            old2new_uniq = []
-            for config in snp_cnts.compressed_counts.config_array:
-                compressed_hashes.append(config)
-                old2new_uniq.append(compressed_hashes.index2uniq(-1))
+            old2new_uniq = compressed_hashes.uniq_idxs(
+                snp_cnts.compressed_counts.config_array)
 
             assert len(snp_cnts.chrom_ids) == len(snp_cnts.compressed_counts.index2uniq)
             assert len(snp_cnts.chrom_ids) == len(snp_cnts.positions)
-            for chrom, pos, old_uniq in zip(snp_cnts.chrom_ids,
-                                            snp_cnts.positions,
-                                            snp_cnts.compressed_counts.index2uniq):
-                chrom_ids.append(chrom)
-                positions.append(pos)
-                index2uniq.append(old2new_uniq[old_uniq])
+            curr_chroms = snp_cnts.chrom_ids
+            if not isinstance(curr_chroms, _CompressedList):
+                curr_chroms = _CompressedList(curr_chroms)
+            # map the unique chromosomes to the concatenated ones
+            old2new_chrom = []
+            for chrom in curr_chroms.uniq_values:
+                chrom_values.append(chrom)
+                old2new_chrom.append(chrom_values.index2uniq[-1])
+            old2new_chrom = np.array(old2new_chrom, dtype=int)
+            curr_codes = np.asarray(curr_chroms.index2uniq, dtype=int)
+
+            chrom_codes.append(old2new_chrom[curr_codes])
+            positions.append(np.asarray(snp_cnts.positions))
+            index2uniq.append(
+                old2new_uniq[snp_cnts.compressed_counts.index2uniq])
 
             try:
                 length += snp_cnts.length
@@ -263,12 +362,29 @@ class SnpAlleleCounts(object):
             n_read_snps += snp_cnts.n_read_snps
             n_excluded_snps += snp_cnts.n_excluded_snps
 
-            for k, v in Counter(snp_cnts.chrom_ids).items():
-                logger.info("Added {} SNPs from Chromosome {}".format(v, k))
+            for k, v in zip(curr_chroms.uniq_values,
+                            np.bincount(curr_codes,
+                                        minlength=len(old2new_chrom))):
+                if v > 0:
+                    logger.info("Added {} SNPs from Chromosome {}".format(
+                        v, k))
+
+        chrom_codes = np.concatenate(chrom_codes)
+        positions = np.concatenate(positions)
+        index2uniq = np.concatenate(index2uniq)
 
         # make sure the positions are sorted
-        chrom_ids, positions, index2uniq = zip(*sorted(zip(
-            chrom_ids, positions, index2uniq)))
+        chrom_values = chrom_values.uniq_values
+        chrom_rank = np.empty(len(chrom_values), dtype=int)
+        chrom_rank[sorted(range(len(chrom_values)),
+                          key=lambda i: chrom_values[i])] = np.arange(
+                              len(chrom_values))
+        sorted_idxs = np.lexsort((index2uniq, positions,
+                                  chrom_rank[chrom_codes]))
+        chrom_ids = _CompressedList._from_arrays(
+            chrom_values, chrom_codes[sorted_idxs].tolist())
+        positions = positions[sorted_idxs]
+        index2uniq = index2uniq[sorted_idxs]
 
         compressed_counts = CompressedAlleleCounts(
             compressed_hashes.config_array(), index2uniq)
@@ -286,9 +402,15 @@ class SnpAlleleCounts(object):
         """Load :class:`SnpAlleleCounts` created \
         from :meth:`SnpAlleleCounts.dump` or ``python -m momi.read_vcf ...``
 
+        If ``f`` is a directory written in the binary format \
+        (see :meth:`SnpAlleleCounts.dump`), its arrays are memory-mapped \
+        instead of being read into memory.
+
         :param str,file f: file object or file name to read in
         :rtype: :class:`SnpAlleleCounts`
         """
+        if _is_binary_path(f):
+            return cls._load_binary(f)
         if isinstance(f, str):
             if f.endswith(".gz"):
                 with gzip.open(f, "rt") as gf:
@@ -377,12 +499,29 @@ class SnpAlleleCounts(object):
         return cls(chrom_ids, positions, compressed_counts,
                    **items)
 
+    @classmethod
+    def _load_binary(cls, dirname):
+        header, arrays = _load_arrays(dirname, cls.__name__)
+        chrom_ids = _CompressedList._from_arrays(
+            header.pop("chrom_values"), arrays["chrom_index"])
+        compressed_counts = CompressedAlleleCounts(
+            arrays["configs"], arrays["config_index"], sort=False)
+        return cls(chrom_ids, arrays["positions"], compressed_counts,
+                   **header)
+
     def dump(self, f):
-        """Write data in JSON format.
+        """Write data in JSON format, or in a binary format.
 
         :param str,file f: filename or file object. \
-        If a filename, the resulting file is gzipped.
+        If the filename ends with ".gz", the resulting file is gzipped. \
+        If the filename ends with ".momi", the data is written to a \
+        directory of binary arrays, which is much faster to write and \
+        read, and is memory-mapped by :meth:`SnpAlleleCounts.load`.
         """
+        if _is_binary_path(f):
+            self._dump_binary(f)
+            return
+
         if isinstance(f, str):
             if f.endswith(".gz"):
                 with gzip.open(f, "wt") as gf:
@@ -429,6 +568,26 @@ class SnpAlleleCounts(object):
         print("\t]", file=f)
         print("}", file=f)
 
+    def _dump_binary(self, dirname):
+        chrom_ids = self.chrom_ids
+        if not isinstance(chrom_ids, _CompressedList):
+            chrom_ids = _CompressedList(chrom_ids)
+        header = {
+            "populations": list(self.populations),
+            "non_ascertained_pops": list(self.non_ascertained_pops),
+            "use_folded_sfs": self.use_folded_sfs,
+            "length": self.length,
+            "n_read_snps": self.n_read_snps,
+            "n_excluded_snps": self.n_excluded_snps,
+            # item() converts numpy scalars to python types for json
+            "chrom_values": [np.asarray(c).item()
+                             for c in chrom_ids.uniq_values]}
+        _dump_arrays(dirname, type(self).__name__, header, {
+            "chrom_index": np.asarray(chrom_ids.index2uniq, dtype=int),
+            "positions": self.positions,
+            "configs": self.compressed_counts.config_array,
+            "config_index": self.compressed_counts.index2uniq})
+
     def __init__(self, chrom_ids, positions,
                  compressed_counts, populations,
                  use_folded_sfs, non_ascertained_pops, length,
@@ -439,7 +598,8 @@ class SnpAlleleCounts(object):
                 "chrom_ids, positions, allele_counts should have same length")
 
         self.chrom_ids = chrom_ids
-        self.positions = np.array(positions)
+        # asarray() avoids copying memory-mapped arrays
+        self.positions = np.asarray(positions)
         self.compressed_counts = compressed_counts
         self.populations = populations
         self.non_ascertained_pops = non_ascertained_pops
@@ -504,14 +664,13 @@ class SnpAlleleCounts(object):
         newPopIdx_to_oldPopIdx = np.array([
             self.populations.index(p) for p in populations], dtype=int)
 
-        uniq_new_configs = CompressedAlleleCounts.from_iter(
+        uniq_new_configs = CompressedAlleleCounts.from_array(
             self.compressed_counts.config_array[:, newPopIdx_to_oldPopIdx, :],
-            len(populations), sort=False)
+            sort=False)
 
         new_compressed_configs = CompressedAlleleCounts(
             uniq_new_configs.config_array,
-            [uniq_new_configs.index2uniq[i]
-             for i in self.compressed_counts.index2uniq],
+            uniq_new_configs.index2uniq[self.compressed_counts.index2uniq],
             sort=False)
 
         return SnpAlleleCounts(
@@ -624,3 +783,250 @@ class SnpAlleleCounts(object):
         n_exclude = self.n_excluded_snps
 
         return n_exclude / (n_read + n_exclude)
+
+
+class SfsAccumulator(object):
+    """
+    Accumulates the SFS of SNPs that arrive in chunks, e.g. \
+    successive batches of sequencing data, or slices of a VCF.
+
+    Only the unique configs and their counts in each block are stored, \
+    so memory does not grow with the number of SNPs added, and \
+    :meth:`SfsAccumulator.extract_sfs` can be called at any time \
+    without re-reading the previous chunks.
+
+    :param list populations: the population names
+    :param int,None block_size: Size (in bases) of the blocks the SFS \
+    is split into, for jackknifing and bootstrapping: a SNP at \
+    position ``pos`` of chromosome ``chrom`` is in the block \
+    ``(chrom, pos // block_size)``. If None, each chromosome is a block.
+    :param bool use_folded_sfs: whether the folded SFS should \
+    be used when computing likelihoods.
+    :param list,None non_ascertained_pops: Don't ascertain SNPs \
+    within these populations.
+    """
+    def __init__(self, populations, block_size=None,
+                 use_folded_sfs=False, non_ascertained_pops=None):
+        self.populations = list(populations)
+        self.block_size = block_size
+        self.use_folded_sfs = use_folded_sfs
+        if non_ascertained_pops is None:
+            non_ascertained_pops = []
+        self.non_ascertained_pops = list(non_ascertained_pops)
+        self.length = 0
+        self.n_read_snps = 0
+        self.n_excluded_snps = 0
+
+        self._configs = _CompressedHashedCounts(len(self.populations))
+        self._block_keys = []
+        self._block2idx = {}
+        # the (config, block, count) triples, with duplicate
+        # (config, block) pairs summed up when the triples are compacted
+        self._triples = [np.zeros((3, 0), dtype=int)]
+        self._n_compacted = 0
+
+    def add_configs(self, chrom_ids, positions, configs, length=None):
+        """Add a chunk of SNPs.
+
+        :param iterator chrom_ids: the CHROM at each SNP
+        :param iterator positions: the POS at each SNP
+        :param numpy.ndarray configs: array with shape \
+        ``(n_snps, n_populations, 2)``, where ``configs[i, p, a]`` is \
+        the count of allele ``a`` (0=ancestral, 1=derived) in \
+        population ``p`` at SNP ``i``
+        :param float,None length: length of the chunk in bases. \
+        If None, the length of the accumulated data becomes unknown.
+        """
+        configs = np.asarray(configs, dtype=int)
+        if configs.shape[1:] != (len(self.populations), 2):
+            raise ValueError(
+                "configs should have shape (n_snps, {}, 2)".format(
+                    len(self.populations)))
+        self._add_snps(chrom_ids, positions,
+                       self._configs.uniq_idxs(configs))
+        self._add_totals(length, len(configs), 0)
+
+    def add_snp_allele_counts(self, snp_counts):
+        """Add the SNPs of a :class:`SnpAlleleCounts`.
+
+        :param SnpAlleleCounts snp_counts: SNPs to add. Must have the \
+        same populations and ascertainment as the accumulator.
+        """
+        self._check_compatible(snp_counts)
+        old2new_uniq = self._configs.uniq_idxs(
+            snp_counts.compressed_counts.config_array)
+        self._add_snps(
+            snp_counts.chrom_ids, snp_counts.positions,
+            old2new_uniq[snp_counts.compressed_counts.index2uniq])
+        self.use_folded_sfs = (self.use_folded_sfs or
+                               snp_counts.use_folded_sfs)
+        self._add_totals(snp_counts.length, snp_counts.n_read_snps,
+                         snp_counts.n_excluded_snps)
+
+    def add_vcf(self, vcf_file, ind2pop, regions=None,
+                ancestral_alleles=True, info_aa_field="AA"):
+        """Add the biallelic SNPs of a VCF, or of some regions of it.
+
+        :param str vcf_file: VCF file to read in. "-" reads from stdin.
+        :param dict ind2pop: Maps individual samples to populations.
+        :param list,None regions: list of ``(contig, start, end)`` \
+        regions to read; requires the VCF to be indexed. The total size \
+        of the regions is added to the length of the data. \
+        If None, all SNPs in the VCF are read, and the length of the \
+        data becomes unknown.
+        :param bool,str ancestral_alleles: see \
+        :meth:`SnpAlleleCounts.read_vcf`
+        :param str info_aa_field: see :meth:`SnpAlleleCounts.read_vcf`
+        """
+        self.add_snp_allele_counts(SnpAlleleCounts._read_vcf_regions(
+            vcf_file, ind2pop, regions, regions is not None,
+            ancestral_alleles, info_aa_field))
+
+    def merge(self, other):
+        """Add the SNPs accumulated by another :class:`SfsAccumulator`.
+
+        :param SfsAccumulator other: Must have the same populations, \
+        ascertainment, and ``block_size``.
+        """
+        self._check_compatible(other)
+        if other.block_size != self.block_size:
+            raise ValueError(
+                "Accumulators must have same block_size to merge")
+        config_idxs, block_idxs, counts = other._compacted_triples()
+        old2new_uniq = self._configs.uniq_idxs(
+            other._configs.config_array())
+        old2new_block = np.array([self._block_idx(key)
+                                  for key in other._block_keys], dtype=int)
+        self._add_triples(old2new_uniq[config_idxs],
+                          old2new_block[block_idxs], counts)
+        self.use_folded_sfs = self.use_folded_sfs or other.use_folded_sfs
+        self._add_totals(other.length, other.n_read_snps,
+                         other.n_excluded_snps)
+
+    def extract_sfs(self):
+        """Extracts SFS from the SNPs added so far.
+
+        Raises :class:`ValueError` if no SNPs polymorphic in the \
+        ascertained populations have been added yet.
+
+        :rtype: :class:`Sfs`
+        """
+        config_idxs, block_idxs, counts = self._compacted_triples()
+        config_array = self._configs.config_array()
+        ascertainment_pop = np.array([
+            (pop not in self.non_ascertained_pops)
+            for pop in self.populations], dtype=bool)
+        ascertained_only = config_array[:, ascertainment_pop, :]
+        is_polymorphic = (ascertained_only.sum(axis=1) != 0).all(axis=1)
+
+        keep = is_polymorphic[config_idxs]
+        config_idxs, block_idxs = config_idxs[keep], block_idxs[keep]
+        kept_configs = np.unique(config_idxs)
+        kept_blocks = np.unique(block_idxs)
+        if len(kept_configs) == 0:
+            # the sample sizes of an empty SFS are unknown
+            raise ValueError("no polymorphic SNPs accumulated yet")
+
+        # sort the configs as in CompressedAlleleCounts
+        compressed_counts = CompressedAlleleCounts(
+            config_array[kept_configs], np.arange(len(kept_configs)))
+        old2new_config = np.zeros(len(config_array), dtype=int)
+        old2new_config[kept_configs] = compressed_counts.index2uniq
+        old2new_block = np.zeros(len(self._block_keys), dtype=int)
+        old2new_block[kept_blocks] = np.arange(len(kept_blocks))
+
+        mat = scipy.sparse.csc_matrix(
+            (counts[keep], (old2new_config[config_idxs],
+                            old2new_block[block_idxs])),
+            shape=(len(kept_configs), len(kept_blocks)))
+        configs = ConfigList(
+            self.populations, compressed_counts.config_array,
+            ascertainment_pop=ascertainment_pop)
+
+        n_snps = self.n_read_snps + self.n_excluded_snps
+        if self.length and n_snps:
+            length = self.length * (1 - self.n_excluded_snps / n_snps)
+        else:
+            length = self.length or None
+        ret = Sfs.from_matrix(mat, configs, folded=False, length=length)
+        if self.use_folded_sfs:
+            ret = ret.fold()
+        return ret
+
+    def _check_compatible(self, other):
+        if any([list(other.populations) != self.populations,
+                list(other.non_ascertained_pops) !=
+                self.non_ascertained_pops]):
+            raise ValueError(
+                "Datasets must have same populations with same"
+                " ascertainment to accumulate")
+
+    def _add_totals(self, length, n_read_snps, n_excluded_snps):
+        try:
+            self.length += length
+        except TypeError:
+            self.length = None
+        self.n_read_snps += n_read_snps
+        self.n_excluded_snps += n_excluded_snps
+
+    def _add_snps(self, chrom_ids, positions, config_idxs):
+        if len(chrom_ids) != len(config_idxs) or len(positions) != len(
+                config_idxs):
+            raise ValueError(
+                "chrom_ids, positions, configs should have same length")
+        if len(config_idxs) == 0:
+            return
+        if isinstance(chrom_ids, _CompressedList):
+            chrom_values = chrom_ids.uniq_values
+            chrom_codes = np.asarray(chrom_ids.index2uniq, dtype=int)
+        else:
+            chrom_values, chrom_codes = np.unique(
+                np.asarray(chrom_ids), return_inverse=True)
+        if self.block_size is None:
+            windows = np.zeros(len(chrom_codes), dtype=int)
+        else:
+            windows = np.asarray(positions, dtype=int) // self.block_size
+
+        # only look up the unique blocks of the chunk
+        uniq, inverse = _unique_rows(np.stack([chrom_codes, windows], axis=1))
+        block_idxs = []
+        for code, window in uniq:
+            chrom = np.asarray(chrom_values[code]).item()
+            if self.block_size is None:
+                block_idxs.append(self._block_idx(chrom))
+            else:
+                block_idxs.append(self._block_idx((chrom, int(window))))
+        block_idxs = np.array(block_idxs, dtype=int)[inverse]
+
+        self._add_triples(config_idxs, block_idxs,
+                          np.ones(len(config_idxs), dtype=int))
+
+    def _block_idx(self, key):
+        try:
+            return self._block2idx[key]
+        except KeyError:
+            self._block2idx[key] = len(self._block_keys)
+            self._block_keys.append(key)
+            return self._block2idx[key]
+
+    def _add_triples(self, config_idxs, block_idxs, counts):
+        self._triples.append(np.array([config_idxs, block_idxs, counts],
+                                      dtype=int))
+        # compact once the uncompacted triples outnumber the compacted
+        # ones, so memory stays proportional to the nonzero counts
+        n_triples = sum(t.shape[1] for t in self._triples)
+        if n_triples - self._n_compacted > max(self._n_compacted, 10000):
+            self._compacted_triples()
+
+    def _compacted_triples(self):
+        config_idxs, block_idxs, counts = np.concatenate(
+            self._triples, axis=1)
+        mat = scipy.sparse.coo_matrix(
+            (counts, (config_idxs, block_idxs)),
+            shape=(len(self._configs.uniq_values), len(self._block_keys)))
+        # converting to csr sums the duplicate entries
+        mat = mat.tocsr().tocoo()
+        compacted = np.array([mat.row, mat.col, mat.data], dtype=int)
+        self._triples = [compacted]
+        self._n_compacted = compacted.shape[1]
+        return compacted
@@ -1,10 +1,12 @@
+import numpy as raw_np
 import autograd.numpy as np
 import pandas as pd
+from .configurations import _hypergeom_vecs
 from ..math_functions import symmetric_matrix, log_wishart_pdf, slogdet_pos
 from ..compute_sfs import expected_sfs_tensor_prod
 
 
-def sfs_tensor_prod(sfs, vecs):
+def sfs_tensor_prod(sfs, vecs, chunk_size=10000):
     """
     Viewing the SFS as a D-tensor (where D is the number of demes), this
     returns a 1d array whose j-th entry is a summary statistic given by the
@@ -21,6 +23,10 @@ def sfs_tensor_prod(sfs, vecs):
          with n[k]+1 columns, where n[k] is the number of samples in the
          k-th deme. The row vectors vecs[k][j,:] are multiplied against
          the SFS along the k-th mode, to obtain res[j].
+    chunk_size : int
+         the number of configs to multiply at a time; each chunk uses
+         memory proportional to chunk_size times the number of rows
+         of vecs.
 
     Returns
     -------
@@ -28,27 +34,43 @@ def sfs_tensor_prod(sfs, vecs):
         res[j] is the tensor multiplication of the sfs against the vectors
         vecs[0][j,:], vecs[1][j,:], ... along its tensor modes.
 
+    Notes
+    -----
+    If a config has missing data in deme k, vecs[k][j,i] is replaced by
+    the average of vecs[k][j,:] weighted by the hypergeometric probability
+    of the config given i derived alleles out of n[k], as for the
+    likelihood of the config in expected_sfs().
+
     See Also
     --------
     expected_sfs_tensor_prod : compute the expectation of sfs_tensor_prod for a
          randomly sampled sfs.
     """
-    res = 0.
-    #sfs = sfs.get_dict()
-    #entries, counts = list(zip(*list(sfs.items())))
-    #entries = np.array(entries, ndmin=3)
     entries = sfs.configs.value
     counts = sfs._total_freqs
 
     sampled_n = np.array([v.shape[1] - 1 for v in vecs], dtype=int)
-    if np.any(np.sum(entries, axis=2) != sampled_n):
-        raise NotImplementedError(
-            "SFS-tensor-product not implemented for missing data. Consider removing all entries with deficient sample size.")
-
-    for config, val in zip(entries, counts):
-        for d, (_, i) in zip(vecs, config):
-            val = val * d[:, i]
-        res = res + val
+    if np.any(np.sum(entries, axis=2) > sampled_n):
+        raise ValueError("There is a config that is larger than the number"
+                         " of columns of vecs")
+
+    # for each deme, multiply vecs against the distinct
+    # (ancestral, derived) counts, then gather the configs
+    deme_vecs, deme_idxs = [], []
+    for k, v in enumerate(vecs):
+        uniq, idxs = raw_np.unique(entries[:, k, :], axis=0,
+                                   return_inverse=True)
+        deme_vecs.append(np.dot(v, np.transpose(
+            _hypergeom_vecs(sampled_n[k], uniq))))
+        deme_idxs.append(idxs)
+
+    res = 0.
+    for start in range(0, len(entries), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        val = 1.
+        for v, idxs in zip(deme_vecs, deme_idxs):
+            val = val * v[:, idxs[chunk]]
+        res = res + np.dot(val, counts[chunk])
     return res
 
 # TODO: rewrite commented code
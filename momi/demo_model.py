@@ -1,9 +1,12 @@
+import os
 import json
 import autograd as ag
 import autograd.numpy as np
+from autograd.tracer import getval
 import scipy, scipy.stats
 import logging
 import collections as co
+import multiprocessing as mp
 import pandas as pd
 import matplotlib as mpl
 from matplotlib import pyplot as plt
@@ -12,7 +15,7 @@ from .sfs_stats import JackknifeGoodnessFitStat
 from .data.configurations import build_config_list
 from .data.sfs import Sfs
 from .demography import Demography
-from .likelihood import SfsLikelihoodSurface
+from .likelihood import SfsLikelihoodSurface, JackknifeSfsLikelihoodSurface
 from .compute_sfs import expected_total_branch_len, expected_sfs, expected_heterozygosity
 from .confidence_region import _ConfidenceRegion
 from .events import LeafEvent, SizeEvent, JoinEvent, PulseEvent, GrowthEvent
@@ -48,7 +51,7 @@ class DemographicModel(object):
         self.leafs = []
 
         self._set_data(sfs=None, length=None,
-                       mem_chunk_size=None,
+                       mem_chunk_size=None, memory_budget=None,
                        use_pairwise_diffs=None,
                        non_ascertained_pops=None)
 
@@ -70,6 +73,7 @@ class DemographicModel(object):
         ret.leafs.extend(self.leafs)
         ret._set_data(sfs=self._fullsfs, length=self._length,
                       mem_chunk_size=self._mem_chunk_size,
+                      memory_budget=self._memory_budget,
                       use_pairwise_diffs=self._use_pairwise_diffs,
                       non_ascertained_pops=self._non_ascertained_pops)
         return ret
@@ -572,14 +576,16 @@ class DemographicModel(object):
             self, sfs, length=None,
             mem_chunk_size=1000,
             non_ascertained_pops=None,
-            use_pairwise_diffs=True):
+            use_pairwise_diffs=True,
+            memory_budget=2**30):
         """Set dataset for the model.
 
         :param Sfs sfs: Observed SFS
         :param float length: Length of data in bases. Overrides ``sfs.length`` if set. Required if :attr:`DemoModel.muts_per_gen` is set and ``sfs.length`` is not.
-        :param mem_chunk_size: Controls memory usage by computing likelihood in chunks of SNPs. If ``-1`` then no chunking is done.
+        :param mem_chunk_size: Controls memory usage by computing likelihood in chunks of SNPs. If ``-1`` then no chunking is done. If ``"auto"`` then the chunk size is chosen from ``memory_budget``.
         :param non_ascertained_pops: Don't ascertain SNPs within these populations. That is, ignore all SNPs that are not polymorphic on the other populations. The SFS is adjusted to represent probabilities conditional on this ascertainment scheme.
         :param use_pairwise_diffs: Only has an effect if :attr:`DemoModel.muts_per_gen` is set. If ``False``, assumes the total number of mutations is Poisson. If True, models the within population nucleotide diversity (i.e. the average number of heterozygotes per population) as independent Poissons. If there is missing data this is required to be ``True``.
+        :param memory_budget: Only has an effect if ``mem_chunk_size="auto"``. Approximate number of bytes to use when computing the likelihood of a chunk of SNPs, estimated from the number of demes and lineages in the demography.
         """
         if not length:
             length = sfs.length
@@ -587,11 +593,12 @@ class DemographicModel(object):
         self._set_data(
             sfs=sfs, length=length,
             mem_chunk_size=mem_chunk_size,
+            memory_budget=memory_budget,
             use_pairwise_diffs=use_pairwise_diffs,
             non_ascertained_pops=non_ascertained_pops)
 
     def _set_data(self, sfs, length,
-                  mem_chunk_size, use_pairwise_diffs,
+                  mem_chunk_size, memory_budget, use_pairwise_diffs,
                   non_ascertained_pops):
         self._lik_surface = None
         self._conf_region = None
@@ -599,6 +606,7 @@ class DemographicModel(object):
         self._fullsfs = sfs
         self._length = length
         self._mem_chunk_size = mem_chunk_size
+        self._memory_budget = memory_budget
         self._use_pairwise_diffs = use_pairwise_diffs
         self._non_ascertained_pops = non_ascertained_pops
 
@@ -736,31 +744,35 @@ class DemographicModel(object):
         # TODO better message (e.g. "Building SFS...")
         logging.getLogger(__name__).info("Constructing likelihood surface...")
 
-        sfs = self._get_sfs().combine_loci()
+        self._lik_surface = self._build_surface(
+            self._get_sfs().combine_loci(), self._length)
+
+        logging.getLogger(__name__).info("Finished constructing likelihood surface")
+
+        return self._lik_surface
+
+    def _build_surface(self, sfs, length):
         use_pairwise_diffs = self._use_pairwise_diffs
 
         muts_per_gen = self.muts_per_gen
         if muts_per_gen is None:
             mut_rate = None
-        elif self._length is None:
+        elif length is None:
             raise ValueError("SFS is missing length attribute, need to manually set length in set_data(), or set mutation rate to None")
         else:
-            mut_rate = 4 * self.N_e * muts_per_gen * self._length
+            mut_rate = 4 * self.N_e * muts_per_gen * length
 
         demo_fun = self._demo_fun
 
         p_miss = self._p_missing_dict()
         p_miss = np.array([p_miss[pop] for pop in sfs.sampled_pops])
 
-        self._lik_surface = SfsLikelihoodSurface(
+        return SfsLikelihoodSurface(
             sfs, demo_fun, mut_rate=mut_rate,
             folded=sfs.folded, batch_size=self._mem_chunk_size,
+            memory_budget=self._memory_budget,
             use_pairwise_diffs=use_pairwise_diffs, p_missing=p_miss)
 
-        logging.getLogger(__name__).info("Finished constructing likelihood surface")
-
-        return self._lik_surface
-
     def _p_missing_dict(self):
         p_miss = self._fullsfs.p_missing
         return {pop: pm for pop, pm in zip(
@@ -881,7 +893,8 @@ class DemographicModel(object):
         return res
 
     def optimize(self, method="tnc", jac=True,
-                 hess=False, hessp=False, printfreq=1, **kwargs):
+                 hess=False, hessp=False, printfreq=1, callback=None,
+                 **kwargs):
         """Search for the maximum likelihood value of the parameters.
 
         This is a wrapper around :func:`scipy.optimize.minimize`, \
@@ -893,6 +906,7 @@ class DemographicModel(object):
         :param bool hess: Whether or not to provide the hessian (computed via :mod:`autograd`) to the optimizer.
         :param bool hessp: Whether or not to provide the hessian-vector-product (via :mod:`autograd`) to the optimizer
         :param int printfreq: Log current progress via :func:`logging.info` every `printfreq` iterations
+        :param function callback: Called after each iteration as ``callback(x)``, where ``x`` is the current (scaled) parameter vector, with additional attributes ``x.iteration`` and ``x.fun`` (the current KL-divergence).
         :rtype: :class:`scipy.optimize.OptimizeResult`
         """
         bounds = [p.x_bounds
@@ -900,6 +914,8 @@ class DemographicModel(object):
         if all([b is None for bnd in bounds for b in bnd]):
             bounds = None
 
+        user_callback = callback
+
         def callback(x):
             self._set_x(x)
             if x.iteration % printfreq == 0:
@@ -907,6 +923,8 @@ class DemographicModel(object):
                 msg.extend(list(self.get_params().items()))
                 msg = ", ".join(["{}: {}".format(k, v) for k, v in msg])
                 logging.getLogger(__name__).info("{" + msg + "}")
+            if user_callback is not None:
+                user_callback(x)
 
         res = self._get_surface().find_mle(
             self._get_x(), method=method,
@@ -919,3 +937,325 @@ class DemographicModel(object):
         res["kl_divergence"] = res.fun
         res["log_likelihood"] = self.log_likelihood()
         return res
+
+    def optimize_multistart(self, n_starts, processes=None,
+                            start_method=None, abandon_tol=None,
+                            abandon_after=10, **kwargs):
+        """Run :meth:`DemographicModel.optimize` from several random \
+        starting points, to avoid getting stuck at a local optimum.
+
+        The starting points are sampled (in the current process) as with \
+        ``set_params(randomize=True)``, so they can be made reproducible \
+        by seeding :mod:`numpy.random`. After the optimizations, the \
+        parameters are set to the best result.
+
+        :param int n_starts: Number of starting points
+        :param int,None processes: Number of worker processes to run the \
+        optimizations in. If None, run them one after another in the \
+        current process.
+        :param str,None start_method: The :mod:`multiprocessing` start \
+        method of the workers ("fork", "spawn", or "forkserver"). \
+        With "fork" (the default on Linux), the workers share the data \
+        and the likelihood surface already loaded by this process. \
+        With "spawn" or "forkserver", the model must be picklable.
+        :param float,None abandon_tol: If not None, stop an optimization \
+        once its log-likelihood is worse than the best one found so far \
+        (by any of the starts) by more than ``abandon_tol``.
+        :param int abandon_after: Only abandon an optimization after this \
+        many iterations.
+        :param kwargs: Additional arguments to \
+        :meth:`DemographicModel.optimize`
+        :returns: A table with one row per start, sorted by decreasing \
+        log-likelihood, with its status ("converged", "not converged", \
+        or "abandoned"), log-likelihood, KL-divergence, number of \
+        iterations, and parameter values.
+        :rtype: :class:`pandas.DataFrame`
+        """
+        x0s = []
+        for _ in range(n_starts):
+            model = self.copy()
+            model.set_params(randomize=True)
+            x0s.append(model._get_x())
+
+        # build the surface before starting the workers, so they share it
+        self._get_surface()
+
+        ctx = mp.get_context(start_method)
+        best_kl = ctx.Value("d", np.inf)
+        tasks = [(i, x0, abandon_tol, abandon_after, kwargs)
+                 for i, x0 in enumerate(x0s)]
+        if processes is None:
+            _worker_init(self, best_kl)
+            try:
+                results = [_multistart_run(task) for task in tasks]
+            finally:
+                _worker_init(None)
+        else:
+            with ctx.Pool(processes, initializer=_worker_init,
+                          initargs=(self, best_kl)) as pool:
+                results = pool.map(_multistart_run, tasks, chunksize=1)
+
+        rows, xs = zip(*results)
+        self._set_x(xs[int(np.argmax([row["log_likelihood"]
+                                       for row in rows]))])
+
+        ret = pd.DataFrame(list(rows))
+        ret = ret.sort_values("log_likelihood", ascending=False)
+        return ret.reset_index(drop=True)
+
+    def bootstrap(self, n_bootstraps, seed=None, processes=None,
+                  start_method=None, checkpoint_file=None, **kwargs):
+        """Refit the model to bootstrap resamplings of the data.
+
+        The ``i``-th bootstrap dataset is created by \
+        :meth:`Sfs.resample` with the random generator \
+        ``numpy.random.RandomState([seed, i])``, and fitted by \
+        :meth:`DemographicModel.optimize` starting from the current \
+        parameters, which should usually be the MLE on the full data.
+
+        :param int n_bootstraps: Number of bootstrap datasets
+        :param int,None seed: Seed for resampling the bootstrap datasets. \
+        If None, it is drawn from :mod:`numpy.random`.
+        :param int,None processes: Number of worker processes to fit \
+        the bootstraps in. If None, fit them one after another in the \
+        current process.
+        :param str,None start_method: The :mod:`multiprocessing` start \
+        method of the workers; see \
+        :meth:`DemographicModel.optimize_multistart`.
+        :param str,None checkpoint_file: If not None, each finished \
+        bootstrap is appended to this file, and bootstraps already \
+        saved there (e.g. by a previous run that was killed) are not \
+        refitted. The seed is also read from this file if not given.
+        :param kwargs: Additional arguments to \
+        :meth:`DemographicModel.optimize`
+        :returns: A table with one row per bootstrap, with its seed, \
+        status ("converged" or "not converged"), log-likelihood, \
+        KL-divergence, and parameter values. \
+        Pass it to :meth:`DemographyPlot.add_bootstraps` to plot the \
+        bootstrap demographies.
+        :rtype: :class:`pandas.DataFrame`
+        """
+        done = {}
+        if checkpoint_file is not None and os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line,
+                                         object_pairs_hook=co.OrderedDict)
+                    except ValueError:
+                        # partially written line of a killed run
+                        continue
+                    done[row["replicate"]] = row
+            # rewrite the file, to drop any partially written line
+            with open(checkpoint_file, "w") as f:
+                for row in done.values():
+                    f.write(json.dumps(row) + "\n")
+
+        if done:
+            prev_seeds = set(row["seed"] for row in done.values())
+            if seed is None and len(prev_seeds) == 1:
+                seed, = prev_seeds
+            if prev_seeds != {seed}:
+                raise ValueError(
+                    "checkpoint_file {} was created with different seed(s) {}".format(
+                        checkpoint_file, sorted(prev_seeds)))
+        elif seed is None:
+            seed = int(np.random.randint(2**31))
+
+        tasks = [(i, seed, self._get_x(), kwargs)
+                 for i in range(n_bootstraps) if i not in done]
+        rows = [row for i, row in done.items() if i < n_bootstraps]
+
+        def save(row):
+            logging.getLogger(__name__).info(
+                "Finished bootstrap {} of {}".format(
+                    len(rows), n_bootstraps))
+            if checkpoint_file is not None:
+                with open(checkpoint_file, "a") as f:
+                    f.write(json.dumps(row) + "\n")
+
+        if processes is None:
+            _worker_init(self)
+            try:
+                for task in tasks:
+                    rows.append(_bootstrap_run(task))
+                    save(rows[-1])
+            finally:
+                _worker_init(None)
+        else:
+            ctx = mp.get_context(start_method)
+            with ctx.Pool(processes, initializer=_worker_init,
+                          initargs=(self,)) as pool:
+                for row in pool.imap_unordered(_bootstrap_run, tasks):
+                    rows.append(row)
+                    save(row)
+
+        ret = pd.DataFrame(rows).sort_values("replicate")
+        return ret.reset_index(drop=True)
+
+    def jackknife(self, replicates=None, processes=None,
+                  start_method=None, **kwargs):
+        """Refit the model to the delete-one-block jackknife of the data.
+
+        The ``i``-th jackknife replicate is the data without its ``i``-th \
+        block (locus), and is fitted by \
+        :meth:`JackknifeSfsLikelihoodSurface.find_mle` starting from the \
+        current parameters, which should usually be the MLE on the full \
+        data. The replicates share the per-block likelihoods of the \
+        full data, so the likelihood surface is only built once.
+
+        Each block is assumed to have the same length, \
+        ``length / n_blocks``.
+
+        :param list,None replicates: Indices of the blocks to delete. \
+        If None, use every block.
+        :param int,None processes: Number of worker processes to fit \
+        the replicates in. If None, fit them one after another in the \
+        current process.
+        :param str,None start_method: The :mod:`multiprocessing` start \
+        method of the workers; see \
+        :meth:`DemographicModel.optimize_multistart`.
+        :param kwargs: Additional arguments to \
+        :meth:`SfsLikelihoodSurface.find_mle` (e.g. ``method``)
+        :returns: A table with one row per replicate, with its status \
+        ("converged" or "not converged"), log-likelihood, \
+        KL-divergence, and parameter values.
+        :rtype: :class:`pandas.DataFrame`
+        """
+        if self._fullsfs is None:
+            raise ValueError("Need to call DemographicModel.set_data()")
+        sfs = self._get_sfs()
+        length = self._length
+        if length is not None:
+            length = length / float(sfs.n_loci)
+        surface = JackknifeSfsLikelihoodSurface(
+            self._build_surface(sfs, length))
+        if replicates is None:
+            replicates = range(surface.n_replicates)
+
+        bounds = [p.x_bounds
+                  for p in self.parameters.values()]
+        if all([b is None for bnd in bounds for b in bnd]):
+            bounds = None
+
+        # build the SfsPlans before starting the workers, so they share them
+        x0 = self._get_x()
+        surface.full_surface.log_lik(x0)
+
+        tasks = [(i, x0, bounds, kwargs) for i in replicates]
+        if processes is None:
+            _worker_init(self, surface=surface)
+            try:
+                rows = [_jackknife_run(task) for task in tasks]
+            finally:
+                _worker_init(None)
+        else:
+            ctx = mp.get_context(start_method)
+            with ctx.Pool(processes, initializer=_worker_init,
+                          initargs=(self, None, surface)) as pool:
+                rows = pool.map(_jackknife_run, tasks, chunksize=1)
+
+        return pd.DataFrame(rows)
+
+
+class _AbandonedStart(Exception):
+    pass
+
+
+# the model (and best KL-divergence, or jackknife surface) shared by the
+# optimizations of DemographicModel.optimize_multistart(),
+# DemographicModel.bootstrap() and DemographicModel.jackknife()
+# run in this process
+_worker_model = None
+_worker_best_kl = None
+_worker_surface = None
+
+
+def _worker_init(model, best_kl=None, surface=None):
+    global _worker_model, _worker_best_kl, _worker_surface
+    _worker_model = model
+    _worker_best_kl = best_kl
+    _worker_surface = surface
+
+
+def _multistart_run(task):
+    start, x0, abandon_tol, abandon_after, kwargs = task
+    model, best_kl = _worker_model, _worker_best_kl
+    n_snps = model._get_surface().sfs.n_snps()
+
+    progress = lambda: None
+    progress.iteration = 0
+
+    def callback(x):
+        progress.iteration = x.iteration + 1
+        kl_div = float(getval(x.fun))
+        with best_kl.get_lock():
+            best_kl.value = min(best_kl.value, kl_div)
+            behind = (kl_div - best_kl.value) * n_snps
+        if (abandon_tol is not None and x.iteration + 1 >= abandon_after
+                and behind > abandon_tol):
+            raise _AbandonedStart()
+
+    model._set_x(x0)
+    try:
+        res = model.optimize(callback=callback, **kwargs)
+    except _AbandonedStart:
+        status = "abandoned"
+        message = "log-likelihood fell behind the best start by more than {}".format(abandon_tol)
+        log_lik = model.log_likelihood()
+        kl_div = model.kl_div()
+    else:
+        status = "converged" if res.success else "not converged"
+        message = res.message
+        log_lik = res.log_likelihood
+        kl_div = res.kl_divergence
+        with best_kl.get_lock():
+            best_kl.value = min(best_kl.value, kl_div)
+
+    row = co.OrderedDict([
+        ("start", start), ("status", status),
+        ("log_likelihood", log_lik), ("kl_divergence", kl_div),
+        ("iterations", progress.iteration), ("message", message)])
+    row.update(model.get_params())
+    return row, model._get_x()
+
+
+def _bootstrap_run(task):
+    replicate, seed, x0, kwargs = task
+    model = _worker_model.copy()
+    model._set_data(
+        sfs=model._fullsfs.resample(
+            np.random.RandomState([seed, replicate])),
+        length=model._length,
+        mem_chunk_size=model._mem_chunk_size,
+        memory_budget=model._memory_budget,
+        use_pairwise_diffs=model._use_pairwise_diffs,
+        non_ascertained_pops=model._non_ascertained_pops)
+    model._set_x(x0)
+    res = model.optimize(**kwargs)
+
+    row = co.OrderedDict([
+        ("replicate", replicate), ("seed", seed),
+        ("status", "converged" if res.success else "not converged"),
+        ("log_likelihood", float(res.log_likelihood)),
+        ("kl_divergence", float(res.kl_divergence)),
+        ("message", str(res.message))])
+    row.update((k, float(v)) for k, v in res.parameters.items())
+    return row
+
+
+def _jackknife_run(task):
+    replicate, x0, bounds, kwargs = task
+    surface = _worker_surface
+    res = surface.find_mle(x0, replicate, bounds=bounds, **kwargs)
+
+    model = _worker_model.copy()
+    model._set_x(res.x)
+    row = co.OrderedDict([
+        ("replicate", replicate),
+        ("status", "converged" if res.success else "not converged"),
+        ("log_likelihood", float(surface.log_lik(res.x, replicate))),
+        ("kl_divergence", float(res.fun)),
+        ("message", str(res.message))])
+    row.update((k, float(v)) for k, v in model.get_params().items())
+    return row
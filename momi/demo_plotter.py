@@ -186,6 +186,22 @@ class DemographyPlot(object):
         additional_plot.draw(alpha=alpha, tree_color="gray",
                              pulse_label=False, rad=rad)
 
+    def add_bootstraps(self, bootstraps, alpha,
+                       rad=-.1, rand_rad=True):
+        """Add several inferred bootstrap demographies to the plot.
+
+        :param pandas.DataFrame bootstraps: Bootstrap results, \
+        as returned by :meth:`DemographicModel.bootstrap`, \
+        with one row per bootstrap and one column per parameter
+        :param float alpha: Transparency
+        :param float rad: Arc of pulse arrows in radians
+        :param bool rand_rad: Add random jitter to the arc of the pulse arrows
+        """
+        for _, row in bootstraps.iterrows():
+            self.add_bootstrap(
+                {name: row[name] for name in self.model.parameters},
+                alpha, rad=rad, rand_rad=rand_rad)
+
     def draw_xticks(self, pops=None, rename_pops=None, rotation=-30):
         if pops is None:
             pops = list(self._plot.pop_lines.keys())
@@ -1 +1 @@
-from .einsum2 import batched_dot, einsum2, einsum1
+from .einsum2 import batched_dot, einsum2, einsum1, set_batched_dot_backend
@@ -3,6 +3,39 @@ import autograd.numpy as np
 from autograd.extend import primitive, defvjp
 from .parallel_matmul import _par_matmul
 
+# backend used by batched_dot() for general batches; see set_batched_dot_backend()
+_batched_dot_backend = "auto"
+
+# below this many multiply-adds per matrix product, the per-matrix overhead
+# of np.matmul dominates and the parallel loop in _par_matmul is faster
+_MATMUL_MIN_SIZE = 64
+
+
+def set_batched_dot_backend(backend):
+    """
+    Set how batched_dot() multiplies general batches of matrices:
+    "matmul" uses numpy.matmul (which calls BLAS on each matrix in the batch),
+    "parallel" uses the parallel for loop in parallel_matmul.pyx,
+    and "auto" (the default) uses the parallel loop for batches of
+    very small matrices, and numpy.matmul otherwise.
+    """
+    global _batched_dot_backend
+    if backend not in ("auto", "matmul", "parallel"):
+        raise ValueError("Unrecognized backend {}".format(backend))
+    _batched_dot_backend = backend
+
+
+def _use_matmul(a, b):
+    if _batched_dot_backend == "matmul":
+        return True
+    if a.dtype != np.double or b.dtype != np.double:
+        # _par_matmul only handles doubles
+        return True
+    if _batched_dot_backend == "parallel":
+        return False
+    return a.shape[1] * a.shape[2] * b.shape[2] >= _MATMUL_MIN_SIZE
+
+
 @primitive
 def batched_dot(a, b):
     if len(a.shape) != 3 or len(b.shape) != 3 or a.shape[0] != b.shape[0]:
@@ -31,6 +64,9 @@ def batched_dot(a, b):
             if b.shape[0] == 1:
                 b = np.reshape(b, [-1])
             return np.transpose(np.reshape(a*b, outshape[::-1]))
+    elif _use_matmul(a, b):
+        ## batched matrix multiply with blas
+        return np.matmul(a, b)
     else:
         ## parallel batched matrix multiply
         return _par_matmul(a, b)
@@ -70,8 +106,8 @@ def einsum2(*args, **kwargs):
     OMP_NUM_THREADS.
 
     To perform the parallel computation, einsum2 will either use
-    numpy.dot (if possible), otherwise it will use a parallel
-    for loop. The advantage of using numpy.dot is that it
+    numpy.dot or numpy.matmul (if possible), otherwise it will use a
+    parallel for loop (see set_batched_dot_backend). The advantage of using numpy.dot is that it
     uses BLAS which is much faster than a for loop. However,
     you need to make sure numpy is compiled against a parallel BLAS
     implementation such as MKL or OpenBlas. You won't need to worry
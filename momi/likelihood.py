@@ -2,12 +2,17 @@ import json
 import functools
 import logging
 import time
+import collections as co
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 import autograd.numpy as np
 import scipy
+import pandas as pd
 import autograd as ag
 from autograd.extend import primitive, defvjp
+from autograd.tracer import Box
 from .optimizers import _find_minimum, stochastic_opts, LoggingCallback
-from .compute_sfs import expected_sfs, expected_total_branch_len, expected_heterozygosity
+from .compute_sfs import expected_sfs, expected_total_branch_len, expected_heterozygosity, SfsPlan, _profile_events, _liks_bytes_per_row
 from .demography import Demography
 from .data.configurations import _ConfigList_Subset
 from .data.sfs import Sfs
@@ -16,7 +21,7 @@ logger = logging.getLogger(__name__)
 
 
 class SfsLikelihoodSurface(object):
-    def __init__(self, data, demo_func=None, mut_rate=None, length=1, log_prior=None, folded=False, error_matrices=None, truncate_probs=1e-100, batch_size=1000, p_missing=0.0, use_pairwise_diffs=False):
+    def __init__(self, data, demo_func=None, mut_rate=None, length=1, log_prior=None, folded=False, error_matrices=None, truncate_probs=1e-100, batch_size=1000, p_missing=0.0, use_pairwise_diffs=False, threads=0, memory_budget=2**30):
         """
         Object for computing composite likelihoods, and searching for the maximum composite likelihood.
 
@@ -44,19 +49,31 @@ class SfsLikelihoodSurface(object):
             controls the memory usage. the SFS will be computed in batches of batch_size.
             Decrease batch_size to decrease memory usage (but add running time overhead).
             set batch_size=-1 to compute all SNPs in a single batch. This is required if you wish to compute hessians or higher-order derivatives with autograd.
-        processes:
-            the number of cores to use.
-            if <= 0 (the default), do not use any parallelization.
-            if processes > 0, it is recommended to create the SfsLikelihoodSurface()
+            set batch_size="auto" to choose the batch size from memory_budget instead.
+        memory_budget:
+            only used if batch_size="auto". The approximate number of bytes to use
+            for the likelihood tensors of the batches being computed (including
+            the intermediate values stored for the gradient). The batch size is
+            chosen on the first likelihood evaluation, from an estimate of the
+            memory per SFS entry, which depends on the number of demes and lineages
+            at each event of the demography. With threads > 0, the budget is
+            split between the threads.
+        threads:
+            the number of threads used to compute the SFS batches concurrently.
+            if <= 0 (the default), the batches are computed one at a time.
+            if threads > 0, it is recommended to create the SfsLikelihoodSurface()
             using the with...as... construct:
 
-                with SfsLikelihoodSurface(data, demo_func, processes=10) as surface:
+                with SfsLikelihoodSurface(data, demo_func, threads=10) as surface:
                      mle = surface.find_mle(x0)
                 print("MLE is ", mle.x)
 
-            as this will automatically take care of closing connections to the parallel subprocesses.
+            as this will automatically take care of shutting down the thread pool.
             (Alternatively, you can manually call surface.close(), but care must be taken
             to make sure surface.close() is called in the event of an Error).
+            Only has an effect if there is more than one batch; the
+            vectorized log-likelihood and higher-order derivatives are
+            always computed one batch at a time.
         """
         self.data = data
 
@@ -79,11 +96,24 @@ class SfsLikelihoodSurface(object):
 
         self.log_prior = log_prior
         self.batch_size = batch_size
+        self.memory_budget = memory_budget
 
-        if batch_size <= 0:
+        if batch_size == "auto":
+            # built with the SfsPlans, from the structure of the demography
+            self.sfs_batches = None
+        elif batch_size <= 0:
             self.sfs_batches = None
         else:
             self.sfs_batches = _build_sfs_batches(self.sfs, batch_size)
+        # SfsPlan for each batch, built on the first likelihood evaluation
+        self._sfs_plans = None
+
+        self.threads = threads
+        if threads > 0 and (batch_size == "auto" or (
+                self.sfs_batches and len(self.sfs_batches) > 1)):
+            self._executor = ThreadPoolExecutor(max_workers=threads)
+        else:
+            self._executor = None
 
         self.p_missing = p_missing
 
@@ -93,6 +123,20 @@ class SfsLikelihoodSurface(object):
             raise ValueError(
                 "Expected total branch length not implemented for missing data; set use_pairwise_diffs=True to scale total mutations by the pairwise differences instead.")
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shut down the thread pool, if any.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
     def log_lik(self, x, vector=False):
         """
         Returns the composite log-likelihood of the data at the point x.
@@ -101,6 +145,24 @@ class SfsLikelihoodSurface(object):
         logger.debug("log-likelihood = {0}".format(ret))
         return ret
 
+    def profile(self, x):
+        """
+        Computes the log-likelihood at the point x, and profiles
+        the computation of the expected SFS.
+
+        Returns a pandas.DataFrame with a row for each operation at each event
+        of the demography (in the order they are computed), with its number
+        of calls, wall time (Seconds), estimated floating point operations
+        (Flops), and its largest output tensor (Shape, Bytes), summed over
+        the batches of the SFS. Op "other" is the time spent on the event
+        outside of the tensor operations (e.g. computing transition matrices).
+
+        Only the forward pass is profiled, not the gradient.
+        """
+        with _profile_events() as profiler:
+            self.log_lik(x)
+        return profiler.dataframe()
+
     def _score(self, x):
         return ag.grad(self.log_lik)(x)
 
@@ -136,22 +198,70 @@ class SfsLikelihoodSurface(object):
             demo = x
         return demo
 
+    def _get_sfs_plans(self, demo):
+        # the plans only depend on the structure of demo,
+        # so only rebuild them if the structure changes
+        if self._sfs_plans is None or not self._sfs_plans[0].is_compatible(demo):
+            if self.batch_size == "auto":
+                self.sfs_batches = _build_sfs_batches(
+                    self.sfs, self._auto_batch_size(demo))
+            if self.sfs_batches:
+                batches = self.sfs_batches
+            else:
+                try:
+                    batches = [self.data.sfs]
+                except AttributeError:
+                    batches = [self.data]
+            self._sfs_plans = []
+            axis_plan = None
+            for batch in batches:
+                # the batches share the same order of axes
+                plan = SfsPlan(demo, batch.configs, folded=self.folded,
+                               error_matrices=self.error_matrices,
+                               axis_plan=axis_plan)
+                axis_plan = plan.axis_plan
+                self._sfs_plans.append(plan)
+        return self._sfs_plans
+
+    def _auto_batch_size(self, demo):
+        # the backward pass allocates gradients as large as the tensors
+        bytes_per_config = 2 * _liks_bytes_per_row(demo)
+        if self.folded:
+            # folded configs use 2 rows
+            bytes_per_config *= 2
+        if self._executor is not None:
+            concurrent_batches = self.threads
+        else:
+            concurrent_batches = 1
+        batch_size = max(1, int(self.memory_budget / concurrent_batches /
+                                bytes_per_config))
+        logger.info("Using batches of {} SFS entries (estimated {} bytes per entry)".format(
+            batch_size, bytes_per_config))
+        return batch_size
+
     def _get_multinom_loglik(self, demo, vector):
+        sfs_plans = self._get_sfs_plans(demo)
         if self.sfs_batches:
             G = demo._get_graph_structure()
             cache = demo._get_differentiable_part()
+            if self._executor is not None and not vector:
+                return _threaded_raw_log_lik(
+                    cache, G, self.sfs_batches, sfs_plans,
+                    self.truncate_probs, self.folded,
+                    self.error_matrices, self._executor)
             ret = 0.0
-            for batch in self.sfs_batches:
+            for batch, plan in zip(self.sfs_batches, sfs_plans):
                 ret = ret + _raw_log_lik(
                     cache, G, batch,
                     self.truncate_probs, self.folded,
-                    self.error_matrices, vector)
+                    self.error_matrices, vector, sfs_plan=plan)
         else:
+            sfs_plan, = sfs_plans
             ret = _composite_log_likelihood(
                 self.data, demo, truncate_probs=self.truncate_probs,
                 folded=self.folded, error_matrices=self.error_matrices,
                 use_pairwise_diffs=self.use_pairwise_diffs,
-                vector=vector)
+                vector=vector, sfs_plan=sfs_plan)
         return ret
 
     def _mut_factor(self, demo, vector):
@@ -224,50 +334,9 @@ class SfsLikelihoodSurface(object):
         1) no "fun" param (this is set to be self.kl_div)
         2) jac, hess, hessp are bools. If True, their respective derivatives are defined using autograd and passed into scipy.optimize.minimize; otherwise, "None" is passed in for the derivatives (in which case scipy may use a numerical derivative if needed)
         """
-        print_progress = LoggingCallback(user_callback=callback).callback
-        hist = lambda: None
-        hist.itr = 0
-        hist.recent_vals = []
-        starttime = time.time()
-
-        def callback(x):
-            for y, fx in reversed(hist.recent_vals):
-                if np.allclose(y, x):
-                    break
-            assert np.allclose(y, x)
-            try:
-                fx = fx.value
-            except AttributeError:
-                pass
-            print_progress(x, fx, hist.itr)
-            hist.itr += 1
-            hist.recent_vals = [(x, fx)]
-
-        opt_kwargs = dict(kwargs)
-        opt_kwargs["method"] = method
-
-        opt_kwargs['jac'] = jac
-        if jac:
-            replacefun = ag.value_and_grad
-        else:
-            replacefun = None
-
-        gradmakers = {}
-        if hess:
-            gradmakers['hess'] = ag.hessian
-        if hessp:
-            gradmakers['hessp'] = ag.hessian_vector_product
-
-        @functools.wraps(self.kl_div)
-        def fun(x):
-            ret = self.kl_div(x)
-            hist.recent_vals += [(x, ret)]
-            return ret
-
-        return _find_minimum(fun, x0, scipy.optimize.minimize,
-                             bounds=bounds, callback=callback,
-                             opt_kwargs=opt_kwargs, gradmakers=gradmakers, replacefun=replacefun)
-
+        return _find_mle(self.kl_div, x0, method=method, jac=jac,
+                         hess=hess, hessp=hessp, bounds=bounds,
+                         callback=callback, **kwargs)
 
     def stochastic_find_mle(
             self, x0, snps_per_minibatch, stepsize, num_iters,
@@ -346,7 +415,8 @@ class SfsLikelihoodSurface(object):
 
         return [SfsLikelihoodSurface(sfs, demo_func=self.demo_func, mut_rate=None,
                                      folded=self.folded, error_matrices=self.error_matrices,
-                                     truncate_probs=self.truncate_probs, batch_size=self.batch_size)
+                                     truncate_probs=self.truncate_probs, batch_size=self.batch_size,
+                                     memory_budget=self.memory_budget)
                 for sfs in sfs_pieces]
 
     def _stochastic_surfaces(self, n_minibatches=None, snps_per_minibatch=None, rgen=np.random):
@@ -411,14 +481,412 @@ class StochasticSfsLikelihoodSurface(object):
                              gradmakers={'fun_and_jac': ag.value_and_grad})
 
 
-def _composite_log_likelihood(data, demo, mut_rate=None, truncate_probs=0.0, vector=False, p_missing=None, use_pairwise_diffs=False, **kwargs):
+class JackknifeSfsLikelihoodSurface(object):
+    def __init__(self, full_surface):
+        """
+        Delete-one-locus jackknife of a likelihood surface: the i-th
+        jackknife replicate is the data of full_surface without its i-th
+        locus (block).
+
+        The multinomial and Poisson log-likelihoods decompose over loci,
+        so the log-likelihoods of all the replicates are computed from the
+        per-locus log-likelihoods of full_surface (i.e.
+        full_surface.log_lik(x, vector=True)), with a single evaluation of
+        the expected SFS at x. The SfsPlans of full_surface are shared by
+        all the replicates.
+
+        Parameters
+        ==========
+        full_surface: SfsLikelihoodSurface
+            surface of the full data, which should not be combined into
+            a single locus. If it has a mutation rate, it should be the
+            per-locus mutation rate.
+        """
+        self.full_surface = full_surface
+        self.n_replicates = full_surface.sfs.n_loci
+        if self.n_replicates < 2:
+            raise ValueError("Need at least 2 loci for the jackknife")
+        self._replicate_sfs = {}
+
+    def log_lik(self, x, replicate=None):
+        """
+        Returns the composite log-likelihood of the replicate at the
+        point x. If replicate is None, returns an array with the
+        log-likelihood of every replicate.
+        """
+        # the log-prior is split evenly over the per-locus
+        # log-likelihoods, so add back the share of the deleted locus
+        locus_liks = self.full_surface._log_lik(x, vector=True)
+        if replicate is None:
+            ret = np.sum(locus_liks) - locus_liks
+        else:
+            ret = np.sum(locus_liks) - locus_liks[replicate]
+        ret = ret + self.full_surface._log_prior(x) / len(locus_liks)
+        logger.debug("jackknife log-likelihood = {0}".format(ret))
+        return ret
+
+    def get_replicate(self, replicate):
+        """
+        The Sfs of the replicate.
+        """
+        try:
+            return self._replicate_sfs[replicate]
+        except KeyError:
+            sfs = self.full_surface.sfs
+            loci = np.delete(np.arange(self.n_replicates), replicate)
+            self._replicate_sfs[replicate] = sfs._subset_loci(loci)
+            return self._replicate_sfs[replicate]
+
+    def kl_div(self, x, replicate):
+        """
+        Returns KL-Divergence(Empirical || Theoretical(x)) of the replicate.
+        """
+        sfs = self.get_replicate(replicate)
+        ret = -self.log_lik(x, replicate) + sfs.n_snps() * sfs._entropy
+        if self.full_surface.mut_rate is not None:
+            ret = ret + sfs._get_muts_poisson_entropy(
+                self.full_surface.use_pairwise_diffs)
+        return ret / float(sfs.n_snps())
+
+    def find_mle(self, x0, replicate, method="tnc", jac=True, hess=False, hessp=False, bounds=None, callback=None, **kwargs):
+        """
+        Search for the maximum of the likelihood surface of the replicate.
+
+        x0 is typically the MLE of the full data. The other arguments
+        are as in SfsLikelihoodSurface.find_mle().
+        """
+        return _find_mle(functools.partial(self.kl_div, replicate=replicate),
+                         x0, method=method, jac=jac,
+                         hess=hess, hessp=hessp, bounds=bounds,
+                         callback=callback, **kwargs)
+
+
+class DistributedSfsLikelihoodSurface(SfsLikelihoodSurface):
+    def __init__(self, data, demo_func, processes, start_method=None, **kwargs):
+        """
+        Like SfsLikelihoodSurface, but splits the SFS configs into shards,
+        and computes the log-likelihood of each shard (and its gradient)
+        in a separate worker process.
+
+        Each worker keeps its own SfsLikelihoodSurface for its shard,
+        so the precomputed parts of the likelihood are reused between
+        evaluations. Only the parameter vector is sent to the workers.
+
+        Parameters
+        ==========
+        data, demo_func, **kwargs:
+            see help(SfsLikelihoodSurface). demo_func is required, and
+            must return a Demography from a vector of parameters.
+            batch_size and threads apply to the shard of each worker,
+            and memory_budget is split between the workers.
+        processes: int
+            the number of worker processes (and shards of the SFS)
+        start_method: str or None
+            the multiprocessing start method of the workers
+            ("fork", "spawn", or "forkserver").
+            If None, use the multiprocessing default.
+            With "spawn" or "forkserver", demo_func must be picklable.
+
+        Notes
+        =====
+        As with the threads option of SfsLikelihoodSurface, use the
+        with...as... construct or call close() to shut down the workers.
+
+        The workers only compute first-order derivatives, so hessians
+        (e.g. find_mle() with hess=True or hessp=True) are not supported.
+        The vectorized log-likelihood (log_lik(x, vector=True)) can be
+        differentiated, but only the most recently computed one.
+        """
+        if demo_func is None:
+            raise ValueError(
+                "DistributedSfsLikelihoodSurface requires a demo_func")
+        if processes <= 0:
+            raise ValueError("processes should be a positive integer")
+        # the SFS is only batched by the workers, so the parent
+        # doesn't keep batches (or threads) for the whole SFS
+        batch_size = kwargs.pop("batch_size", 1000)
+        memory_budget = kwargs.pop("memory_budget", 2**30)
+        threads = kwargs.pop("threads", 0)
+        super(DistributedSfsLikelihoodSurface, self).__init__(
+            data, demo_func=demo_func, batch_size=-1, threads=0, **kwargs)
+
+        shards = [self.sfs._subset_configs(idxs) for idxs in np.array_split(
+            np.arange(len(self.sfs.configs)), processes) if len(idxs) > 0]
+
+        worker_kwargs = {
+            "demo_func": self.demo_func, "folded": self.folded,
+            "error_matrices": self.error_matrices,
+            "truncate_probs": self.truncate_probs,
+            "batch_size": batch_size, "threads": threads,
+            "memory_budget": memory_budget / len(shards)}
+        logger.info("Starting {} worker processes, with an average of {} unique SFS entries per process".format(
+            len(shards), len(self.sfs.configs) / float(len(shards))))
+
+        # the point of the last vectorized log-likelihood,
+        # whose VJP is kept by the workers
+        self._last_vector_x = None
+
+        ctx = mp.get_context(start_method)
+        self._connections = []
+        self._workers = []
+        for shard in shards:
+            conn, worker_conn = ctx.Pipe()
+            worker = ctx.Process(target=_distributed_worker,
+                                 args=(worker_conn, shard, worker_kwargs),
+                                 daemon=True)
+            worker.start()
+            worker_conn.close()
+            self._connections.append(conn)
+            self._workers.append(worker)
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        super(DistributedSfsLikelihoodSurface, self).close()
+        for conn in self._connections:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for worker in self._workers:
+            worker.join()
+        self._connections = []
+        self._workers = []
+
+    def profile(self, x):
+        """
+        Computes the log-likelihood at the point x, and profiles
+        the computation of the expected SFS.
+
+        As SfsLikelihoodSurface.profile(), except that each worker
+        profiles its shard of the SFS, and the rows of each operation
+        are summed over the workers. So Seconds is the time summed over
+        the workers, not the elapsed wall time.
+        """
+        x = np.array(x)
+        with _profile_events() as profiler:
+            self._mut_factor(self._get_multipop_moran(x), vector=False)
+        return _sum_profiles(
+            self._send_workers("profile", x) + [profiler.dataframe()])
+
+    def find_mle(self, x0, method="tnc", jac=True, hess=False, hessp=False, bounds=None, callback=None, **kwargs):
+        """
+        Search for the maximum of the likelihood surface
+        (i.e., the minimum of the KL-divergence).
+
+        See SfsLikelihoodSurface.find_mle(). hess and hessp are not
+        supported, as the workers only compute first-order derivatives.
+        """
+        if hess or hessp:
+            raise ValueError(
+                "DistributedSfsLikelihoodSurface does not support hess or hessp, as its workers only compute first-order derivatives")
+        return super(DistributedSfsLikelihoodSurface, self).find_mle(
+            x0, method=method, jac=jac, bounds=bounds, callback=callback,
+            **kwargs)
+
+    def _log_lik(self, x, vector):
+        demo = self._get_multipop_moran(x)
+        if vector:
+            ret = _distributed_multinom_loglik_vector(x, self)
+            ret = ret + self._mut_factor(demo, vector=True)
+            return ret + self._log_prior(x) / len(ret)
+        ret = _distributed_multinom_loglik(x, self, lambda: None)
+        return ret + self._mut_factor(demo, vector=False) + self._log_prior(x)
+
+    def _send_workers(self, command, arg):
+        """
+        Sends (command, arg) to the workers, and returns the list
+        of their results
+        """
+        if not self._connections:
+            raise ValueError(
+                "DistributedSfsLikelihoodSurface has been closed")
+        for conn in self._connections:
+            conn.send((command, arg))
+        # receive from all workers before raising any errors,
+        # so that no results are left in the pipes
+        results = [conn.recv() for conn in self._connections]
+        for _, err in results:
+            if err is not None:
+                raise err
+        return [res for res, _ in results]
+
+    def _value_and_grad(self, x):
+        results = self._send_workers("value_and_grad", x)
+        return (sum(val for val, _ in results),
+                sum(grad for _, grad in results))
+
+
+def _check_first_order(x):
+    if isinstance(x, Box):
+        raise ValueError(
+            "Higher-order derivatives not supported by DistributedSfsLikelihoodSurface")
+
+
+@primitive
+def _distributed_multinom_loglik(x, surface, dummy):
+    _check_first_order(x)
+    val, dummy.cache = surface._value_and_grad(np.array(x))
+    return val
+defvjp(_distributed_multinom_loglik,
+       lambda ans, x, surface, dummy: lambda g: g * dummy.cache,
+       None, None)
+
+
+@primitive
+def _distributed_multinom_loglik_vector(x, surface):
+    # the workers keep the VJP of their last vectorized log-likelihood
+    _check_first_order(x)
+    x = np.array(x)
+    surface._last_vector_x = x
+    return sum(surface._send_workers("vector", x))
+
+
+def _distributed_multinom_loglik_vector_vjp(ans, x, surface):
+    def vjp(g):
+        _check_first_order(g)
+        if not np.array_equal(x, surface._last_vector_x):
+            raise ValueError(
+                "DistributedSfsLikelihoodSurface can only differentiate its most recent vectorized log-likelihood")
+        return sum(surface._send_workers("vjp", np.array(g)))
+    return vjp
+defvjp(_distributed_multinom_loglik_vector,
+       _distributed_multinom_loglik_vector_vjp, None)
+
+
+def _distributed_worker(conn, sfs, surface_kwargs):
+    surface = SfsLikelihoodSurface(sfs, **surface_kwargs)
+
+    def multinom_loglik(x, vector=False):
+        return surface._get_multinom_loglik(
+            surface._get_multipop_moran(x), vector=vector)
+
+    vector_vjp = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        command, arg = msg
+        try:
+            if command == "value_and_grad":
+                res = ag.value_and_grad(multinom_loglik)(arg)
+            elif command == "vector":
+                vector_vjp, res = ag.make_vjp(
+                    functools.partial(multinom_loglik, vector=True))(arg)
+            elif command == "vjp":
+                res = vector_vjp(arg)
+            elif command == "profile":
+                res = surface.profile(arg)
+            else:
+                raise ValueError("Unrecognized command {}".format(command))
+        except Exception as err:
+            conn.send((None, err))
+        else:
+            conn.send((res, None))
+    surface.close()
+    conn.close()
+
+
+def _sum_profiles(profiles):
+    """
+    Sums the rows of the same operation at the same event over a list of
+    profiles from SfsLikelihoodSurface.profile(), keeping the largest
+    output tensor
+    """
+    records = co.OrderedDict()
+    for df in profiles:
+        for row in df.itertuples(index=False):
+            key = (row.Event, row.Op)
+            if key not in records:
+                records[key] = [row.EventType, 0, 0.0, 0, None, 0]
+            rec = records[key]
+            rec[1] += row.Calls
+            rec[2] += row.Seconds
+            rec[3] += row.Flops
+            if row.Bytes >= rec[5]:
+                rec[4], rec[5] = row.Shape, row.Bytes
+    return pd.DataFrame(
+        [[event, e_type, op, calls, seconds, flops, shape, nbytes]
+         for (event, op), (e_type, calls, seconds, flops, shape, nbytes)
+         in records.items()],
+        columns=["Event", "EventType", "Op", "Calls", "Seconds",
+                 "Flops", "Shape", "Bytes"])
+
+
+def _find_mle(kl_div, x0, method, jac, hess, hessp, bounds, callback, **kwargs):
+    """
+    Minimize kl_div(x) with scipy.optimize.minimize,
+    see SfsLikelihoodSurface.find_mle()
+    """
+    print_progress = LoggingCallback(user_callback=callback).callback
+    hist = lambda: None
+    hist.itr = 0
+    hist.recent_vals = []
+    hist.callback_error = None
+    starttime = time.time()
+
+    def callback(x):
+        for y, fx in reversed(hist.recent_vals):
+            if np.allclose(y, x):
+                break
+        assert np.allclose(y, x)
+        try:
+            fx = fx.value
+        except AttributeError:
+            pass
+        try:
+            print_progress(x, fx, hist.itr)
+        except Exception as err:
+            # some optimizers (e.g. tnc) don't propagate errors from
+            # the callback, so raise it from fun instead
+            hist.callback_error = err
+        hist.itr += 1
+        hist.recent_vals = [(x, fx)]
+
+    opt_kwargs = dict(kwargs)
+    opt_kwargs["method"] = method
+
+    opt_kwargs['jac'] = jac
+    if jac:
+        replacefun = ag.value_and_grad
+    else:
+        replacefun = None
+
+    gradmakers = {}
+    if hess:
+        gradmakers['hess'] = ag.hessian
+    if hessp:
+        gradmakers['hessp'] = ag.hessian_vector_product
+
+    @functools.wraps(kl_div)
+    def fun(x):
+        if hist.callback_error is not None:
+            raise hist.callback_error
+        ret = kl_div(x)
+        hist.recent_vals += [(x, ret)]
+        return ret
+
+    ret = _find_minimum(fun, x0, scipy.optimize.minimize,
+                        bounds=bounds, callback=callback,
+                        opt_kwargs=opt_kwargs, gradmakers=gradmakers, replacefun=replacefun)
+    if hist.callback_error is not None:
+        raise hist.callback_error
+    return ret
+
+
+def _composite_log_likelihood(data, demo, mut_rate=None, truncate_probs=0.0, vector=False, p_missing=None, use_pairwise_diffs=False, sfs_plan=None, **kwargs):
     try:
         sfs = data.sfs
     except AttributeError:
         sfs = data
 
-    sfs_probs = np.maximum(expected_sfs(demo, sfs.configs, normalized=True, **kwargs),
-                           truncate_probs)
+    if sfs_plan is not None:
+        sfs_probs = sfs_plan.expected_sfs(demo, normalized=True)
+    else:
+        sfs_probs = expected_sfs(demo, sfs.configs, normalized=True, **kwargs)
+    sfs_probs = np.maximum(sfs_probs, truncate_probs)
     log_lik = sfs._integrate_sfs(np.log(sfs_probs), vector=vector)
 
     # add on log likelihood of poisson distribution for total number of SNPs
@@ -503,10 +971,10 @@ def rearrange_dict_grad(fun):
         return wrapped_fun_helper(ag.dict(xdict), lambda:None)
     return wrapped_fun
 
-def _raw_log_lik(cache, G, data, truncate_probs, folded, error_matrices, vector=False):
+def _raw_log_lik(cache, G, data, truncate_probs, folded, error_matrices, vector=False, sfs_plan=None):
     def wrapped_fun(cache):
         demo = Demography(G, cache=cache)
-        return _composite_log_likelihood(data, demo, truncate_probs=truncate_probs, folded=folded, error_matrices=error_matrices, vector=vector)
+        return _composite_log_likelihood(data, demo, truncate_probs=truncate_probs, folded=folded, error_matrices=error_matrices, vector=vector, sfs_plan=sfs_plan)
     if vector:
         return ag.checkpoint(wrapped_fun)(cache)
     else:
@@ -516,6 +984,44 @@ def _raw_log_lik(cache, G, data, truncate_probs, folded, error_matrices, vector=
         return rearrange_dict_grad(wrapped_fun)(cache)
 
 
+def _threaded_raw_log_lik(cache, G, batches, sfs_plans, truncate_probs, folded, error_matrices, executor):
+    """
+    Sum of _raw_log_lik() over the batches, with the value and gradient
+    of each batch computed in a separate thread of executor
+    """
+    def batch_fun(batch, sfs_plan):
+        def fun(cache):
+            demo = Demography(G, cache=cache)
+            return _composite_log_likelihood(batch, demo, truncate_probs=truncate_probs, folded=folded, error_matrices=error_matrices, sfs_plan=sfs_plan)
+        return fun
+    batch_funs = [batch_fun(b, p) for b, p in zip(batches, sfs_plans)]
+
+    def summed_fun(cache):
+        return sum(f(cache) for f in batch_funs)
+
+    @primitive
+    def wrapped_fun_helper(xdict, dummy):
+        if any(isinstance(v, Box) for v in xdict.values()):
+            ## higher-order derivative, so trace the batches
+            ## serially as in rearrange_dict_grad()
+            val, grad = ag.checkpoint(ag.value_and_grad(summed_fun))(xdict)
+        else:
+            results = list(executor.map(
+                lambda f: ag.value_and_grad(f)(xdict), batch_funs))
+            val = sum(v for v, _ in results)
+            grad = {k: sum(g[k] for _, g in results) for k in xdict}
+        dummy.cache = grad
+        return val
+
+    def wrapped_fun_helper_grad(ans, xdict, dummy):
+        def grad(g):
+            return {k: g*v for k, v in dummy.cache.items()}
+        return grad
+    defvjp(wrapped_fun_helper, wrapped_fun_helper_grad, None)
+
+    return wrapped_fun_helper(ag.dict(cache), lambda: None)
+
+
 #def _build_sfs_batches(sfs, batch_size):
 #    counts = sfs._total_freqs
 #    sfs_len = len(counts)
@@ -1,10 +1,13 @@
 
+import numpy as raw_np
 import autograd.numpy as np
 #from autograd.core import primitive
 from autograd.extend import primitive, defvjp
 import scipy
-from .util import memoize, check_psd
-from .convolution import convolve_sum_axes, transposed_convolve_sum_axes, sum_trailing_antidiagonals, add_trailing_axis, roll_trailing_axes, unroll_trailing_axes
+from .util import disk_memoize, check_psd
+from .convolution import convolve_sum_axes as _direct_convolve_sum_axes
+from .convolution import transposed_convolve_sum_axes as _direct_transposed_convolve_sum_axes
+from .convolution import sum_trailing_antidiagonals, add_trailing_axis, roll_trailing_axes, unroll_trailing_axes
 from .einsum2 import einsum1, einsum2
 
 
@@ -16,8 +19,145 @@ def convolve_trailing_axes(A, B):
     B = np.reshape(B, list(B.shape) + [1])
     return convolve_sum_axes(A, B)
 
-convolve_sum_axes = primitive(convolve_sum_axes)
-transposed_convolve_sum_axes = primitive(transposed_convolve_sum_axes)
+# method used by convolve_sum_axes(); see set_convolution_method()
+_convolution_method = "auto"
+
+# minimum length of the reduction axis for the BLAS method to beat the
+# direct Cython loop
+_BLAS_CONVOLUTION_MIN_REDUCTION = 8
+
+
+def set_convolution_method(method):
+    """
+    Set how convolve_sum_axes() and transposed_convolve_sum_axes() are computed:
+    "direct" uses the parallel loop in convolution.pyx,
+    "blas" loops over the shorter convolved axis and computes each lag
+    with a batched matrix multiply (numpy.matmul), and "fft" uses the
+    fast Fourier transform.
+
+    "direct" and "blas" compute exactly the same sums, so they have the
+    same relative accuracy. "fft" is much faster for long axes, but its
+    error is relative to the largest entry, so small probabilities (e.g.
+    the tails of the allele count distributions) lose all accuracy;
+    it is never chosen automatically.
+
+    "auto" (the default) uses "blas" when the reduction (last) axis
+    is long enough to keep BLAS busy, and "direct" otherwise.
+    """
+    global _convolution_method
+    if method not in ("auto", "direct", "blas", "fft"):
+        raise ValueError("Unrecognized method {}".format(method))
+    _convolution_method = method
+
+
+def _get_convolution_method(n_reduce):
+    if _convolution_method == "auto":
+        if n_reduce >= _BLAS_CONVOLUTION_MIN_REDUCTION:
+            return "blas"
+        else:
+            return "direct"
+    return _convolution_method
+
+
+@primitive
+def convolve_sum_axes(A, B):
+    """
+    C[i,j,k,l+m] = sum_n A[i,j,l,n] * B[i,k,m,n]
+    """
+    if A.shape[0] != B.shape[0] or A.shape[3] != B.shape[3]:
+        raise ValueError("A,B must have matching first and last dimensions")
+    method = _get_convolution_method(A.shape[3])
+    if method == "blas":
+        return _blas_convolve_sum_axes(A, B)
+    elif method == "fft":
+        return _fft_convolve_sum_axes(A, B)
+    else:
+        return _direct_convolve_sum_axes(A, B)
+
+
+@primitive
+def transposed_convolve_sum_axes(C, B):
+    """
+    If convolve_sum_axes is viewed as multiplying A and B by a certain tensor,
+    this is equal to multiplying C and B by that tensor, but with the tensor
+    transposed along the A/C directions, i.e.
+    A[i,j,l,n] = sum_{k,m} C[i,j,k,l+m] * B[i,k,m,n]
+    """
+    if C.shape[0] != B.shape[0] or C.shape[2] != B.shape[1]:
+        raise ValueError("C,B dimensions don't match")
+    method = _get_convolution_method(B.shape[3])
+    if method == "blas":
+        return _blas_transposed_convolve_sum_axes(C, B)
+    elif method == "fft":
+        return _fft_transposed_convolve_sum_axes(C, B)
+    else:
+        return _direct_transposed_convolve_sum_axes(C, B)
+
+
+def _blas_convolve_sum_axes(A, B):
+    I, J, L, N = A.shape
+    K, M = B.shape[1], B.shape[2]
+    if M < L:
+        # loop over the shorter axis
+        return raw_np.transpose(_blas_convolve_sum_axes(B, A), (0, 2, 1, 3))
+
+    C = raw_np.zeros((I, J, K, L + M - 1))
+    B = raw_np.reshape(raw_np.transpose(B, (0, 3, 1, 2)), (I, N, K * M))
+    for l in range(L):
+        C[:, :, :, l:(l+M)] += raw_np.reshape(
+            raw_np.matmul(A[:, :, l, :], B), (I, J, K, M))
+    return C
+
+
+def _blas_transposed_convolve_sum_axes(C, B):
+    I, J, K = C.shape[:3]
+    M, N = B.shape[2:]
+    L = C.shape[3] + 1 - M
+
+    A = raw_np.zeros((I, J, L, N))
+    if L <= M:
+        B = raw_np.reshape(B, (I, K * M, N))
+        for l in range(L):
+            A[:, :, l, :] = raw_np.matmul(
+                raw_np.reshape(C[:, :, :, l:(l+M)], (I, J, K * M)), B)
+    else:
+        A = raw_np.reshape(A, (I, J * L, N))
+        for m in range(M):
+            C_m = raw_np.transpose(C[:, :, :, m:(m+L)], (0, 1, 3, 2))
+            A += raw_np.matmul(raw_np.reshape(C_m, (I, J * L, K)),
+                               B[:, :, m, :])
+        A = raw_np.reshape(A, (I, J, L, N))
+    return A
+
+
+def _fft_convolve_sum_axes(A, B):
+    I, J, L, N = A.shape
+    K, M = B.shape[1], B.shape[2]
+    size = L + M - 1
+
+    fA = raw_np.fft.rfft(A, n=size, axis=2)
+    fB = raw_np.fft.rfft(B, n=size, axis=2)
+    # fC[i,f,j,k] = sum_n fA[i,j,f,n] * fB[i,k,f,n]
+    fC = raw_np.matmul(raw_np.transpose(fA, (0, 2, 1, 3)),
+                       raw_np.transpose(fB, (0, 2, 3, 1)))
+    return raw_np.fft.irfft(raw_np.transpose(fC, (0, 2, 3, 1)),
+                            n=size, axis=3)
+
+
+def _fft_transposed_convolve_sum_axes(C, B):
+    I, J, K, size = C.shape
+    M, N = B.shape[2:]
+    L = size + 1 - M
+
+    fC = raw_np.fft.rfft(C, n=size, axis=3)
+    fB = raw_np.conj(raw_np.fft.rfft(B, n=size, axis=2))
+    # fA[i,f,j,n] = sum_k fC[i,j,k,f] * fB[i,k,f,n]
+    fA = raw_np.matmul(raw_np.transpose(fC, (0, 3, 1, 2)),
+                       raw_np.transpose(fB, (0, 2, 1, 3)))
+    A = raw_np.fft.irfft(raw_np.transpose(fA, (0, 2, 1, 3)),
+                         n=size, axis=2)
+    return A[:, :, :L, :]
+
 
 defvjp(
     convolve_sum_axes,
@@ -199,7 +339,7 @@ def hypergeom_mat(N, n):
     return np.exp(ret)
 
 
-@memoize
+@disk_memoize(maxsize=256)
 def hypergeom_quasi_inverse(N, n):
     # return scipy.linalg.pinv(hypergeom_mat(N,n))
     # return np.linalg.pinv(hypergeom_mat(N,n))
@@ -1,31 +1,152 @@
-
-from .util import memoize, check_probs_matrix
+from .util import memoize, disk_memoize, check_probs_matrix
 from .math_functions import par_einsum
 import scipy.sparse
+import scipy.sparse.linalg
+import numpy as raw_np
 import autograd.numpy as np
-from autograd.numpy import dot, diag, exp
+from autograd.numpy import dot, exp, expm1
+from autograd.extend import primitive, defvjp
+from autograd.tracer import getval
 
 
 def moran_transition(t, n):
     assert t >= 0.0
+    if n == 1:
+        # both states are absorbing
+        return np.eye(2)
     P, d, Pinv = moran_eigensystem(n)
-    D = diag(exp(t * d))
-    return check_probs_matrix(dot(P, dot(D, Pinv)))
+    # only use the eigenvectors with nonzero eigenvalues (the first 2
+    # eigenvalues are 0), as the columns for absorption at 0 and n
+    # would suffer from cancellation when computed from the eigensystem
+    P, d, Pinv = P[:, 2:], d[2:], Pinv[2:, 1:-1]
+    # P * exp(t*d) == dot(P, diag(exp(t*d)))
+    interior = dot(P * exp(t * d), Pinv)
+
+    # probability of absorption at 0 (resp. n) by time t is the
+    # integral of the transition probability to 1 (resp. n-1),
+    # times the rate of absorption from there, (n-1)/2
+    integrated = P * (expm1(t * d) / d)
+    i = np.arange(n + 1)
+    rate = (n - 1) / 2.
+    absorbed_0 = (i == 0) + rate * dot(integrated, Pinv[:, 0])
+    absorbed_n = (i == n) + rate * dot(integrated, Pinv[:, -1])
+
+    # roundoff error grows with n
+    return check_probs_matrix(np.concatenate(
+        [absorbed_0[:, None], interior, absorbed_n[:, None]], axis=1),
+        tol=max(1e-13, n * 1e-15))
+
+# method used by moran_action(); see set_action_method()
+_action_method = "auto"
+
+
+def set_action_method(method):
+    """
+    Set how moran_action() applies the Moran transition to a vector:
+    "eigen" forms the dense transition matrix from the eigensystem,
+    "expm_multiply" applies the sparse rate matrix with
+    scipy.sparse.linalg.expm_multiply without forming the transition,
+    and "auto" (the default) chooses the cheaper of the two based on
+    the number of samples, the number of vectors, and the time.
+    """
+    global _action_method
+    if method not in ("auto", "eigen", "expm_multiply"):
+        raise ValueError("Unrecognized method {}".format(method))
+    _action_method = method
 
-def moran_action(t, v, axis=0):
+
+def moran_action(t, v, axis=0, method=None):
+    """
+    Apply the Moran transition over time t along axis of v, i.e.
+    ret[...,j,...] = sum_i moran_transition(t, n)[j,i] * v[...,i,...]
+
+    method is one of "auto", "eigen", "expm_multiply", or None to use
+    the method of set_action_method().
+    """
     if v.shape[axis] == 1:
         return v
 
     n = v.shape[axis] - 1
-    PDPinv = moran_transition(t, n)
+    if method is None:
+        method = _action_method
+    if method == "auto":
+        n_vecs = int(raw_np.prod(v.shape)) // (n + 1)
+        if _use_expm_multiply(getval(t), n, n_vecs):
+            method = "expm_multiply"
+        else:
+            method = "eigen"
 
-    vlen, output_dim = len(v.shape), list(range(len(v.shape)))
-    output_dim[axis] = vlen
-    ret = par_einsum(v, list(range(vlen)), PDPinv, [vlen, axis], output_dim)
+    vlen = len(v.shape)
+    if axis < 0:
+        axis += vlen
+    if method == "expm_multiply":
+        perm = [axis] + [i for i in range(vlen) if i != axis]
+        v_perm = np.transpose(v, perm)
+        ret = expm_action(t, np.reshape(v_perm, (n + 1, -1)), False)
+        ret = np.transpose(np.reshape(ret, v_perm.shape),
+                           raw_np.argsort(perm))
+    elif method == "eigen":
+        PDPinv = moran_transition(t, n)
+        if axis == vlen - 1:
+            ret = dot(v, np.transpose(PDPinv))
+        else:
+            output_dim = list(range(vlen))
+            output_dim[axis] = vlen
+            ret = par_einsum(v, list(range(vlen)), PDPinv, [vlen, axis],
+                             output_dim)
+    else:
+        raise ValueError("Unrecognized method {}".format(method))
     assert ret.shape == v.shape
     return ret
 
 
+def _use_expm_multiply(t, n, n_vecs):
+    # rough flop counts. forming the transition costs O(n^3), while
+    # expm_multiply needs about ||t*rate_matrix(n)||_1 = t*n^2/2
+    # (plus some overhead) products of the tridiagonal rate matrix with
+    # the n_vecs vectors
+    eigen_cost = n ** 3 + n ** 2 * n_vecs
+    expm_multiply_cost = (t * n ** 2 / 2. + 20) * 3 * n * n_vecs
+    return expm_multiply_cost < eigen_cost
+
+
+@primitive
+def expm_action(t, v, transpose):
+    """
+    exp(t*M).dot(v) where M = rate_matrix(v.shape[0]-1),
+    or exp(t*M.T).dot(v) if transpose is True
+    """
+    return scipy.sparse.linalg.expm_multiply(
+        t * _rate_matrix(v.shape[0] - 1, transpose), v)
+
+
+@primitive
+def rate_matrix_dot(v, transpose):
+    """
+    M.dot(v), where M = rate_matrix(v.shape[0]-1),
+    or M.T.dot(v) if transpose is True
+    """
+    return _rate_matrix(v.shape[0] - 1, transpose).dot(v)
+
+
+def _rate_matrix(n, transpose):
+    if transpose:
+        return rate_matrix(n, sparse_format="csc").T
+    return rate_matrix(n)
+
+
+defvjp(expm_action,
+       lambda ans, t, v, transpose: lambda g: np.sum(
+           g * rate_matrix_dot(ans, transpose)),
+       lambda ans, t, v, transpose: lambda g: expm_action(
+           t, g, not transpose),
+       None)
+defvjp(rate_matrix_dot,
+       lambda ans, v, transpose: lambda g: rate_matrix_dot(
+           g, not transpose),
+       None)
+
+
 @memoize
 def rate_matrix(n, sparse_format="csr"):
     i = np.arange(n + 1)
@@ -36,8 +157,48 @@ def rate_matrix(n, sparse_format="csr"):
     return M
 
 
-@memoize
+@disk_memoize(maxsize=256)
 def moran_eigensystem(n):
-    M = rate_matrix(n).toarray()
-    d, P = np.linalg.eig(M)
-    return P, d, np.linalg.inv(P)
+    """
+    Returns P, d, Pinv, such that rate_matrix(n) == P * diag(d) * Pinv.
+    """
+    # States 0 and n are absorbing, so the rate matrix has the form
+    # [[0, 0, 0], [b, A, c], [0, 0, 0]], where the tridiagonal A on the
+    # interior states has eigenvalues -k(k-1)/2 for k=2,...,n.
+    # A = D S D^{-1} for a diagonal D and symmetric S, so the eigenvectors
+    # of A are found stably from eigh(S).
+    i = raw_np.arange(n + 1)
+    rates = i * (n - i) / 2.
+    interior = i[1:-1]
+
+    # diagonal of D, and sub/super diagonal of S
+    D = raw_np.sqrt(interior * (n - interior) / float(max(n - 1, 1)))
+    S_offdiag = raw_np.sqrt(rates[1:-2] * rates[2:-1])
+    S = (raw_np.diag(-2 * rates[1:-1]) + raw_np.diag(S_offdiag, 1) +
+         raw_np.diag(S_offdiag, -1))
+    S_d, Q = raw_np.linalg.eigh(S)
+
+    # eigh sorts the eigenvalues in ascending order
+    interior_d = -(raw_np.arange(n, 1, -1) * raw_np.arange(n - 1, 0, -1)) / 2.
+    assert raw_np.allclose(S_d, interior_d, rtol=1e-8, atol=1e-8 * n * n)
+
+    d = raw_np.concatenate([[0., 0.], interior_d])
+
+    # right eigenvectors. for eigenvalue 0 these are the
+    # probabilities of absorption at 0 and n
+    P = raw_np.zeros((n + 1, n + 1))
+    P[:, 0] = 1. - i / float(n)
+    P[:, 1] = i / float(n)
+    P[1:-1, 2:] = D[:, raw_np.newaxis] * Q
+
+    # left eigenvectors
+    Pinv = raw_np.zeros((n + 1, n + 1))
+    Pinv[0, 0] = 1.
+    Pinv[1, n] = 1.
+    Z = Q.T / D[raw_np.newaxis, :]
+    Pinv[2:, 1:-1] = Z
+    if n > 1:
+        Pinv[2:, 0] = Z[:, 0] * rates[1] / interior_d
+        Pinv[2:, n] = Z[:, -1] * rates[n - 1] / interior_d
+
+    return P, d, Pinv
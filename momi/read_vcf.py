@@ -16,12 +16,14 @@ if __name__ == "__main__":
     parser.add_argument("vcf_file", help="VCF file to read")
     parser.add_argument("ind2pop",
                         help="File whose first column is individual ID and second column is population ID")
-    parser.add_argument("out_file", help="Output file to store counts. If ends with .gz, gzip it.")
+    parser.add_argument("out_file", help="Output file to store counts. If ends with .gz, gzip it. If ends with .momi, write a directory in the (faster) binary format.")
     parser.add_argument("--bed", help="Mask file specifying which regions to read. Also used to determine the size of the data in bases. If not provided then user will need to manually specify the length when required. Do NOT use the same BED file across multiple VCFs or the length of those regions will be double-counted!")
     parser.add_argument("--no_aa", action='store_true',
                         help="Ignore AA information entirely; use folded SFS downstream.")
     parser.add_argument("--outgroup", default=None,
                         help="Set this population as outgroup to determine ancestral allele, instead of using the AA info field. Note the outgroup will not appear in the created data (as it always has allele 0).")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Number of processes to read the VCF with. If greater than 1, the regions of the BED (or the contigs of the VCF, if no BED is given) are split across processes. Requires an indexed VCF.")
     parser.add_argument("--verbose", action="store_true")
     parser.add_argument("--info_aa_field", default="AA", help="INFO field to read ancestral allele from. Default is AA. Has no effect if --outgroup or --no_aa are set.")
     args = parser.parse_args()
@@ -42,4 +44,5 @@ if __name__ == "__main__":
     SnpAlleleCounts.read_vcf(
         args.vcf_file, ind2pop, bed_file=args.bed,
         ancestral_alleles=ancestral_alleles,
-        info_aa_field=args.info_aa_field).dump(args.out_file)
+        info_aa_field=args.info_aa_field,
+        processes=args.processes).dump(args.out_file)
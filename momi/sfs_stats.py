@@ -1,6 +1,5 @@
 import collections as co
 import functools as ft
-from cached_property import cached_property
 import autograd.numpy as np
 from .compute_sfs import _expected_sfs_tensor_prod
 
@@ -13,14 +12,34 @@ class SfsStats(object):
     def __init__(self, sampled_n_dict):
         self.sampled_n_dict = {p: n for p, n in sampled_n_dict.items()
                                if n > 0}
+        # cache of tensor_prod()
+        self._tensor_prods = {}
 
     def tensor_prod(self, derived_weights_dict):
+        return self.batch_tensor_prod([derived_weights_dict])[0]
+
+    def batch_tensor_prod(self, derived_weights_dicts):
+        """
+        Returns [tensor_prod(d) for d in derived_weights_dicts],
+        computing the products that are not already cached in a
+        single pass.
+        """
+        keys = [_weights_key(d) for d in derived_weights_dicts]
+        new = co.OrderedDict(
+            (k, d) for k, d in zip(keys, derived_weights_dicts)
+            if k not in self._tensor_prods)
+        if new:
+            self._tensor_prods.update(zip(
+                new.keys(), self._batch_tensor_prod(list(new.values()))))
+        return [self._tensor_prods[k] for k in keys]
+
+    def _batch_tensor_prod(self, derived_weights_dicts):
         raise NotImplementedError
 
     def log(self, x):
         raise NotImplementedError
 
-    @cached_property
+    @property
     def denom(self):
         return self.tensor_prod({})
 
@@ -41,6 +60,12 @@ class SfsStats(object):
             return (self.ordered_prob(subsample_dict)
                     + self.ordered_prob(rev_subsample))
 
+        return (self.tensor_prod(self._ordered_weights(subsample_dict))
+                / self.denom)
+
+    def _ordered_weights(self, subsample_dict):
+        # The derived_weights_dict whose tensor_prod() is the (unnormalized)
+        # ordered probability of subsample_dict.
         derived_weights_dict = {}
         for pop, pop_subsample in subsample_dict.items():
             n = self.sampled_n_dict[pop]
@@ -58,7 +83,7 @@ class SfsStats(object):
 
             derived_weights_dict[pop] = prob
 
-        return self.tensor_prod(derived_weights_dict) / self.denom
+        return derived_weights_dict
 
     def count_1100(self, A, B, C, O=None):
         # O=None -> O is the root population
@@ -209,11 +234,11 @@ class SfsModelFitStats(SfsStats):
         sfs = demo_model._get_sfs()
         if not sampled_n_dict:
             sampled_n_dict = dict(zip(sfs.sampled_pops, sfs.sampled_n))
-        self.sampled_n_dict = sampled_n_dict
+        super(SfsModelFitStats, self).__init__(sampled_n_dict)
 
-        self.empirical = ObservedSfsStats(sfs, self.sampled_n_dict)
+        self.empirical = ObservedSfsStats(sfs, sampled_n_dict)
         self.expected = ExpectedSfsStats(
-            demo_model._get_demo(self.sampled_n_dict), [
+            demo_model._get_demo(sampled_n_dict), [
                 pop for pop, is_asc in zip(sfs.sampled_pops,
                                            sfs.ascertainment_pop)
                 if is_asc])
@@ -238,13 +263,20 @@ class SfsModelFitStats(SfsStats):
 
         :rtype: :class:`JackknifeGoodnessFitStat`
         """
-        exp = self.expected.tensor_prod(derived_weights_dict)
-        emp = self.empirical.tensor_prod(derived_weights_dict)
-
-        exp = exp / self.expected.denom
-        emp = emp / self.empirical.denom
-
-        return JackknifeGoodnessFitStat(exp, emp.est, emp.jackknife)
+        return super(SfsModelFitStats, self).tensor_prod(
+            derived_weights_dict)
+
+    def _batch_tensor_prod(self, derived_weights_dicts):
+        # the last products are the denominators
+        exps = self.expected.batch_tensor_prod(derived_weights_dicts + [{}])
+        emps = self.empirical.batch_tensor_prod(derived_weights_dicts + [{}])
+
+        ret = []
+        for exp, emp in zip(exps[:-1], emps[:-1]):
+            exp = exp / exps[-1]
+            emp = emp / emps[-1]
+            ret.append(JackknifeGoodnessFitStat(exp, emp.est, emp.jackknife))
+        return ret
 
     def log(self, x):
         return x.apply(np.log)
@@ -260,41 +292,54 @@ class SfsModelFitStats(SfsStats):
         :rtype: :class:`pandas.DataFrame`
         """
         pops = list(self.sampled_n_dict.keys())
-
-        df = []
-        for pop1 in pops:
-            for pop2 in pops:
-                if pop1 > pop2:
-                    continue
-                elif pop1 == pop2:
-                    if self.sampled_n_dict[pop1] == 1:
-                        continue
-                    prob = self.ordered_prob({
-                        pop1: [0, 0]}, fold=True)
+        pairs = [(pop1, pop2) for pop1 in pops for pop2 in pops
+                 if pop1 < pop2 or (
+                     pop1 == pop2 and self.sampled_n_dict[pop1] > 1)]
+
+        # ordered_prob(..., fold=True) for all pairs, in a single pass
+        weights = []
+        for pop1, pop2 in pairs:
+            for allele in (0, 1):
+                if pop1 == pop2:
+                    subsample = {pop1: [allele, allele]}
                 else:
-                    prob = self.ordered_prob({
-                        pop1: [0], pop2: [0]}, fold=True)
+                    subsample = {pop1: [allele], pop2: [allele]}
+                weights.append(self._ordered_weights(subsample))
+        prods = self.batch_tensor_prod(weights)
+        probs = [anc + der for anc, der in zip(prods[0::2], prods[1::2])]
 
-                line = [pop1, pop2, prob.expected,
-                        prob.observed, prob.z_score]
-                df.append(line)
+        df = []
+        for (pop1, pop2), prob in zip(pairs, probs):
+            line = [pop1, pop2, prob.expected,
+                    prob.observed, prob.z_score]
+            df.append(line)
 
         return self._pairwise_zscores(df, fig)
 
     def all_f2(self, fig=True):
         pops = [k for k, v in self.sampled_n_dict.items() if v > 1]
+        pairs = [(pop1, pop2) for pop1 in pops for pop2 in pops
+                 if pop1 < pop2]
+
+        # f2(A, B) = baba(A, B, A, B) - abba(A, B, A, B) for all pairs,
+        # in a single pass
+        weights = []
+        for pop1, pop2 in pairs:
+            for subsample in ({pop1: [1, 1], pop2: [0, 0]},
+                              {pop1: [0, 0], pop2: [1, 1]},
+                              {pop1: [1, 0], pop2: [1, 0]},
+                              {pop1: [0, 1], pop2: [0, 1]}):
+                weights.append(self._ordered_weights(subsample))
+        prods = self.batch_tensor_prod(weights)
+        probs = [(baba1 + baba2) - (abba1 + abba2)
+                 for baba1, baba2, abba1, abba2 in zip(
+                     prods[0::4], prods[1::4], prods[2::4], prods[3::4])]
 
         df = []
-        for pop1 in pops:
-            for pop2 in pops:
-                if pop1 >= pop2:
-                    continue
-                else:
-                    prob = self.f2(pop1, pop2)
-
-                line = [pop1, pop2, prob.expected,
-                        prob.observed, prob.z_score]
-                df.append(line)
+        for (pop1, pop2), prob in zip(pairs, probs):
+            line = [pop1, pop2, prob.expected,
+                    prob.observed, prob.z_score]
+            df.append(line)
 
         return self._pairwise_zscores(df, fig)
 
@@ -331,35 +376,38 @@ class ObservedSfsStats(SfsStats):
         self.sfs = sfs
         super(ObservedSfsStats, self).__init__(sampled_n_dict)
 
-    def tensor_prod(self, derived_weights_dict):
-        weighted_counts = self.sfs.configs.count_subsets(derived_weights_dict,
-                                                         self.sampled_n_dict)
-
-        # subtract out weights of monomorphic
-        mono_anc = {}
-        mono_der = {}
-        for pop, asc in zip(self.sfs.sampled_pops, self.sfs.ascertainment_pop):
-            try:
-                v = derived_weights_dict[pop]
-            except KeyError:
+    def _batch_tensor_prod(self, derived_weights_dicts):
+        all_weights = []
+        for derived_weights_dict in derived_weights_dicts:
+            # subtract out weights of monomorphic
+            mono_anc = {}
+            mono_der = {}
+            for pop, asc in zip(self.sfs.sampled_pops,
+                                self.sfs.ascertainment_pop):
                 try:
-                    v = [1] * (self.sampled_n_dict[pop]+1)
+                    v = derived_weights_dict[pop]
                 except KeyError:
-                    continue
-            if asc:
-                mono_anc[pop] = [v[0]] + [0]*(len(v)-1)
-                mono_der[pop] = [0]*(len(v)-1) + [v[-1]]
-            else:
-                mono_anc[pop] = v
-                mono_der[pop] = v
-        mono_anc = self.sfs.configs.count_subsets(
-            mono_anc, self.sampled_n_dict)
-        mono_der = self.sfs.configs.count_subsets(
-            mono_der, self.sampled_n_dict)
+                    try:
+                        v = [1] * (self.sampled_n_dict[pop]+1)
+                    except KeyError:
+                        continue
+                if asc:
+                    mono_anc[pop] = [v[0]] + [0]*(len(v)-1)
+                    mono_der[pop] = [0]*(len(v)-1) + [v[-1]]
+                else:
+                    mono_anc[pop] = v
+                    mono_der[pop] = v
+            all_weights.extend([derived_weights_dict, mono_anc, mono_der])
 
-        return JackknifeStat.from_chunks(
-            self.sfs.freqs_matrix.T.dot(
-                weighted_counts - mono_anc - mono_der))
+        weighted_counts = self.sfs.configs.batch_count_subsets(
+            all_weights, self.sampled_n_dict)
+        weighted_counts = (weighted_counts[:, 0::3]
+                           - weighted_counts[:, 1::3]
+                           - weighted_counts[:, 2::3])
+
+        by_locus = self.sfs.freqs_matrix.T.dot(weighted_counts)
+        return [JackknifeStat.from_chunks(by_locus[:, j])
+                for j in range(len(derived_weights_dicts))]
 
     def log(self, x):
         return x.apply(np.log)
@@ -380,7 +428,7 @@ class ExpectedSfsStats(SfsStats):
         super(ExpectedSfsStats, self).__init__(dict(zip(demo.sampled_pops,
                                                         demo.sampled_n)))
 
-    def tensor_prod(self, derived_weights_dict):
+    def _batch_tensor_prod(self, derived_weights_dicts):
         #sampled_pops, sampled_n = zip(*sorted(self.sampled_n_dict.items()))
         #demo = self.demo._get_multipop_moran(sampled_pops, sampled_n)
         demo = self.demo
@@ -388,29 +436,36 @@ class ExpectedSfsStats(SfsStats):
         vecs = []
         for p, n in zip(demo.sampled_pops, demo.sampled_n):
             v = []
-            try:
-                row = derived_weights_dict[p]
-            except KeyError:
-                row = np.ones(n+1)
-            assert len(row) == n+1
-
-            if p in self.ascertainment_pops:
-                v.append([row[0]] + [0.0] * n)  # all ancestral state
-                v.append([0.0] * n + [row[-1]])  # all derived state
-            else:
-                for _ in range(2):
-                    v.append(row)
-            v.append(row)
+            for derived_weights_dict in derived_weights_dicts:
+                try:
+                    row = derived_weights_dict[p]
+                except KeyError:
+                    row = np.ones(n+1)
+                assert len(row) == n+1
+
+                if p in self.ascertainment_pops:
+                    v.append([row[0]] + [0.0] * n)  # all ancestral state
+                    v.append([0.0] * n + [row[-1]])  # all derived state
+                else:
+                    for _ in range(2):
+                        v.append(row)
+                v.append(row)
 
             vecs.append(np.array(v))
 
-        res = _expected_sfs_tensor_prod(vecs, demo)
-        return res[2] - res[0] - res[1]
+        # one traversal of the demography for all the products
+        res = np.reshape(_expected_sfs_tensor_prod(vecs, demo), (-1, 3))
+        return list(res[:, 2] - res[:, 0] - res[:, 1])
 
     def log(self, x):
         return np.log(x)
 
 
+def _weights_key(derived_weights_dict):
+    return frozenset((p, tuple(np.array(w, dtype=float)))
+                     for p, w in derived_weights_dict.items())
+
+
 class JackknifeGoodnessFitStat(object):
     """
     Object returned by methods of :class:`SfsModelFitStats`.
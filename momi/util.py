@@ -1,6 +1,8 @@
 
+import os
+import tempfile
 import autograd.numpy as np
-from functools import partial, wraps
+from functools import partial, wraps, lru_cache
 #from autograd.core import primitive, Node
 from autograd.extend import primitive, defvjp
 
@@ -60,8 +62,8 @@ def truncate0(x, axis=None, strict=False, tol=1e-13):
         return set0(x, x < 2 * mins)
 
 
-def check_probs_matrix(x):
-    x = truncate0(x)
+def check_probs_matrix(x, **tol_kwargs):
+    x = truncate0(x, **tol_kwargs)
     rowsums = np.sum(x, axis=1)
     assert np.allclose(rowsums, 1.0)
     return np.einsum('ij,i->ij', x, 1.0 / rowsums)
@@ -105,6 +107,71 @@ def memoize(obj):
     return memoizer
 
 
+# directory of the on-disk cache used by disk_memoize(); None to disable
+_cache_dir = None
+_disk_memoized = []
+
+
+def set_cache_dir(dirname):
+    """
+    Store the matrices computed by functions decorated with
+    disk_memoize() (e.g. the eigensystem of the Moran model, and the
+    quasi-inverse of the hypergeometric matrix) in dirname,
+    so they are only computed once across processes and sessions.
+    If dirname is None, the on-disk cache is disabled (the default).
+    """
+    global _cache_dir
+    if dirname is not None:
+        dirname = os.path.expanduser(dirname)
+        os.makedirs(dirname, exist_ok=True)
+    _cache_dir = dirname
+    for fun in _disk_memoized:
+        fun.cache_clear()
+
+
+def disk_memoize(maxsize):
+    """
+    Like functools.lru_cache(maxsize), but the return value (an array
+    or tuple of arrays) is also stored in the directory given to
+    set_cache_dir(). The arguments must be ints.
+    """
+    def decorator(obj):
+        @lru_cache(maxsize=maxsize)
+        @wraps(obj)
+        def memoizer(*args):
+            if _cache_dir is None:
+                return obj(*args)
+
+            fname = os.path.join(_cache_dir, "{}_{}.npz".format(
+                obj.__name__, "_".join(str(int(a)) for a in args)))
+            try:
+                with np.load(fname) as f:
+                    ret = tuple(f["arr_{}".format(i)]
+                                for i in range(len(f.files)))
+            except (IOError, KeyError, ValueError):
+                pass
+            else:
+                if len(ret) == 1:
+                    ret, = ret
+                return ret
+
+            ret = obj(*args)
+            if isinstance(ret, tuple):
+                arrays = ret
+            else:
+                arrays = (ret,)
+            # write to a temporary file first, so that
+            # other processes never read a partial file
+            fd, tmpname = tempfile.mkstemp(dir=_cache_dir, suffix=".npz")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, *arrays)
+            os.replace(tmpname, fname)
+            return ret
+        _disk_memoized.append(memoizer)
+        return memoizer
+    return decorator
+
+
 class memoize_instance(object):
     """cache the return value of a method
 
@@ -54,3 +54,25 @@ def random_tensor(p):
     Adims = list(np.random.permutation([k for k in dims if np.random.uniform() <= p]))
     A = np.random.normal(size=[dims[s] for s in Adims])
     return A, Adims
+
+def test_batched_dot_backends():
+    for I,J,K,L in [(10,2,2,2), (5,6,7,8)]:
+        A = np.random.normal(size=(I,J,K))
+        B = np.random.normal(size=(I,K,L))
+        G = np.random.normal(size=(I,J,L))
+
+        results = []
+        try:
+            for backend in ("parallel", "matmul", "auto"):
+                einsum2.set_batched_dot_backend(backend)
+                results.append((
+                    einsum2.batched_dot(A,B),
+                    autograd.grad(lambda A, B: np.sum(
+                        G * einsum2.batched_dot(A, B)), (0,1))(A, B)))
+        finally:
+            einsum2.set_batched_dot_backend("auto")
+
+        for res, (dA, dB) in results:
+            assert np.allclose(res, A @ B)
+            assert np.allclose(dA, results[0][1][0])
+            assert np.allclose(dB, results[0][1][1])
@@ -25,6 +25,25 @@ def test_combine_loci():
     data.extract_sfs(10).combine_loci()
 
 
+def test_sfs_dump_load(tmp_path):
+    demo = simple_five_pop_demo()
+    data = demo.simulate_data(
+        1000, recoms_per_gen=0, num_replicates=100,
+        muts_per_gen=.1/1000,
+        sampled_n_dict=dict(zip(demo.leafs, [10]*5)))
+    sfs = data.extract_sfs(10)
+
+    for fname in ("sfs.json", "sfs.json.gz", "sfs.momi"):
+        fname = str(tmp_path / fname)
+        sfs.dump(fname)
+        loaded = momi.Sfs.load(fname)
+        assert loaded == sfs
+        assert loaded.n_loci == sfs.n_loci
+        assert np.all(loaded.config_array == sfs.config_array)
+        assert np.allclose(loaded.freqs_matrix.toarray(),
+                           sfs.freqs_matrix.toarray())
+
+
 def test_import_dadi_sfs():
     folded_sfs = "test_dadi_folded_2pop.sfs"
     unfolded_sfs = "test_dadi_unfolded_2pop.sfs"
@@ -75,3 +94,26 @@ def test_import_dadi_sfs():
 #            use_folded_sfs=info["use_folded_sfs"])
 #
 #    assert data._sfs == data2._sfs
+
+
+def test_compressed_allele_counts():
+    rng = np.random.RandomState(0)
+    n_snps, npops = 1000, 3
+    derived = rng.randint(0, 3, size=(n_snps, npops))
+    ancestral = rng.randint(0, 3, size=(n_snps, npops))
+    configs = np.stack([ancestral, derived], axis=2)
+
+    from_iter = CompressedAlleleCounts.from_iter(
+        (c.tolist() for c in configs), npops)
+    from_array = CompressedAlleleCounts.from_array(configs)
+    assert from_iter == from_array
+
+    for compressed in (from_iter, from_array):
+        assert np.all(compressed.config_array[compressed.index2uniq]
+                      == configs)
+        # check against sorting by python tuples
+        a = list(map(tuple, compressed.config_array[:, :, 0]))
+        d = list(map(tuple, compressed.config_array[:, :, 1]))
+        n = list(map(tuple, compressed.config_array.sum(axis=2)))
+        keys = list(zip(n, map(min, zip(a, d))))
+        assert keys == sorted(keys)
@@ -6,7 +6,9 @@ import numpy as np
 import momi
 from momi import expected_sfs_tensor_prod, expected_total_branch_len
 from demo_utils import simple_admixture_demo
-from momi.math_functions import hypergeom_quasi_inverse
+from momi.math_functions import hypergeom_quasi_inverse, hypergeom_mat
+from momi.math_functions import convolve_sum_axes, set_convolution_method
+from momi.util import set_cache_dir
 
 import autograd
 
@@ -63,6 +65,50 @@ def test_hypergeom_pinv_eye():
                        np.eye(i + 1, i + 1))
 
 
+def test_hypergeom_pinv_cache_dir(tmpdir):
+    N, n = 12, 5
+    set_cache_dir(str(tmpdir))
+    try:
+        pinv = hypergeom_quasi_inverse(N, n)
+        assert tmpdir.join("hypergeom_quasi_inverse_12_5.npz").check()
+
+        hypergeom_quasi_inverse.cache_clear()
+        assert np.all(hypergeom_quasi_inverse(N, n) == pinv)
+    finally:
+        set_cache_dir(None)
+    assert np.allclose(np.dot(hypergeom_mat(N, n), pinv), np.eye(n + 1))
+
+
+@pytest.mark.parametrize("Ashape,Bshape", [
+    ((3, 2, 5, 1), (3, 4, 7, 1)),
+    ((2, 3, 9, 10), (2, 2, 4, 10))])
+def test_convolve_sum_axes_methods(Ashape, Bshape):
+    A = np.random.uniform(size=Ashape)
+    B = np.random.uniform(size=Bshape)
+    G = np.random.normal(size=(Ashape[0], Ashape[1], Bshape[1],
+                               Ashape[2] + Bshape[2] - 1))
+
+    C = np.zeros(G.shape)
+    for l in range(Ashape[2]):
+        for m in range(Bshape[2]):
+            C[:, :, :, l+m] += np.einsum("ijn,ikn->ijk",
+                                         A[:, :, l, :], B[:, :, m, :])
+    def f(A, B):
+        return autograd.numpy.sum(G * convolve_sum_axes(A, B))
+
+    try:
+        grads = []
+        for method in ("direct", "blas", "fft", "auto"):
+            set_convolution_method(method)
+            assert np.allclose(convolve_sum_axes(A, B), C)
+            grads.append(autograd.grad(f, (0, 1))(A, B))
+    finally:
+        set_convolution_method("auto")
+    for dA, dB in grads:
+        assert np.allclose(dA, grads[0][0])
+        assert np.allclose(dB, grads[0][1])
+
+
 def test_P():
     t1 = np.random.exponential(.25)
     t2 = np.random.exponential(.25) + t1
@@ -157,3 +157,133 @@ def test_underflow_robustness(folded):
     print("# Relative Error:", "\n", error)
 
     assert max(abs(error)) < .1
+
+
+def test_fit_stats_batch():
+    from demo_utils import simple_five_pop_demo
+    model = simple_five_pop_demo()
+    data = model.simulate_data(
+        length=1000, recoms_per_gen=0, muts_per_gen=1e-3,
+        num_replicates=100, sampled_n_dict={i: 4 for i in range(1, 6)})
+    model.set_data(data.extract_sfs(10))
+
+    stats = momi.SfsModelFitStats(model)
+    f2 = momi.SfsModelFitStats(model).all_f2(fig=False)
+    ibs = momi.SfsModelFitStats(model).all_pairs_ibs(fig=False)
+    assert len(f2) == 10 and len(ibs) == 15
+
+    for _, row in f2.iterrows():
+        x = stats.f2(row["Pop1"], row["Pop2"])
+        assert np.allclose([x.expected, x.observed, x.z_score],
+                           [row["Expected"], row["Observed"], row["Z"]])
+    for _, row in ibs.iterrows():
+        pop1, pop2 = row["Pop1"], row["Pop2"]
+        if pop1 == pop2:
+            x = stats.ordered_prob({pop1: [0, 0]}, fold=True)
+        else:
+            x = stats.ordered_prob({pop1: [0], pop2: [0]}, fold=True)
+        assert np.allclose([x.expected, x.observed, x.z_score],
+                           [row["Expected"], row["Observed"], row["Z"]])
+
+
+@pytest.mark.parametrize("processes", (None, 2))
+def test_optimize_multistart(processes):
+    def build_model():
+        model = momi.DemographicModel(1e4, muts_per_gen=1.25e-8)
+        model.add_time_param("tdiv", 1e4, lower=1e3, upper=1e5)
+        model.add_size_param("N", 1e4, lower=1e3, upper=1e5)
+        model.add_leaf("a", N="N")
+        model.add_leaf("b")
+        model.move_lineages("a", "b", t="tdiv")
+        return model
+
+    data = build_model().simulate_data(
+        length=1e5, recoms_per_gen=1e-8, num_replicates=20,
+        sampled_n_dict={"a": 6, "b": 6})
+    model = build_model()
+    model.set_data(data.extract_sfs(5), length=2e6)
+
+    res = model.optimize_multistart(4, processes=processes)
+    assert list(sorted(res["start"])) == list(range(4))
+    assert np.all(np.diff(res["log_likelihood"]) <= 0)
+    assert np.isclose(model.log_likelihood(), res["log_likelihood"][0])
+    assert np.isclose(model.get_params()["tdiv"], res["tdiv"][0])
+
+    # abandon all starts that fall behind after their first iteration
+    res = model.optimize_multistart(4, processes=processes,
+                                    abandon_tol=0, abandon_after=1)
+    assert set(res["status"]) <= {"converged", "not converged", "abandoned"}
+    assert res["status"][0] != "abandoned"
+    if processes is None:
+        assert list(res["status"]).count("abandoned") > 0
+
+
+@pytest.mark.parametrize("processes", (None, 2))
+def test_bootstrap(processes, tmpdir):
+    def build_model():
+        model = momi.DemographicModel(1e4, muts_per_gen=1.25e-8)
+        model.add_time_param("tdiv", 1e4, lower=1e3, upper=1e5)
+        model.add_size_param("N", 1e4, lower=1e3, upper=1e5)
+        model.add_leaf("a", N="N")
+        model.add_leaf("b")
+        model.move_lineages("a", "b", t="tdiv")
+        return model
+
+    data = build_model().simulate_data(
+        length=1e5, recoms_per_gen=1e-8, num_replicates=20,
+        sampled_n_dict={"a": 6, "b": 6})
+    model = build_model()
+    model.set_data(data.extract_sfs(5), length=2e6)
+    model.optimize()
+    mle = model.get_params()
+
+    res = model.bootstrap(3, seed=123, processes=processes)
+    assert list(res["replicate"]) == [0, 1, 2]
+    assert set(res["status"]) <= {"converged", "not converged"}
+    # the model is left at the full-data MLE
+    assert model.get_params() == mle
+
+    # resuming from a checkpoint gives the same bootstraps
+    checkpoint = str(tmpdir.join("bootstrap.jsonl"))
+    res_part = model.bootstrap(2, seed=123, processes=processes,
+                               checkpoint_file=checkpoint)
+    with open(checkpoint, "a") as f:
+        f.write('{"replicate": 2, "se')
+    res_resumed = model.bootstrap(3, processes=processes,
+                                  checkpoint_file=checkpoint)
+    for col in ["log_likelihood", "tdiv", "N"]:
+        assert np.allclose(res[col], res_resumed[col])
+        assert np.allclose(res[col][:2], res_part[col])
+
+    with pytest.raises(ValueError):
+        model.bootstrap(3, seed=124, checkpoint_file=checkpoint)
+
+
+@pytest.mark.parametrize("processes", (None, 2))
+def test_jackknife(processes):
+    def build_model():
+        model = momi.DemographicModel(1e4, muts_per_gen=1.25e-8)
+        model.add_time_param("tdiv", 1e4, lower=1e3, upper=1e5)
+        model.add_size_param("N", 1e4, lower=1e3, upper=1e5)
+        model.add_leaf("a", N="N")
+        model.add_leaf("b")
+        model.move_lineages("a", "b", t="tdiv")
+        return model
+
+    data = build_model().simulate_data(
+        length=1e5, recoms_per_gen=1e-8, num_replicates=20,
+        sampled_n_dict={"a": 6, "b": 6})
+    model = build_model()
+    model.set_data(data.extract_sfs(5), length=2e6)
+    model.optimize()
+    mle = model.get_params()
+
+    res = model.jackknife(processes=processes)
+    assert list(res["replicate"]) == list(range(5))
+    assert set(res["status"]) <= {"converged", "not converged"}
+    assert model.get_params() == mle
+
+    assert np.all(np.isfinite(res["log_likelihood"]))
+
+    res_first = model.jackknife(replicates=[0], processes=processes)
+    assert np.allclose(res_first["tdiv"], res["tdiv"][0])
@@ -3,7 +3,7 @@ import pytest
 import momi
 import momi.likelihood
 from momi import SfsLikelihoodSurface
-from demo_utils import simple_five_pop_demo
+from demo_utils import simple_five_pop_demo, simple_admixture_demo
 
 import autograd.numpy as np
 from autograd import grad, hessian, hessian_vector_product, jacobian
@@ -71,6 +71,155 @@ def test_batches_grad():
     jac2 = grad(lambda x: momi.likelihood._composite_log_likelihood(sfs, demo_func(*x), mut_rate=1.))(x0)
     assert np.allclose(jac1, jac2)
 
+def test_batches_threads():
+    x0 = np.random.normal(size=7)
+    sampled_n_dict = {"a": 6, "b": 6}
+    demo_func = lambda *x: simple_admixture_demo(np.array(x))._get_demo(
+        sampled_n_dict)
+
+    num_bases = 1000
+    sfs = simple_admixture_demo(x0).simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=500,
+        sampled_n_dict=sampled_n_dict)._sfs
+    assert sfs.n_nonzero_entries > 10
+
+    serial = SfsLikelihoodSurface(sfs, batch_size=5, demo_func=demo_func,
+                                  mut_rate=1.)
+    with SfsLikelihoodSurface(sfs, batch_size=5, demo_func=demo_func,
+                              mut_rate=1., threads=3) as threaded:
+        assert threaded._executor is not None
+        assert np.isclose(serial.log_lik(x0), threaded.log_lik(x0))
+        assert np.allclose(grad(serial.kl_div)(x0),
+                           grad(threaded.kl_div)(x0))
+    assert threaded._executor is None
+
+
+def test_batches_auto():
+    x0 = np.random.normal(size=7)
+    sampled_n_dict = {"a": 6, "b": 6}
+    demo_func = lambda *x: simple_admixture_demo(np.array(x))._get_demo(
+        sampled_n_dict)
+
+    num_bases = 1000
+    sfs = simple_admixture_demo(x0).simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=500,
+        sampled_n_dict=sampled_n_dict)._sfs
+    assert sfs.n_nonzero_entries > 10
+
+    bytes_per_row = momi.compute_sfs._liks_bytes_per_row(demo_func(*x0))
+    assert bytes_per_row > 0
+
+    surface = SfsLikelihoodSurface(sfs, batch_size="auto",
+                                   memory_budget=11 * bytes_per_row,
+                                   demo_func=demo_func, mut_rate=1.)
+    assert surface.sfs_batches is None
+    assert np.isclose(
+        surface.log_lik(x0),
+        SfsLikelihoodSurface(sfs, batch_size=-1, demo_func=demo_func,
+                             mut_rate=1.).log_lik(x0))
+    assert [len(b.configs) for b in surface.sfs_batches[:-1]] == [5] * (
+        len(surface.sfs_batches) - 1)
+
+
+def test_profile():
+    x0 = np.random.normal(size=7)
+    sampled_n_dict = {"a": 6, "b": 6}
+    demo_func = lambda *x: simple_admixture_demo(np.array(x))._get_demo(
+        sampled_n_dict)
+
+    num_bases = 1000
+    sfs = simple_admixture_demo(x0).simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=500,
+        sampled_n_dict=sampled_n_dict)._sfs
+
+    surface = SfsLikelihoodSurface(sfs, batch_size=5, demo_func=demo_func,
+                                   mut_rate=1.)
+    df = surface.profile(x0)
+    n_batches = len(surface.sfs_batches)
+    assert n_batches > 1
+
+    assert set(df.EventType) == {"leaf", "pulse", "merge_clusters",
+                                 "merge_subpops"}
+    assert "convolve_trailing_axes" in set(df.Op)
+    assert "moran_last_axis" in set(df.Op)
+    assert (df.Calls >= n_batches).all()
+    assert (df.Seconds >= 0).all()
+    assert (df.Flops[df.Op != "other"] > 0).all()
+
+    # profiling is opt-in
+    assert momi.compute_sfs._profiler is None
+
+
+def _admixture_demo_func(*x):
+    return simple_admixture_demo(np.array(x))._get_demo({"a": 6, "b": 6})
+
+
+@pytest.mark.parametrize("start_method", ("fork", "spawn"))
+def test_distributed(start_method):
+    x0 = np.random.normal(size=7)
+    num_bases = 1000
+    sfs = simple_admixture_demo(x0).simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=500,
+        sampled_n_dict={"a": 6, "b": 6})._sfs
+    assert sfs.n_nonzero_entries > 10
+
+    serial = SfsLikelihoodSurface(sfs, batch_size=5,
+                                  demo_func=_admixture_demo_func,
+                                  mut_rate=1.)
+    with momi.DistributedSfsLikelihoodSurface(
+            sfs, _admixture_demo_func, processes=3,
+            start_method=start_method, batch_size=5,
+            mut_rate=1.) as distributed:
+        assert len(distributed._workers) == 3
+        # only the workers batch the SFS
+        assert distributed.sfs_batches is None
+        assert distributed._executor is None
+        for x in (x0, np.random.normal(size=7)):
+            assert np.isclose(serial.log_lik(x), distributed.log_lik(x))
+            assert np.allclose(grad(serial.kl_div)(x),
+                               grad(distributed.kl_div)(x))
+
+        assert np.allclose(serial.log_lik(x0, vector=True),
+                           distributed.log_lik(x0, vector=True))
+        g = np.random.normal(size=sfs.n_loci)
+        assert np.allclose(
+            grad(lambda x: np.sum(g * serial.log_lik(x, vector=True)))(x0),
+            grad(lambda x: np.sum(
+                g * distributed.log_lik(x, vector=True)))(x0))
+
+        serial_profile = serial.profile(x0)
+        distributed_profile = distributed.profile(x0)
+        serial_calls = dict(zip(
+            zip(serial_profile["Event"], serial_profile["Op"]),
+            serial_profile["Calls"]))
+        distributed_calls = dict(zip(
+            zip(distributed_profile["Event"], distributed_profile["Op"]),
+            distributed_profile["Calls"]))
+        assert set(serial_calls) == set(distributed_calls)
+        assert all(serial_calls[k] <= distributed_calls[k]
+                   for k in serial_calls)
+
+        with pytest.raises(ValueError):
+            distributed.find_mle(x0, hessp=True)
+
+        assert np.allclose(
+            momi.JackknifeSfsLikelihoodSurface(serial).log_lik(x0),
+            momi.JackknifeSfsLikelihoodSurface(distributed).log_lik(x0))
+    assert not distributed._workers
+
+
 # TODO reenable these tests?
 #def test_batches_jac():
 #    x0 = np.random.normal(size=30)
@@ -137,3 +286,117 @@ def test_batches_grad():
 #    #hess2 = hessian(lambda x: momi.likelihood._composite_log_likelihood(
 #    #    sfs, demo_func(*x), mut_rate=mu))(x0)
 #    assert np.allclose(hess1, hess2)
+
+
+@pytest.mark.parametrize("folded", (True, False))
+def test_sfs_plan(folded):
+    sampled_n_dict = {"a": 4, "b": 3}
+    demo0 = simple_admixture_demo(np.random.normal(size=7))._get_demo(
+        sampled_n_dict)
+    configs = momi.data.configurations.build_full_config_list(
+        demo0.sampled_pops, demo0.sampled_n)
+    plan = momi.compute_sfs.SfsPlan(demo0, configs, folded=folded)
+
+    for _ in range(3):
+        demo = simple_admixture_demo(np.random.normal(size=7))._get_demo(
+            sampled_n_dict)
+        assert plan.is_compatible(demo)
+        assert np.allclose(
+            plan.expected_sfs(demo, normalized=True),
+            momi.expected_sfs(demo, configs, normalized=True,
+                              folded=folded))
+
+    other = simple_admixture_demo()._get_demo({"a": 3, "b": 3})
+    assert not plan.is_compatible(other)
+    with pytest.raises(ValueError):
+        plan.expected_sfs(other)
+
+
+def test_sfs_plan_axis_plan():
+    def demo_func(*x):
+        model = momi.DemographicModel(1.0, .25)
+        for pop in "abcd":
+            model.add_leaf(pop)
+        model.move_lineages("a", "b", t=.1, p=x[0])
+        model.move_lineages("c", "a", t=.2, p=x[1])
+        model.move_lineages("d", "b", t=.3, p=x[2])
+        model.move_lineages("b", "c", t=.4)
+        model.move_lineages("a", "d", t=.5, p=x[3])
+        model.move_lineages("d", "c", t=.6)
+        model.move_lineages("a", "c", t=.7)
+        return model._get_demo(dict(zip("abcd", [3, 2, 3, 2])))
+
+    x = np.array([.1, .2, .3, .4])
+    demo = demo_func(*x)
+    configs = momi.data.configurations.build_full_config_list(
+        demo.sampled_pops, demo.sampled_n)
+    planned = momi.compute_sfs.SfsPlan(demo, configs)
+    unplanned = momi.compute_sfs.SfsPlan(demo, configs, axis_plan=False)
+    assert planned.axis_plan is not None
+    assert unplanned.axis_plan is None
+
+    def sfs_sum(plan):
+        return lambda x: np.sum(plan.expected_sfs(demo_func(*x)))
+
+    assert np.allclose(planned.expected_sfs(demo),
+                       unplanned.expected_sfs(demo))
+    assert np.allclose(grad(sfs_sum(planned))(x),
+                       grad(sfs_sum(unplanned))(x))
+
+
+@pytest.mark.parametrize("use_pairwise_diffs", (False, True))
+def test_jackknife_surface(use_pairwise_diffs):
+    x0 = np.random.normal(size=30)
+    pre_demo_func = lambda *x: simple_five_pop_demo(x=np.array(x))
+    demo = pre_demo_func(*x0)
+
+    sampled_n_dict = dict(zip(demo.leafs, [10]*5))
+    num_bases = 1000
+    sfs = demo.simulate_data(
+        length=num_bases,
+        muts_per_gen=.1/num_bases,
+        recoms_per_gen=0,
+        num_replicates=10,
+        sampled_n_dict=sampled_n_dict)._sfs
+    demo_func = lambda *x: pre_demo_func(*x)._get_demo(sampled_n_dict)
+
+    surface_kwargs = dict(demo_func=demo_func, mut_rate=1., batch_size=20,
+                          use_pairwise_diffs=use_pairwise_diffs)
+    jackknife = momi.JackknifeSfsLikelihoodSurface(
+        SfsLikelihoodSurface(sfs, **surface_kwargs))
+    assert jackknife.n_replicates == sfs.n_loci
+
+    all_liks = jackknife.log_lik(x0)
+    for replicate in (0, 3):
+        replicate_sfs = jackknife.get_replicate(replicate)
+        assert replicate_sfs.n_loci == sfs.n_loci - 1
+        surface = SfsLikelihoodSurface(replicate_sfs, **surface_kwargs)
+
+        assert np.isclose(jackknife.log_lik(x0, replicate),
+                          surface.log_lik(x0))
+        assert np.isclose(all_liks[replicate], surface.log_lik(x0))
+        assert np.isclose(jackknife.kl_div(x0, replicate),
+                          surface.kl_div(x0))
+        assert np.allclose(
+            grad(lambda x: jackknife.kl_div(x, replicate))(x0),
+            grad(surface.kl_div)(x0))
+
+
+def test_integrate_sfs_vector():
+    demo = simple_admixture_demo()
+    sampled_n_dict = dict(zip(demo.leafs, [4]*len(demo.leafs)))
+    sfs = demo.simulate_data(
+        length=1000, muts_per_gen=1e-3, recoms_per_gen=0,
+        num_replicates=20, sampled_n_dict=sampled_n_dict)._sfs
+
+    weights = np.random.normal(size=len(sfs.configs))
+    per_locus = np.array([sfs._integrate_sfs(weights, locus=loc)
+                          for loc in range(sfs.n_loci)])
+    assert np.allclose(sfs._integrate_sfs(weights, vector=True), per_locus)
+
+    # first and second derivatives of the sparse product
+    g = np.random.normal(size=sfs.n_loci)
+    f = lambda w: np.sum(g * sfs._integrate_sfs(w**2, vector=True))
+    freqs_g = sfs.freqs_matrix.dot(g)
+    assert np.allclose(grad(f)(weights), 2 * weights * freqs_g)
+    assert np.allclose(hessian(f)(weights), np.diag(2 * freqs_g))
@@ -1,8 +1,11 @@
 
 import numpy as np
+import scipy.linalg
 import momi.moran_model as moran_model
+from momi.util import set_cache_dir
 import pytest
 from autograd import grad
+import autograd.numpy as anp
 from autograd.numpy import dot
 import numdifftools as nd
 
@@ -19,6 +22,54 @@ def test_rate_matrix():
                             3 * (n - 3) / 2],
                            [0, 0, 0, 0, 0]])
 
+
+@pytest.mark.parametrize("n", (1, 2, 5, 50, 300, 1000))
+def test_moran_eigensystem(n):
+    M = moran_model.rate_matrix(n).toarray()
+    P, d, Pinv = moran_model.moran_eigensystem(n)
+    assert np.allclose(np.dot(P, Pinv), np.eye(n + 1))
+    assert np.allclose(np.dot(P * d, Pinv), M)
+
+    for t in (0.01, 1.0, 10.0):
+        assert np.allclose(moran_model.moran_transition(t, n),
+                           scipy.linalg.expm(t * M))
+
+
+def test_eigensystem_cache_dir(tmpdir):
+    n = 7
+    set_cache_dir(str(tmpdir))
+    try:
+        P, d, Pinv = moran_model.moran_eigensystem(n)
+        assert tmpdir.join("moran_eigensystem_7.npz").check()
+
+        # read back from disk
+        moran_model.moran_eigensystem.cache_clear()
+        P2, d2, Pinv2 = moran_model.moran_eigensystem(n)
+        assert np.all(P == P2) and np.all(d == d2) and np.all(Pinv == Pinv2)
+    finally:
+        set_cache_dir(None)
+
+
+@pytest.mark.parametrize("n,t", ((n, t) for n in (2, 10, 60)
+                                 for t in (0.001, 0.1, 2.0)))
+def test_moran_action_methods(n, t):
+    v = np.random.random((3, n + 1, 2))
+    w = np.random.random((3, n + 1, 2))
+
+    def f(t, v, method):
+        return anp.sum(w * moran_model.moran_action(t, v, axis=1,
+                                                    method=method))
+
+    for argnum in (0, 1):
+        eigen_grad = grad(f, argnum)(t, v, "eigen")
+        expm_grad = grad(f, argnum)(t, v, "expm_multiply")
+        assert np.allclose(eigen_grad, expm_grad)
+    assert np.isclose(f(t, v, "eigen"), f(t, v, "expm_multiply"))
+
+    # second derivative in t
+    assert np.isclose(grad(grad(f))(t, v, "eigen"),
+                      grad(grad(f))(t, v, "expm_multiply"))
+
 # @pytest.mark.parametrize("n,t",
 #         ((n, t) for n in (5, 10, 50, 100, 250)
 #             for t in (0.01, 0.1, 1.0, 10.0, 100.0) if n * t < 100))
@@ -49,3 +49,25 @@ def test_tree_demo_rank1tensor():
 def test_admixture_demo_rank1tensor():
     demo = simple_admixture_demo()
     check_random_tensor(demo._get_demo({"a":4,"b":5}))
+
+
+def test_sfs_tensor_prod_missing_data():
+    sampled_n = [4, 3]
+    # (ancestral, derived) counts; the last 2 configs have missing data
+    configs = [((3, 1), (1, 2)), ((0, 4), (3, 0)), ((2, 1), (0, 3)),
+               ((1, 0), (1, 1))]
+    sfs = momi.site_freq_spectrum(
+        ["a", "b"], [{configs[0]: 2, configs[1]: 1},
+                     {configs[2]: 3, configs[3]: 1}])
+    vecs = [np.random.normal(size=(5, n + 1)) for n in sampled_n]
+
+    expected = 0.
+    for config, count in zip(configs, [2, 1, 3, 1]):
+        val = count
+        for v, n, (a, d) in zip(vecs, sampled_n, config):
+            probs = scipy.stats.hypergeom.pmf(d, n, np.arange(n + 1), a + d)
+            val = val * np.dot(v, probs)
+        expected = expected + val
+
+    assert np.allclose(sfs_tensor_prod(sfs, vecs), expected)
+    assert np.allclose(sfs_tensor_prod(sfs, vecs, chunk_size=3), expected)
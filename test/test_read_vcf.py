@@ -5,6 +5,7 @@ import io
 import vcf
 import collections as co
 import subprocess as sp
+import numpy as np
 
 def test_read_vcf():
     sampled_n_dict = {"a":4,"b":4,"c":6}
@@ -60,3 +61,172 @@ def test_read_vcf_folded():
     assert data._sfs.fold() == data2._sfs.subset_populations(data._sfs.sampled_pops).fold()
 
     # TODO: test that concatenating datasets from multiple vcfs works?
+
+def test_dump_load_binary():
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    theta = 100.0
+    rho = 100.0
+    num_bases = 100000
+
+    demo.simulate_vcf(
+        "test_vcf_binary", recoms_per_gen=rho/num_bases,
+        length=num_bases, muts_per_gen=theta/num_bases,
+        sampled_n_dict=sampled_n_dict, random_seed=1234,
+        force=True)
+
+    data = momi.SnpAlleleCounts.read_vcf(
+        'test_vcf_binary.vcf.gz', ind2pop={f"{pop}_{i}": pop for pop, n in sampled_n_dict.items() for i in range(n)},
+        bed_file="test_vcf_binary.bed")
+
+    data.dump("test_vcf_binary.momi")
+    data2 = momi.SnpAlleleCounts.load("test_vcf_binary.momi")
+
+    assert data == data2
+    assert data.length == data2.length
+    assert data._sfs == data2._sfs
+
+    data.dump("test_vcf_binary.json")
+    data3 = momi.SnpAlleleCounts.load("test_vcf_binary.json")
+    assert data3._sfs == data2._sfs
+
+def test_read_vcf_parallel():
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    theta = 100.0
+    rho = 100.0
+    num_bases = 100000
+
+    demo.simulate_vcf(
+        "test_vcf_parallel", recoms_per_gen=rho/num_bases,
+        length=num_bases, muts_per_gen=theta/num_bases,
+        sampled_n_dict=sampled_n_dict, random_seed=1234,
+        force=True)
+
+    # split the chromosome into several (unequal) regions
+    with open("test_vcf_parallel_split.bed", "w") as bed_f:
+        breaks = [0, 10000, 15000, 40000, 70000, 71000, num_bases]
+        for start, end in zip(breaks[:-1], breaks[1:]):
+            print(1, start, end, sep="\t", file=bed_f)
+
+    ind2pop = {f"{pop}_{i}": pop for pop, n in sampled_n_dict.items() for i in range(n)}
+    serial = momi.SnpAlleleCounts.read_vcf(
+        'test_vcf_parallel.vcf.gz', ind2pop=ind2pop,
+        bed_file="test_vcf_parallel_split.bed")
+    parallel = momi.SnpAlleleCounts.read_vcf(
+        'test_vcf_parallel.vcf.gz', ind2pop=ind2pop,
+        bed_file="test_vcf_parallel_split.bed", processes=3)
+
+    assert serial.length == parallel.length == num_bases
+    assert serial.n_read_snps == parallel.n_read_snps
+    assert list(serial.positions) == list(parallel.positions)
+    assert serial._sfs == parallel._sfs
+
+    # without a BED, shard over the contigs of the index
+    no_bed = momi.SnpAlleleCounts.read_vcf(
+        'test_vcf_parallel.vcf.gz', ind2pop=ind2pop, processes=2)
+    assert no_bed.length is None
+    assert no_bed._sfs == serial._sfs
+
+
+def test_sfs_accumulator():
+    sampled_n_dict = {"a":4,"b":4,"c":6}
+    demo = demo_utils.simple_admixture_3pop()
+    theta = 100.0
+    rho = 100.0
+    num_bases = 100000
+
+    demo.simulate_vcf(
+        "test_vcf_parallel", recoms_per_gen=rho/num_bases,
+        length=num_bases, muts_per_gen=theta/num_bases,
+        sampled_n_dict=sampled_n_dict, random_seed=1234,
+        force=True)
+    ind2pop = {f"{pop}_{i}": pop for pop, n in sampled_n_dict.items() for i in range(n)}
+    data = momi.SnpAlleleCounts.read_vcf(
+        'test_vcf_parallel.vcf.gz', ind2pop=ind2pop,
+        bed_file="test_vcf_parallel.bed")
+
+    # read slices of the VCF into 2 accumulators, then merge them
+    breaks = [0, 10000, 15000, 40000, 70000, 71000, num_bases]
+    regions = [("1", start, end) for start, end in zip(breaks[:-1], breaks[1:])]
+    accumulators = [momi.SfsAccumulator(data.populations) for _ in range(2)]
+    # no SNPs, or only monomorphic SNPs, gives no SFS yet
+    with pytest.raises(ValueError, match="no polymorphic SNPs"):
+        accumulators[0].extract_sfs()
+    monomorphic = momi.SfsAccumulator(data.populations)
+    monomorphic.add_configs(
+        ["1"], [5], [[[2, 0]] * len(data.populations)], length=10)
+    with pytest.raises(ValueError, match="no polymorphic SNPs"):
+        monomorphic.extract_sfs()
+    for i, region in enumerate(regions):
+        accumulators[i % 2].add_vcf('test_vcf_parallel.vcf.gz', ind2pop,
+                                    regions=[region])
+    accumulated, other = accumulators
+    accumulated.merge(other)
+    assert accumulated.length == data.length == num_bases
+    assert accumulated.n_read_snps == data.n_read_snps
+    assert accumulated.extract_sfs() == data._sfs
+
+    # add chunks of configs, split into blocks of 20000 bases
+    configs = data.compressed_counts.config_array[
+        data.compressed_counts.index2uniq]
+    accumulated = momi.SfsAccumulator(data.populations, block_size=20000)
+    for start in range(0, len(configs), 50):
+        end = start + 50
+        accumulated.add_configs(list(data.chrom_ids)[start:end],
+                                data.positions[start:end],
+                                configs[start:end])
+        if start == 0:
+            first = data.filter(np.arange(end))
+            assert accumulated.extract_sfs() == first._sfs
+    sfs = accumulated.extract_sfs()
+    assert accumulated.length is None
+    assert sfs.n_loci == len(set(data.positions // 20000))
+    assert sfs.combine_loci() == data._sfs.combine_loci()
+
+    with pytest.raises(ValueError):
+        accumulated.merge(momi.SfsAccumulator(data.populations))
+
+
+MISSING_VCF = """\
+##fileformat=VCFv4.2
+##contig=<ID=1,length=1000>
+##INFO=<ID=AA,Number=1,Type=String,Description="Ancestral allele">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ta_0\ta_1\tb_0\to_0
+1\t10\t.\tA\tC\t.\tPASS\tAA=C\tGT\t0/1\t0\t./.\t1/1
+1\t20\t.\tA\tG\t.\tPASS\tAA=A\tGT\t1|1\t.\t0/1\t0/0
+1\t30\t.\tA\tT\t.\tPASS\t.\tGT\t0/0\t1\t1/1\t0/1
+1\t40\t.\tA\tC,G\t.\tPASS\tAA=A\tGT\t0/1\t2\t1/2\t0/0
+1\t50\t.\tA\tG\t.\tPASS\tAA=G\tGT\t./1\t0\t0/0\t./.
+"""
+
+
+@pytest.mark.parametrize("ancestral_alleles,positions,configs,n_excluded", [
+    (True, [10, 20, 50],
+     [[[1, 2], [0, 0]], [[0, 2], [1, 1]], [[1, 1], [0, 2]]], 1),
+    (False, [10, 20, 30, 50],
+     [[[2, 1], [0, 0]], [[0, 2], [1, 1]], [[2, 1], [0, 2]],
+      [[1, 1], [2, 0]]], 0),
+    ("o", [10, 20],
+     [[[1, 2], [0, 0]], [[0, 2], [1, 1]]], 2)])
+def test_read_vcf_missing_mixed_ploidy(ancestral_alleles, positions, configs,
+                                       n_excluded):
+    # a_1 is haploid, so the genotypes are padded with missing alleles;
+    # missing and half-missing calls are not counted
+    with open("test_vcf_missing.vcf", "w") as f:
+        f.write(MISSING_VCF)
+
+    ind2pop = {"a_0": "a", "a_1": "a", "b_0": "b"}
+    if ancestral_alleles == "o":
+        ind2pop["o_0"] = "o"
+    data = momi.SnpAlleleCounts.read_vcf(
+        "test_vcf_missing.vcf", ind2pop=ind2pop,
+        ancestral_alleles=ancestral_alleles)
+
+    assert list(data.populations) == ["a", "b"]
+    assert list(data.positions) == positions
+    assert np.all(np.array([data[i] for i in range(len(data))]) == configs)
+    assert data.n_read_snps == len(positions)
+    assert data.n_excluded_snps == n_excluded
+    assert data.use_folded_sfs == (ancestral_alleles is False)
@@ -71,6 +71,35 @@ def test_count_subsets():
                        data.configs.subsample_probs(subconfig))
 
 
+def test_batch_count_subsets():
+    # configs with missing data
+    configs = momi.data.configurations.build_config_list(
+        ["a", "b"], [[[2, 1], [0, 3]], [[1, 1], [2, 2]], [[3, 0], [1, 1]],
+                     [[0, 2], [3, 1]]])
+    total_counts_dict = {"a": 2, "b": 1}
+    derived_weights_dicts = [
+        {"a": np.random.normal(size=3), "b": np.random.normal(size=2)},
+        {"a": np.random.normal(size=3)},
+        {}]
+
+    counts = configs.batch_count_subsets(derived_weights_dicts,
+                                         total_counts_dict)
+    assert counts.shape == (len(configs), len(derived_weights_dicts))
+    for j, derived_weights_dict in enumerate(derived_weights_dicts):
+        expected = np.ones(len(configs))
+        for i, pop in enumerate(configs.sampled_pops):
+            n = total_counts_dict[pop]
+            w = derived_weights_dict.get(pop, np.ones(n+1))
+            expected = expected * sum(
+                w[d] * scipy.special.comb(configs.value[:, i, 0], n-d)
+                * scipy.special.comb(configs.value[:, i, 1], d)
+                for d in range(n+1))
+        assert np.allclose(counts[:, j], expected)
+        assert np.allclose(configs.count_subsets(derived_weights_dict,
+                                                 total_counts_dict),
+                           expected)
+
+
 @pytest.mark.parametrize("folded,n_lins",
                          ((f, n) for f in (True, False) for n in ((2, 3), (0, 3))))
 def test_simple_admixture_subsampling(folded, n_lins):